@@ -54,6 +54,7 @@ def bump_stale_tickets():
 def alerts_loop():
     scheduler.every().day.at("11:00", "UTC").do(check_unresolved_tickets)
     scheduler.every().hour.do(bump_stale_tickets)
+    scheduler.every(10).minutes.do(cache.prune)
     while True:
         scheduler.run_pending()
         time.sleep(30)
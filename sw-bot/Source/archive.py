@@ -0,0 +1,33 @@
+import logging, time
+import schedule
+import db
+from globals import MSG_ARCHIVE_AFTER_DAYS, MSG_ARCHIVE_BATCH
+
+scheduler = schedule.Scheduler()
+
+BATCH_PAUSE_S = 1.0  # between batches, so a big first run doesn't hog the primary
+
+
+def archive_closed_tickets():
+    created = db.ensure_msg_partitions()
+    moved = batches = 0
+    while True:
+        count = db.archive_closed_ticket_msgs(MSG_ARCHIVE_AFTER_DAYS, MSG_ARCHIVE_BATCH)
+        if not count:
+            break
+        moved += count
+        batches += 1
+        time.sleep(BATCH_PAUSE_S)
+    dropped = db.drop_empty_msg_partitions(MSG_ARCHIVE_AFTER_DAYS)
+    logging.info(
+        f"archive: {moved} messages archived in {batches} batch(es), "
+        f"{len(created)} partitions created, {len(dropped)} empty live partitions dropped"
+    )
+
+
+def archive_loop():
+    db.ensure_msg_partitions()
+    scheduler.every().day.at("04:00", "UTC").do(archive_closed_tickets)
+    while True:
+        scheduler.run_pending()
+        time.sleep(60)
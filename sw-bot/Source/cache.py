@@ -1,169 +1,676 @@
-import logging, threading
-from time import monotonic
-import db, worker
+import logging, os, resource, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from time import monotonic, sleep, time
+from slack_sdk.errors import SlackApiError
+import db, db_async, worker
+from globals import client
 
 SHIPWRIGHTS_TTL = 600.0
 DEFAULT_TTL = 7200.0
 BUMP_TTL = 3300.0  # 55 min — just under the hourly poll interval
+TICKET_MISS_TTL = 600.0
+TICKET_MISS_MAX = 5000
+WARM_CLOSED_DAYS = 3
+CLOSED_NOTIFIED_TTL = 300.0
+LIVE_TTL = 86400.0  # ticket_users while db_listener is connected, since outside changes then arrive by NOTIFY
+LOCAL_EDIT_GRACE = 120.0  # how long a resync leaves an entry alone after the bot changed it (its write may be queued)
+PROFILE_TTL = 86400.0  # user_change events update profiles as they happen; this only bounds a missed one
+PROFILE_REFRESH_AFTER = 3600.0  # older profiles are still served, and refreshed in the background
+PROFILE_WARM_PAGE_SIZE = 200
+PROFILE_WARM_MAX_PAGES = 100
+PROFILE_WARM_PAUSE_S = 3.0  # users.list is Tier 2, ~20 calls a minute
+
+MAX_ENTRIES = {
+    "tickets": 5000,
+    "ticket_users": 10000,
+    "feedback": 2000,
+    "metas": 1000,
+    "closed_notified": 2000,
+    "deleted_headers": 2000,
+    "message_links": 20000,
+    "profiles": 20000,
+    "fetch_times": 40000,
+}
+FETCH_PREFIXES = {"ticket_users": "tu:", "feedback": "fb:", "metas": "meta:", "profiles": "pf:"}
+PERSISTED = ("tickets", "ticket_users", "feedback", "metas", "profiles")
+EMPTY_METRICS = {
+    "cached_at": None,
+    "quote_otd": None,
+    "recommendation": None,
+    "bool": None,
+    "paused": False,
+}
+
+
+def current_rss_kb() -> int | None:
+    """Resident set size right now (ru_maxrss is the peak and never comes back down); None off Linux."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") // 1024
 
 
 class Cache:
-    def __init__(self):
+    def __init__(self, max_entries: dict | None = None):
         self._lock = threading.RLock()
+        self.max_entries = {**MAX_ENTRIES, **(max_entries or {})}
+        self.evictions = dict.fromkeys(self.max_entries, 0)
+        self.expirations = 0
         self.bot_user_id: str | None = None
+        self.workspace_url: str | None = None  # from auth.test, for helpers.permalink
         self.sticky_message_ts = None
         self.meta_sticky_ts = None
         self.ticket_users: dict = {}
         self.tickets: dict = {}
+        self.thread_index: dict = {}
+        self.ticket_misses: dict[str, float] = {}
         self.feedback: dict = {}
         self.metas: dict = {}
         self.shipwrights: list = []
         self.ignorable: list = []
-        self.deleted_headers: set = set()
+        self.deleted_headers: dict[str, None] = {}
         self.closed_notified: dict[tuple, float] = {}
+        self.message_links: dict[str, tuple] = {}  # ts -> (ticket_id, linked ts, ts is the origin side)
+        self.profiles: dict[str, dict] = {}  # slack user id -> display name and avatars, from users.info / users.list
+        self._refreshing: set[str] = set()
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="profile-refresh")
         self._bump_candidates: list = []
-        self.metrics: dict = {
-            "cached_at": None,
-            "quote_otd": None,
-            "recommendation": None,
-            "bool": None,
-            "paused": False,
-        }
+        self.metrics: dict = dict(EMPTY_METRICS)
         self.fetch_times: dict[str, float] = {}
+        self._inflight: dict[str, Future] = {}
+        self._dirty: set[tuple] = set()
+        self._local_edits: dict[tuple, float] = {}
+        self.live_invalidation = False
+        self.warm = threading.Event()
+
+    def _load_once(self, key: str, loader):
+        # single-flight: the first caller for a key runs loader() outside the lock,
+        # concurrent callers for the same key wait on its result instead of hitting the db again
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = Future()
+        if not leader:
+            return flight.result()
+        try:
+            flight.set_result(loader())
+        except Exception as e:
+            flight.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return flight.result()
+
+    def _touch(self, store: dict, key):
+        store[key] = store.pop(key)
+
+    def _mark_dirty(self, name: str, key):
+        self._dirty.add((name, key))
+
+    def _ttl(self, name: str) -> float:
+        if name == "profiles":
+            return PROFILE_TTL
+        return LIVE_TTL if name == "ticket_users" and self.live_invalidation else DEFAULT_TTL
+
+    def _fetch_ttl(self, key: str) -> float:
+        for name, prefix in FETCH_PREFIXES.items():
+            if key.startswith(prefix):
+                return self._ttl(name)
+        return DEFAULT_TTL
+
+    def _note_local_edit(self, name: str, key):
+        self._local_edits.pop((name, key), None)
+        self._local_edits[(name, key)] = monotonic()
+
+    def _drop(self, name: str, key):
+        getattr(self, name).pop(key, None)
+        if name in PERSISTED:
+            self._mark_dirty(name, key)
+        if name in FETCH_PREFIXES:
+            self.fetch_times.pop(f"{FETCH_PREFIXES[name]}{key}", None)
+
+    def _trim(self, name: str):
+        # LRU: dicts keep insertion order and hits are moved to the end, so the front is coldest.
+        # Trim 10% below the cap so we don't pay for eviction on every insert once full.
+        store, limit = getattr(self, name), self.max_entries[name]
+        if len(store) <= limit:
+            return
+        excess = len(store) - (limit - limit // 10)
+        for key in list(islice(store, excess)):
+            self._drop(name, key)
+        self.evictions[name] += excess
+
+    def _drop_ticket(self, key):
+        ticket = self.tickets.pop(key, None)
+        if not ticket:
+            return
+        self._mark_dirty("tickets", key)
+        for field in ("staff_thread_ts", "user_thread_ts"):
+            if self.thread_index.get(ticket.get(field)) == key:
+                del self.thread_index[ticket[field]]
+
+    def _trim_tickets(self):
+        limit = self.max_entries["tickets"]
+        if len(self.tickets) <= limit:
+            return
+        excess = len(self.tickets) - (limit - limit // 10)
+        closed = [k for k, t in self.tickets.items() if t.get("status") == "closed"][:excess]
+        victims = closed + list(islice((k for k, t in self.tickets.items() if t.get("status") != "closed"), excess - len(closed)))
+        for key in victims:
+            self._drop_ticket(key)
+        self.evictions["tickets"] += len(victims)
+
+    def prune(self):
+        with self._lock:
+            now = monotonic()
+            expired = 0
+            for name, prefix in FETCH_PREFIXES.items():
+                store = getattr(self, name)
+                ttl = self._ttl(name)
+                for key in [k for k in store if now - self.fetch_times.get(f"{prefix}{k}", 0.0) > ttl]:
+                    self._drop(name, key)
+                    expired += 1
+            for key in [k for k, t in self.closed_notified.items() if now - t > CLOSED_NOTIFIED_TTL]:
+                del self.closed_notified[key]
+                expired += 1
+            for key in [k for k, t in self.ticket_misses.items() if now - t > TICKET_MISS_TTL]:
+                del self.ticket_misses[key]
+                expired += 1
+            for key in [k for k, t in self.fetch_times.items() if now - t > self._fetch_ttl(k)]:
+                del self.fetch_times[key]
+            for key in [k for k, t in self._local_edits.items() if now - t > LOCAL_EDIT_GRACE]:
+                del self._local_edits[key]
+            self.expirations += expired
+            if expired:
+                logging.info(f"cache prune: expired {expired} entries")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sizes": {name: len(getattr(self, name)) for name in self.max_entries},
+                "limits": dict(self.max_entries),
+                "evictions": dict(self.evictions),
+                "expirations": self.expirations,
+                "thread_index": len(self.thread_index),
+                "ticket_misses": len(self.ticket_misses),
+                "rss_kb": current_rss_kb(),
+                "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            }
 
     def can_notify_closed(self, user_id: str, ticket_id, ttl: float = 30.0) -> bool:
         key = (user_id, ticket_id)
         now = monotonic()
-        if now - self.closed_notified.get(key, 0.0) < ttl:
-            return False
-        self.closed_notified[key] = now
-        return True
+        with self._lock:
+            if now - self.closed_notified.get(key, 0.0) < ttl:
+                return False
+            self.closed_notified.pop(key, None)
+            self.closed_notified[key] = now
+            self._trim("closed_notified")
+            return True
+
+    def mark_header_deleted(self, ts) -> bool:
+        with self._lock:
+            if ts in self.deleted_headers:
+                return False
+            self.deleted_headers[ts] = None
+            self._trim("deleted_headers")
+            return True
+
+    def remember_message_link(self, ticket_id, message_ts, origin_message_ts):
+        with self._lock:
+            for ts, linked, is_origin in ((message_ts, origin_message_ts, False), (origin_message_ts, message_ts, True)):
+                if ts:
+                    self.message_links.pop(ts, None)
+                    self.message_links[ts] = (ticket_id, linked, is_origin)
+            self._trim("message_links")
+
+    def _message_link(self, ts):
+        with self._lock:
+            if ts in self.message_links:
+                self._touch(self.message_links, ts)
+                return self.message_links[ts]
+        row = self._load_once(f"link:{ts}", lambda: db.find_message_link(ts))
+        if not row:
+            return None
+        self.remember_message_link(row["ticket_id"], row["message_ts"], row["origin_message_ts"])
+        with self._lock:
+            return self.message_links.get(ts)
+
+    def get_dest_message_ts(self, ts):
+        link = self._message_link(ts)
+        return link[1] if link and link[2] else None
+
+    def get_linked_message_ts(self, ts):
+        link = self._message_link(ts)
+        return link[1] if link else None
+
+    def message_belongs_to_ticket(self, ts, ticket_id) -> bool:
+        link = self._message_link(ts)
+        return bool(link) and str(link[0]) == str(ticket_id)
 
     def is_stale(self, key: str, ttl: float) -> bool:
         return monotonic() - self.fetch_times.get(key, 0.0) > ttl
 
     def mark_fresh(self, key: str):
+        self.fetch_times.pop(key, None)
         self.fetch_times[key] = monotonic()
+        self._trim("fetch_times")
 
     def get_user_opt_in(self, user_id):
+        key = f"tu:{user_id}"
         with self._lock:
-            if user_id in self.ticket_users and not self.is_stale(f"tu:{user_id}", DEFAULT_TTL):
+            if user_id in self.ticket_users and not self.is_stale(key, self._ttl("ticket_users")):
+                self._touch(self.ticket_users, user_id)
                 return self.ticket_users[user_id]
+
+        def load():
             user_data = db.get_ticket_user(user_id)
             if user_data:
-                self.ticket_users[user_data["user_id"]] = user_data["is_opted_in"]
-                self.mark_fresh(f"tu:{user_id}")
-                return self.ticket_users[user_id]
+                return user_data["is_opted_in"]
             worker.enqueue(db.create_ticket_user, user_id)
-            self.ticket_users[user_id] = True
-            self.mark_fresh(f"tu:{user_id}")
             return True
 
+        started = monotonic()
+        opted_in = self._load_once(key, load)
+        with self._lock:
+            if self.fetch_times.get(key, 0.0) > started and user_id in self.ticket_users:
+                return self.ticket_users[user_id]  # modify_user_opt landed while we were loading
+            self._set_user_opt(user_id, opted_in)
+            return opted_in
+
+    async def get_user_opt_in_async(self, user_id):
+        key = f"tu:{user_id}"
+        with self._lock:
+            if user_id in self.ticket_users and not self.is_stale(key, self._ttl("ticket_users")):
+                self._touch(self.ticket_users, user_id)
+                return self.ticket_users[user_id]
+        started = monotonic()
+        user_data = await db_async.get_ticket_user(user_id)
+        if user_data:
+            opted_in = user_data["is_opted_in"]
+        else:
+            worker.enqueue(db.create_ticket_user, user_id)
+            opted_in = True
+        with self._lock:
+            if self.fetch_times.get(key, 0.0) > started and user_id in self.ticket_users:
+                return self.ticket_users[user_id]
+            self._set_user_opt(user_id, opted_in)
+            return opted_in
+
+    def _set_user_opt(self, user_id, state):
+        self.ticket_users.pop(user_id, None)
+        self.ticket_users[user_id] = state
+        self.mark_fresh(f"tu:{user_id}")
+        self._mark_dirty("ticket_users", user_id)
+        self._trim("ticket_users")
+
     def modify_user_opt(self, user_id, state=True):
         with self._lock:
-            self.ticket_users[user_id] = state
-            self.mark_fresh(f"tu:{user_id}")
+            self._set_user_opt(user_id, state)
+            self._note_local_edit("ticket_users", user_id)
         worker.enqueue(db.update_ticket_user_opt, user_id, state)
 
-    def ticket_data_saver(self, ticket_data):
-        self.tickets[ticket_data["id"]] = {
-            "id": ticket_data["id"],
-            "user_id": ticket_data["user_id"],
-            "user_name": ticket_data["user_name"],
-            "question": ticket_data["question"],
-            "user_thread_ts": ticket_data["user_thread_ts"],
-            "staff_thread_ts": ticket_data["staff_thread_ts"],
-            "status": ticket_data["status"],
-            "closed_by": ticket_data["closed_by"],
+    def apply_user_opt_change(self, user_id, opted_in) -> bool:
+        """Opt-in change made outside the bot (db_listener). Uncached users load on demand anyway."""
+        with self._lock:
+            if user_id not in self.ticket_users:
+                return False
+            self._set_user_opt(user_id, opted_in)
+            return True
+
+    @staticmethod
+    def _profile_entry(user: dict) -> dict:
+        profile = user.get("profile", {})
+        return {
+            "display_name": profile.get("display_name") or profile.get("real_name"),
+            "name": user.get("name"),
+            "image_48": profile.get("image_48"),
+            "image_192": profile.get("image_192"),
         }
 
-    def get_ticket_by_id(self, ticket_id):
+    def _store_profile(self, user_id, entry: dict):
+        self.profiles.pop(user_id, None)
+        self.profiles[user_id] = entry
+        self.mark_fresh(f"pf:{user_id}")
+        self._mark_dirty("profiles", user_id)
+        self._trim("profiles")
+
+    def _load_profile(self, user_id) -> dict:
+        key = f"pf:{user_id}"
+        started = monotonic()
+        entry = self._load_once(key, lambda: self._profile_entry(client.users_info(user=user_id)["user"]))
         with self._lock:
-            if ticket_id not in self.tickets:
-                ticket_data = db.get_ticket(ticket_id)
-                if not ticket_data:
-                    return None
+            if self.fetch_times.get(key, 0.0) > started and user_id in self.profiles:
+                return self.profiles[user_id]  # a user_change landed while we were loading
+            self._store_profile(user_id, entry)
+            return entry
+
+    def _background_refresh(self, user_id):
+        try:
+            self._load_profile(user_id)
+        except Exception as e:
+            logging.warning(f"profile refresh for {user_id} failed, keeping the cached one: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(user_id)
+
+    def _refresh_profile(self, user_id):
+        with self._lock:
+            if user_id in self._refreshing:
+                return
+            self._refreshing.add(user_id)
+        self._refresher.submit(self._background_refresh, user_id)
+
+    def get_profile(self, user_id) -> dict:
+        key = f"pf:{user_id}"
+        with self._lock:
+            profile = self.profiles.get(user_id)
+            if profile is not None and not self.is_stale(key, PROFILE_TTL):
+                self._touch(self.profiles, user_id)
+                if self.is_stale(key, PROFILE_REFRESH_AFTER):
+                    self._refresh_profile(user_id)
+                return profile
+        return self._load_profile(user_id)
+
+    def prefetch_profile(self, user_id):
+        """Starts loading a missing or aging profile without waiting; get_profile joins the load if it's still running."""
+        with self._lock:
+            if user_id in self.profiles and not self.is_stale(f"pf:{user_id}", PROFILE_REFRESH_AFTER):
+                return
+        self._refresh_profile(user_id)
+
+    def apply_user_change(self, user: dict) -> bool:
+        """user_change event: the payload is the full user, so cached profiles are replaced rather than dropped."""
+        with self._lock:
+            if user.get("id") not in self.profiles:
+                return False
+            self._store_profile(user["id"], self._profile_entry(user))
+            return True
+
+    def warm_profiles(self):
+        # page users.list for everyone the bot already knows (ticket users, shipwrights), instead of one
+        # users.info per first message after a cold start; the rest of the workspace is skipped
+        self.warm.wait()
+        started = monotonic()
+        with self._lock:
+            wanted = set(self.ticket_users) | set(self.shipwrights) | {t["user_id"] for t in self.tickets.values()}
+            wanted -= {uid for uid in self.profiles if not self.is_stale(f"pf:{uid}", PROFILE_REFRESH_AFTER)}
+        filled = pages = 0
+        cursor = None
+        try:
+            while wanted and pages < PROFILE_WARM_MAX_PAGES:
+                resp = client.users_list(limit=PROFILE_WARM_PAGE_SIZE, cursor=cursor)
+                pages += 1
+                with self._lock:
+                    for user in resp["members"]:
+                        if user["id"] not in wanted:
+                            continue
+                        wanted.discard(user["id"])
+                        if self.fetch_times.get(f"pf:{user['id']}", 0.0) < started:
+                            self._store_profile(user["id"], self._profile_entry(user))
+                            filled += 1
+                cursor = resp.get("response_metadata", {}).get("next_cursor")
+                if not cursor:
+                    break
+                sleep(PROFILE_WARM_PAUSE_S)
+        except SlackApiError as e:
+            logging.error(f"profile warm-up stopped after {pages} page(s): {e}")
+        logging.info(f"profile warm-up: {filled} profiles from {pages} users.list page(s), {len(wanted)} not found")
+
+    def _index_ticket(self, key, ticket):
+        for field in ("staff_thread_ts", "user_thread_ts"):
+            if ticket.get(field):
+                self.thread_index[ticket[field]] = key
+
+    def _remember_ticket_miss(self, ts):
+        self.ticket_misses.pop(ts, None)
+        self.ticket_misses[ts] = monotonic()
+        while len(self.ticket_misses) > TICKET_MISS_MAX:
+            del self.ticket_misses[next(iter(self.ticket_misses))]
+
+    def _is_known_miss(self, ts) -> bool:
+        missed_at = self.ticket_misses.get(ts)
+        if missed_at is None:
+            return False
+        if monotonic() - missed_at > TICKET_MISS_TTL:
+            del self.ticket_misses[ts]
+            return False
+        return True
+
+    def forget_ticket_miss(self, *timestamps):
+        with self._lock:
+            for ts in timestamps:
+                self.ticket_misses.pop(ts, None)
+
+    def ticket_data_saver(self, ticket_data):
+        with self._lock:
+            self.forget_ticket_miss(ticket_data["user_thread_ts"], ticket_data["staff_thread_ts"])
+            self.tickets.pop(ticket_data["id"], None)
+            self.tickets[ticket_data["id"]] = {
+                "id": ticket_data["id"],
+                "user_id": ticket_data["user_id"],
+                "user_name": ticket_data["user_name"],
+                "question": ticket_data["question"],
+                "user_thread_ts": ticket_data["user_thread_ts"],
+                "staff_thread_ts": ticket_data["staff_thread_ts"],
+                "status": ticket_data["status"],
+                "closed_by": ticket_data["closed_by"],
+            }
+            self._index_ticket(ticket_data["id"], self.tickets[ticket_data["id"]])
+            self._mark_dirty("tickets", ticket_data["id"])
+            self._trim_tickets()
+
+    def _save_loaded_ticket(self, ticket_data):
+        # don't clobber an entry that was loaded or mutated in place while we were querying
+        with self._lock:
+            if ticket_data["id"] not in self.tickets:
                 self.ticket_data_saver(ticket_data)
-            return self.tickets.get(ticket_id)
+            return self.tickets.get(ticket_data["id"])
+
+    def warm_up(self):
+        started = monotonic()
+        try:
+            closed = db.get_recently_closed_tickets(WARM_CLOSED_DAYS, self.max_entries["tickets"] // 2)
+            opened = db.get_open_tickets()
+            users = db.get_ticket_users(self.max_entries["ticket_users"])
+            shipwrights = db.get_shipwrights()
+            with self._lock:
+                # closed go in first so they sit at the cold end of the LRU
+                for ticket_data in reversed(closed):
+                    if ticket_data["id"] not in self.tickets:
+                        self.ticket_data_saver(ticket_data)
+                for ticket_data in opened:
+                    if ticket_data["id"] not in self.tickets:
+                        self.ticket_data_saver(ticket_data)
+                for user_id, opted_in in reversed(users):
+                    if self.fetch_times.get(f"tu:{user_id}", 0.0) < started:
+                        self._set_user_opt(user_id, opted_in)
+                if shipwrights:
+                    self.shipwrights = shipwrights
+                    self.mark_fresh("shipwrights")
+            logging.info(f"cache warm-up: {len(opened)} open, {len(closed)} closed tickets, {len(users)} users in {monotonic() - started:.2f}s")
+        except Exception as e:
+            logging.error(f"cache warm-up failed: {e}")
+        finally:
+            self.warm.set()
+
+    def get_ticket_by_id(self, ticket_id):
+        with self._lock:
+            if ticket_id in self.tickets:
+                self._touch(self.tickets, ticket_id)
+                return self.tickets[ticket_id]
+        ticket_data = self._load_once(f"ticket:{ticket_id}", lambda: db.get_ticket(ticket_id))
+        if not ticket_data:
+            return None
+        return self._save_loaded_ticket(ticket_data)
 
     def find_ticket_by_ts(self, ts):
         with self._lock:
-            for ticket in self.tickets.values():
-                if ticket["staff_thread_ts"] == ts or ticket["user_thread_ts"] == ts:
-                    return ticket
-            ticket_data = db.find_ticket(ts)
-            if ticket_data:
-                self.ticket_data_saver(ticket_data)
-                return self.tickets.get(ticket_data["id"])
+            key = self.thread_index.get(ts)
+            if key is not None and key in self.tickets:
+                self._touch(self.tickets, key)
+                return self.tickets[key]
+            if self._is_known_miss(ts):
+                return None
+        ticket_data = self._load_once(f"ts:{ts}", lambda: db.find_ticket(ts))
+        if ticket_data:
+            return self._save_loaded_ticket(ticket_data)
+        with self._lock:
+            key = self.thread_index.get(ts)
+            if key is not None and key in self.tickets:
+                return self.tickets[key]  # ticket was created while we were querying
+            self._remember_ticket_miss(ts)
             return None
 
-    def _load_ticket(self, ticket_id):
-        ticket_data = db.get_ticket(ticket_id)
+    async def find_ticket_by_ts_async(self, ts):
+        with self._lock:
+            key = self.thread_index.get(ts)
+            if key is not None and key in self.tickets:
+                self._touch(self.tickets, key)
+                return self.tickets[key]
+            if self._is_known_miss(ts):
+                return None
+        ticket_data = await db_async.find_ticket(ts)
         if ticket_data:
-            self.ticket_data_saver(ticket_data)
-            return True
-        logging.critical(f"ticket {ticket_id} not found in cache or db")
-        return False
+            return self._save_loaded_ticket(ticket_data)
+        with self._lock:
+            key = self.thread_index.get(ts)
+            if key is not None and key in self.tickets:
+                return self.tickets[key]
+            self._remember_ticket_miss(ts)
+            return None
+
+    def _ensure_ticket(self, ticket_id):
+        ticket = self.get_ticket_by_id(ticket_id)
+        if not ticket:
+            logging.critical(f"ticket {ticket_id} not found in cache or db")
+        return ticket
 
     def open_ticket(self, ticket_id):
+        ticket = self._ensure_ticket(ticket_id)
+        if not ticket:
+            return
         with self._lock:
-            if ticket_id not in self.tickets and not self._load_ticket(ticket_id):
-                return
-            self.tickets[ticket_id]["status"] = "open"
+            ticket["status"] = "open"
+            self._mark_dirty("tickets", ticket["id"])
+            self._note_local_edit("tickets", ticket["id"])
         worker.enqueue(db.open_ticket, ticket_id)
 
     def close_ticket(self, ticket_id):
+        ticket = self._ensure_ticket(ticket_id)
+        if not ticket:
+            return
         with self._lock:
-            if ticket_id not in self.tickets and not self._load_ticket(ticket_id):
-                return
-            self.tickets[ticket_id]["status"] = "closed"
+            ticket["status"] = "closed"
+            self._mark_dirty("tickets", ticket["id"])
+            self._note_local_edit("tickets", ticket["id"])
         worker.enqueue(db.close_ticket, ticket_id)
 
     def is_ticket_claimed(self, ticket_id):
+        ticket = self._ensure_ticket(ticket_id)
+        if not ticket:
+            return None
         with self._lock:
-            if ticket_id not in self.tickets and not self._load_ticket(ticket_id):
-                return None
-            return self.tickets[ticket_id]["closed_by"]
+            return ticket["closed_by"]
 
     def claim_ticket(self, ticket_id, claimer):
+        ticket = self._ensure_ticket(ticket_id)
+        if not ticket:
+            return
         with self._lock:
-            if ticket_id not in self.tickets and not self._load_ticket(ticket_id):
-                return
-            self.tickets[ticket_id]["closed_by"] = claimer
+            ticket["closed_by"] = claimer
+            self._mark_dirty("tickets", ticket["id"])
+            self._note_local_edit("tickets", ticket["id"])
         worker.enqueue(db.claim_ticket, ticket_id, claimer)
         worker.enqueue(db.add_stardust, claimer, ticket_id)
 
+    def apply_ticket_change(self, ticket_id, status, closed_by) -> bool:
+        """Status / claim change made outside the bot (db_listener), applied to the cached ticket in place."""
+        with self._lock:
+            ticket = self.tickets.get(ticket_id)
+            if not ticket:
+                return False
+            reopened_or_closed = ticket["status"] != status
+            ticket["status"] = status
+            ticket["closed_by"] = closed_by
+            self._mark_dirty("tickets", ticket_id)
+        if reopened_or_closed:
+            self.invalidate_bump_cache()
+        return True
+
+    def resync_live_state(self):
+        # db_listener calls this on every (re)connect: anything changed while nobody was listening is caught
+        # here, including staleness from a restored snapshot. Entries the bot changed itself within
+        # LOCAL_EDIT_GRACE are skipped, since their write may still be queued and the db would be behind.
+        with self._lock:
+            ticket_ids = list(self.tickets)
+            user_ids = list(self.ticket_users)
+        tickets = db.get_ticket_states(ticket_ids)
+        users = db.get_ticket_user_states(user_ids)
+        now = monotonic()
+        changed = 0
+        with self._lock:
+            for row in tickets:
+                ticket = self.tickets.get(row["id"])
+                if not ticket or now - self._local_edits.get(("tickets", row["id"]), float("-inf")) < LOCAL_EDIT_GRACE:
+                    continue
+                if (ticket["status"], ticket["closed_by"]) != (row["status"], row["closed_by"]):
+                    self.apply_ticket_change(row["id"], row["status"], row["closed_by"])
+                    changed += 1
+            for user_id, opted_in in users:
+                if now - self._local_edits.get(("ticket_users", user_id), float("-inf")) < LOCAL_EDIT_GRACE:
+                    continue
+                if self.ticket_users.get(user_id, opted_in) != opted_in:
+                    changed += 1
+                self.apply_user_opt_change(user_id, opted_in)
+        logging.info(f"cache resync: {len(tickets)} tickets, {len(users)} users checked, {changed} updated")
+
     def get_shipwrights(self):
         with self._lock:
             if self.shipwrights and not self.is_stale("shipwrights", SHIPWRIGHTS_TTL):
                 return self.shipwrights
-            self.shipwrights = db.get_shipwrights()
+        shipwrights = self._load_once("shipwrights", db.get_shipwrights)
+        with self._lock:
+            self.shipwrights = shipwrights
             self.mark_fresh("shipwrights")
-            return self.shipwrights
+            return shipwrights
 
     def get_feedback(self, ticket_id):
+        key = f"fb:{ticket_id}"
         with self._lock:
-            if ticket_id in self.feedback and not self.is_stale(f"fb:{ticket_id}", DEFAULT_TTL):
+            if ticket_id in self.feedback and not self.is_stale(key, DEFAULT_TTL):
+                self._touch(self.feedback, ticket_id)
                 return self.feedback[ticket_id]
-            feedback_data = db.get_feedback(ticket_id)
+        started = monotonic()
+        feedback_data = self._load_once(key, lambda: db.get_feedback(ticket_id))
+        with self._lock:
+            if self.fetch_times.get(key, 0.0) > started and ticket_id in self.feedback:
+                return self.feedback[ticket_id]  # save_feedback landed while we were loading
             if not feedback_data:
                 return None
+            self.feedback.pop(ticket_id, None)
             self.feedback[ticket_id] = feedback_data
-            self.mark_fresh(f"fb:{ticket_id}")
-            return self.feedback[ticket_id]
+            self.mark_fresh(key)
+            self._mark_dirty("feedback", ticket_id)
+            self._trim("feedback")
+            return feedback_data
 
     def save_feedback(self, ticket_id, rating, comment):
         with self._lock:
             entry = {"rating": int(rating), "comment": comment}
-            if ticket_id in self.feedback:
-                self.feedback[ticket_id].append(entry)
-            else:
-                self.feedback[ticket_id] = [entry]
+            self.feedback[ticket_id] = self.feedback.pop(ticket_id, []) + [entry]
             self.mark_fresh(f"fb:{ticket_id}")
+            self._mark_dirty("feedback", ticket_id)
+            self._trim("feedback")
         worker.enqueue(db.save_feedback, ticket_id, int(rating), comment)
 
     def save_meta(self, text, meta_message_ts, votes_message_ts):
         with self._lock:
+            self.metas.pop(meta_message_ts, None)
             self.metas[meta_message_ts] = {
                 "upvotes": 0,
                 "downvotes": 0,
@@ -172,14 +679,23 @@ class Cache:
                 "voters": {},
             }
             self.mark_fresh(f"meta:{meta_message_ts}")
+            self._mark_dirty("metas", meta_message_ts)
+            self._trim("metas")
         worker.enqueue(db.save_meta, text, meta_message_ts, votes_message_ts)
 
     def get_meta_by_meta_ts(self, meta_message_ts):
+        key = f"meta:{meta_message_ts}"
         with self._lock:
-            if meta_message_ts in self.metas and not self.is_stale(f"meta:{meta_message_ts}", DEFAULT_TTL):
+            if meta_message_ts in self.metas and not self.is_stale(key, DEFAULT_TTL):
+                self._touch(self.metas, meta_message_ts)
+                return self.metas[meta_message_ts]
+        started = monotonic()
+        meta_data = self._load_once(key, lambda: db.find_meta_by_meta_ts(meta_message_ts))
+        with self._lock:
+            if self.fetch_times.get(key, 0.0) > started and meta_message_ts in self.metas:
                 return self.metas[meta_message_ts]
-            meta_data = db.find_meta_by_meta_ts(meta_message_ts)
             if meta_data:
+                self.metas.pop(meta_message_ts, None)
                 self.metas[meta_message_ts] = {
                     "upvotes": meta_data.get("upvotes", 0),
                     "downvotes": meta_data.get("downvotes", 0),
@@ -187,16 +703,18 @@ class Cache:
                     "text": meta_data["text"],
                     "voters": {},
                 }
-                self.mark_fresh(f"meta:{meta_message_ts}")
+                self.mark_fresh(key)
+                self._mark_dirty("metas", meta_message_ts)
+                self._trim("metas")
                 return self.metas[meta_message_ts]
             logging.critical("get_meta_by_meta_ts: meta not found in cache or db")
             return None
 
     def add_vote(self, meta_message_ts, user_id, delta):
+        meta = self.get_meta_by_meta_ts(meta_message_ts)
+        if not meta:
+            return None
         with self._lock:
-            meta = self.get_meta_by_meta_ts(meta_message_ts)
-            if not meta:
-                return None
             previous = meta["voters"].get(user_id)
             if previous == delta:
                 return False
@@ -212,6 +730,7 @@ class Cache:
             meta["voters"][user_id] = delta
             meta["upvotes"] = max(0, meta["upvotes"] + upvote_delta)
             meta["downvotes"] = max(0, meta["downvotes"] + downvote_delta)
+            self._mark_dirty("metas", meta_message_ts)
         worker.enqueue(db.update_meta_votes, meta_message_ts, upvote_delta, downvote_delta)
         return (meta["upvotes"], meta["downvotes"])
 
@@ -220,43 +739,128 @@ class Cache:
         with self._lock:
             if self._bump_candidates and not self.is_stale("bump_candidates", BUMP_TTL):
                 return self._bump_candidates
-            self._bump_candidates = db.get_tickets_due_for_bump()
+        candidates = self._load_once("bump_candidates", db.get_tickets_due_for_bump)
+        with self._lock:
+            self._bump_candidates = candidates
             self.mark_fresh("bump_candidates")
-            return self._bump_candidates
+            return candidates
 
     def invalidate_bump_cache(self):
         with self._lock:
             self._bump_candidates = []
             self.fetch_times.pop("bump_candidates", None)
 
-    def snapshot(self) -> dict:
+    @staticmethod
+    def _copy_entry(name: str, value):
+        if name == "tickets":
+            return dict(value)
+        if name == "feedback":
+            return list(value)
+        if name == "metas":
+            return {**value, "voters": dict(value["voters"])}
+        if name == "profiles":
+            return dict(value)
+        return value
+
+    def _fetched_at(self, keys) -> dict:
+        # monotonic clocks don't survive a restart, so persist fetch times as wall-clock
+        offset = time() - monotonic()
+        return {k: self.fetch_times[k] + offset for k in keys if k in self.fetch_times}
+
+    def _scalars(self) -> dict:
+        return {
+            "shipwrights": list(self.shipwrights),
+            "metrics": dict(self.metrics),
+            "sticky_message_ts": self.sticky_message_ts,
+            "meta_sticky_ts": self.meta_sticky_ts,
+        }
+
+    def _apply_scalars(self, data: dict):
+        self.shipwrights = data.get("shipwrights", self.shipwrights)
+        self.metrics.update(data.get("metrics", {}))
+        self.sticky_message_ts = data.get("sticky_message_ts", self.sticky_message_ts)
+        self.meta_sticky_ts = data.get("meta_sticky_ts", self.meta_sticky_ts)
+
+    def _apply_fetched_at(self, fetched_at: dict):
+        offset = time() - monotonic()
+        for k, wall in fetched_at.items():
+            self.fetch_times[k] = wall - offset
+
+    def snapshot(self) -> tuple[dict, set]:
+        """Returns the full state and the pending delta keys it supersedes; hand those back to
+        requeue_dirty if the snapshot never makes it to disk."""
         with self._lock:
+            dirty, self._dirty = self._dirty, set()
             return {
-                "tickets": dict(self.tickets),
-                "ticket_users": dict(self.ticket_users),
-                "feedback": {k: list(v) for k, v in self.feedback.items()},
-                "metas": {k: {**v, "voters": dict(v["voters"])} for k, v in self.metas.items()},
-                "shipwrights": list(self.shipwrights),
-                "metrics": dict(self.metrics),
-                "sticky_message_ts": self.sticky_message_ts,
-                "meta_sticky_ts": self.meta_sticky_ts,
-                "fetch_times": dict(self.fetch_times),
-            }
+                **{name: {k: self._copy_entry(name, v) for k, v in getattr(self, name).items()} for name in PERSISTED},
+                **self._scalars(),
+                "fetched_at": self._fetched_at(list(self.fetch_times)),
+            }, dirty
+
+    def requeue_dirty(self, keys: set):
+        with self._lock:
+            self._dirty |= keys
+
+    def drain_delta(self) -> dict | None:
+        with self._lock:
+            if not self._dirty:
+                return None
+            dirty, self._dirty = self._dirty, set()
+            changes = []
+            for name, key in dirty:
+                store = getattr(self, name)
+                if key in store:
+                    changes.append(("set", name, key, self._copy_entry(name, store[key])))
+                else:
+                    changes.append(("del", name, key, None))
+            fetch_keys = [f"{FETCH_PREFIXES[name]}{key}" for name, key in dirty if name in FETCH_PREFIXES]
+            return {"changes": changes, "fetched_at": self._fetched_at(fetch_keys), **self._scalars()}
 
     def restore(self, data: dict) -> None:
         with self._lock:
             self.tickets = data.get("tickets", {})
+            self.thread_index = {}
+            for key, ticket in self.tickets.items():
+                self._index_ticket(key, ticket)
             self.ticket_users = data.get("ticket_users", {})
             self.feedback = data.get("feedback", {})
+            self.profiles = data.get("profiles", {})
             self.metas = {
                 k: {**v, "voters": dict(v.get("voters", {}))}
                 for k, v in data.get("metas", {}).items()
             }
-            self.shipwrights = data.get("shipwrights", [])
-            self.metrics.update(data.get("metrics", {}))
-            self.sticky_message_ts = data.get("sticky_message_ts")
-            self.meta_sticky_ts = data.get("meta_sticky_ts")
-            self.fetch_times = data.get("fetch_times", {})
+            self._apply_scalars(data)
+            self.fetch_times = {}
+            self._apply_fetched_at(data.get("fetched_at", {}))
+            for name in ("ticket_users", "feedback", "metas", "profiles", "fetch_times"):
+                self._trim(name)
+            self._trim_tickets()
+            self._dirty = set()
+
+    def clear_persisted(self) -> None:
+        """Undoes whatever restore() / apply_delta() got through before a bad snapshot failed, so the bot starts cold."""
+        with self._lock:
+            self.restore({"shipwrights": [], "sticky_message_ts": None, "meta_sticky_ts": None})
+            self.metrics = dict(EMPTY_METRICS)
+
+    def apply_delta(self, delta: dict) -> None:
+        with self._lock:
+            for op, name, key, value in delta["changes"]:
+                if name == "tickets":
+                    self._drop_ticket(key)
+                    if op == "set":
+                        self.tickets[key] = value
+                        self._index_ticket(key, value)
+                elif op == "set":
+                    getattr(self, name)[key] = value
+                else:
+                    getattr(self, name).pop(key, None)
+            self._apply_scalars(delta)
+            self._apply_fetched_at(delta.get("fetched_at", {}))
+            for name in ("ticket_users", "feedback", "metas", "profiles", "fetch_times"):
+                self._trim(name)
+            self._trim_tickets()
+            self._dirty = set()
 
 
 cache = Cache()
@@ -1,26 +1,120 @@
-import json, logging, os
-from globals import CACHE_SNAPSHOT_PATH
+import contextlib, logging, os, pickle, struct, threading, time
+from globals import CACHE_DELTA_INTERVAL, CACHE_DELTA_PATH, CACHE_SNAPSHOT_INTERVAL, CACHE_SNAPSHOT_PATH
+
+# snapshot file: MAGIC | version (u8) | generation (u64) | pickle
+# delta log:     repeated [generation (u64) | length (u32) | pickle]
+# pickle keeps int ticket ids as ints, which json turned into strings.
+# Deltas only apply on top of the snapshot with the same generation, so a crash between
+# writing a new snapshot and truncating the log can't replay older values over newer ones.
+MAGIC = b"SWCS"
+VERSION = 1
+HEADER = struct.Struct("<4sBQ")
+FRAME = struct.Struct("<QI")
+
+_io_lock = threading.Lock()
+_generation = 0
 
 
 def save(cache) -> None:
-    data = cache.snapshot()
-    tmp = CACHE_SNAPSHOT_PATH + ".tmp"
-    try:
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(data, f)
-        os.replace(tmp, CACHE_SNAPSHOT_PATH)
-    except OSError as e:
-        logging.error(f"cache_store save failed: {e}")
+    global _generation
+    with _io_lock:
+        data, superseded = cache.snapshot()
+        generation = time.time_ns()
+        tmp = CACHE_SNAPSHOT_PATH + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, generation))
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, CACHE_SNAPSHOT_PATH)
+        except Exception as e:  # OSError, or a value pickle can't handle
+            # the old snapshot and its deltas are still current, so those changes go out in the next delta
+            cache.requeue_dirty(superseded)
+            logging.error(f"cache_store save failed: {e}")
+            return
+        _generation = generation
+        try:
+            open(CACHE_DELTA_PATH, "wb").close()
+        except OSError as e:
+            logging.error(f"cache_store: could not truncate the delta log: {e}")  # stale frames are skipped by generation
+
+
+def save_delta(cache) -> None:
+    with _io_lock:
+        if not _generation:
+            return  # no snapshot on disk to apply it to; the next full save picks the changes up
+        delta = cache.drain_delta()
+        if delta is None:
+            return
+        size = None
+        try:
+            payload = pickle.dumps(delta, protocol=pickle.HIGHEST_PROTOCOL)
+            with open(CACHE_DELTA_PATH, "ab") as f:
+                size = f.tell()
+                f.write(FRAME.pack(_generation, len(payload)) + payload)
+        except Exception as e:  # OSError, or a value pickle can't handle
+            cache.requeue_dirty({(name, key) for _, name, key, _ in delta["changes"]})
+            logging.error(f"cache_store delta append failed: {e}")
+            if size is not None:
+                with contextlib.suppress(OSError):
+                    os.truncate(CACHE_DELTA_PATH, size)  # a torn frame would misalign every frame after it
+
+
+def _read_deltas(generation: int):
+    if not os.path.exists(CACHE_DELTA_PATH):
+        return
+    with open(CACHE_DELTA_PATH, "rb") as f:
+        while True:
+            head = f.read(FRAME.size)
+            if len(head) < FRAME.size:
+                return
+            frame_gen, length = FRAME.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length:
+                logging.warning("cache_store: truncated delta record at end of log, ignoring")
+                return
+            if frame_gen == generation:
+                yield pickle.loads(payload)
 
 
 def load(cache) -> None:
+    global _generation
     if not os.path.exists(CACHE_SNAPSHOT_PATH):
         return
     try:
-        with open(CACHE_SNAPSHOT_PATH, encoding="utf-8") as f:
-            data = json.load(f)
-    except (OSError, json.JSONDecodeError) as e:
-        logging.error(f"cache_store load failed: {e}")
+        with open(CACHE_SNAPSHOT_PATH, "rb") as f:
+            head = f.read(HEADER.size)
+            if len(head) < HEADER.size:
+                logging.error("cache_store load failed: snapshot header truncated")
+                return
+            magic, version, generation = HEADER.unpack(head)
+            if magic != MAGIC or version != VERSION:
+                logging.warning(f"cache_store: unsupported snapshot format (magic={magic!r} version={version}), skipping")
+                return
+            data = pickle.load(f)
+        cache.restore(data)
+        applied = 0
+        for delta in _read_deltas(generation):
+            cache.apply_delta(delta)
+            applied += 1
+    except Exception as e:
+        # a corrupt or stale snapshot can fail in pickle or in restore / apply_delta, possibly halfway through
+        logging.error(f"cache_store load failed, starting with an empty cache: {e!r}")
+        cache.clear_persisted()
         return
-    cache.restore(data)
-    logging.info("cache_store: snapshot restored")
+    _generation = generation
+    logging.info(f"cache_store: snapshot restored with {applied} deltas")
+
+
+def snapshot_loop(cache) -> None:
+    save(cache)
+    last_full = time.monotonic()
+    while True:
+        time.sleep(CACHE_DELTA_INTERVAL)
+        try:
+            if time.monotonic() - last_full >= CACHE_SNAPSHOT_INTERVAL:
+                save(cache)
+                last_full = time.monotonic()
+            else:
+                save_delta(cache)
+        except Exception as e:
+            logging.exception(f"cache_store snapshot loop error: {e}")
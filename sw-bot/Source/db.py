@@ -1,24 +1,180 @@
+import functools
 import json
 import logging
 import math
+import threading
 from contextlib import contextmanager
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from time import monotonic, perf_counter
 
 import psycopg2
 import pytz
 from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 
-from globals import DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER, TICKET_PAY
+from globals import (
+    DB_ACQUIRE_TIMEOUT_S, DB_HOST, DB_NAME, DB_PASSWORD, DB_POOL_MAX, DB_POOL_WRITER_RESERVED, DB_PORT,
+    DB_REPLICA_DSN, DB_REPLICA_MAX_LAG_S, DB_REPLICA_POOL_MAX, DB_USER, DB_VALIDATE_IDLE_S, TICKET_PAY,
+)
+from pool_gate import PoolGate, PoolTimeout
+import msg_partitions, query_metrics
 
 connection_pool: pool.ThreadedConnectionPool | None = None
 
+# Sent as application_name on every bot connection; the NOTIFY triggers echo it so db_listener skips our own writes.
+APPLICATION_NAME = "sw-bot"
+
+# The query functions below log and swallow psycopg2 errors, so callers that need to know
+# whether a write actually landed (the worker's retry logic) read the last failure from here.
+_last_error = threading.local()
+
+# Name of the db function running on this thread, set by @retry_dead_conn; get_db reports metrics under it.
+_call_site = threading.local()
+
+# Transient failures worth another attempt. Anything else - integrity and programming errors, or a TypeError /
+# KeyError from bad replayed args - fails the same way every time, so the worker dead-letters it straight away.
+RETRYABLE_ERRORS = (
+    psycopg2.OperationalError,
+    psycopg2.InterfaceError,
+    psycopg2.extensions.TransactionRollbackError,
+    pool.PoolError,
+    PoolTimeout,
+)
+
+
+class CommitOutcomeUnknown(Exception):
+    """COMMIT raised, so the transaction may or may not have landed. Not retryable: running a non-idempotent
+    write (save_message, add_stardust) again could insert it twice."""
+
+
+def take_last_error() -> Exception | None:
+    error = getattr(_last_error, "value", None)
+    _last_error.value = None
+    return error
+
+
+def is_retryable(error: Exception) -> bool:
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+# Connections are only probed with SELECT 1 when they've sat idle past DB_VALIDATE_IDLE_S (0 = every checkout),
+# or were idle when another connection was found dead. Anything else is trusted; if it turns out to be dead
+# the query fails, get_db flags it, and @retry_dead_conn runs the function once more on a fresh connection.
+# Every checkout first passes the gate, so ThreadedConnectionPool never sees more than DB_POOL_MAX borrowers
+# and never raises PoolError; callers queue (FIFO) for up to DB_ACQUIRE_TIMEOUT_S instead.
+_gate = PoolGate(DB_POOL_MAX, DB_POOL_WRITER_RESERVED)
+_role = threading.local()
+
+_last_used: dict[int, float] = {}
+_pool_created = 0.0
+_suspect_before = 0.0
+_rebuild_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_pool_stats = {
+    "checkouts": 0,
+    "in_use": 0,
+    "wait_ms_total": 0.0,
+    "wait_ms_max": 0.0,
+    "validations": 0,
+    "validation_failures": 0,
+    "dead_conn_retries": 0,
+    "rebuilds": 0,
+}
+# pool_stats keys that only ever increase, for /metrics
+POOL_COUNTERS = (
+    "checkouts",
+    "validations",
+    "validation_failures",
+    "dead_conn_retries",
+    "rebuilds",
+    "timeouts",
+    "replica_reads",
+    "replica_stale",
+    "replica_unavailable",
+    "replica_fallbacks",
+)
+
+
+# Reporting functions (@prefer_replica) read from DB_REPLICA_DSN when it is set, has replayed to within
+# DB_REPLICA_MAX_LAG_S of the primary, and has a free connection; otherwise they use the primary as before.
+# A replica that can't be reached is left alone for REPLICA_RETRY_S.
+REPLICA_RETRY_S = 30.0
+REPLICA_LAG_SQL = """
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+           END
+"""
+replica_pool: pool.ThreadedConnectionPool | None = None
+_replica_lock = threading.Lock()
+_replica_down_until = 0.0
+_route = threading.local()
+_replica_stats = {"reads": 0, "stale": 0, "unavailable": 0, "fallbacks": 0, "lag_s": None}
+
+
+def _bump(key: str, n=1):
+    with _stats_lock:
+        _pool_stats[key] += n
+
+
+def mark_writer_thread():
+    """Called by the worker's writer threads so they can use the reserved pool capacity."""
+    _role.writer = True
+
+
+def pool_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_pool_stats)
+    checkouts = stats.pop("checkouts")
+    wait_total = stats.pop("wait_ms_total")
+    return {
+        **stats,
+        "checkouts": checkouts,
+        "avg_wait_ms": round(wait_total / checkouts, 2) if checkouts else 0.0,
+        "wait_ms_max": round(stats["wait_ms_max"], 2),
+        **_gate.stats(),
+        **replica_stats(),
+    }
+
+
+def replica_stats() -> dict:
+    with _stats_lock:
+        stats = {f"replica_{k}": v for k, v in _replica_stats.items()}
+    return {"replica_configured": bool(DB_REPLICA_DSN), **stats}
+
+
+class _TimedCursor:
+    def execute(self, query, vars=None):
+        started = perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            query_metrics.statement(query, vars, perf_counter() - started, self.rowcount)
 
-def init_pool():
-    global connection_pool
-    connection_pool = pool.ThreadedConnectionPool(
+    def executemany(self, query, vars_list):
+        started = perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            query_metrics.statement(query, None, perf_counter() - started, self.rowcount)
+
+
+@functools.cache
+def _timed(cursor_class):
+    return type(f"Timed{cursor_class.__name__}", (_TimedCursor, cursor_class), {})
+
+
+class _TimedConnection(psycopg2.extensions.connection):
+    """Times every statement, whichever cursor_factory the caller asks for."""
+
+    def cursor(self, *args, **kwargs):
+        kwargs["cursor_factory"] = _timed(kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor)
+        return super().cursor(*args, **kwargs)
+
+
+def _new_pool() -> pool.ThreadedConnectionPool:
+    return pool.ThreadedConnectionPool(
         minconn=2,
-        maxconn=10,
+        maxconn=DB_POOL_MAX,
         host=DB_HOST,
         port=DB_PORT,
         user=DB_USER,
@@ -28,53 +184,311 @@ def init_pool():
         keepalives_idle=60,
         keepalives_interval=10,
         keepalives_count=5,
+        application_name=APPLICATION_NAME,
+        connection_factory=_TimedConnection,
     )
 
 
-def _acquire_conn() -> psycopg2.extensions.connection:
-    global connection_pool
+def init_pool():
+    global connection_pool, _pool_created
+    connection_pool = _new_pool()
+    _pool_created = monotonic()
+
+
+def open_listen_conn() -> psycopg2.extensions.connection:
+    """A dedicated autocommit connection outside the pool, for LISTEN."""
+    conn = psycopg2.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        dbname=DB_NAME,
+        keepalives=1,
+        keepalives_idle=60,
+        keepalives_interval=10,
+        keepalives_count=5,
+        application_name=f"{APPLICATION_NAME}-listener",
+    )
+    conn.autocommit = True
+    return conn
+
+
+def _getconn() -> psycopg2.extensions.connection:
+    current = connection_pool
+    conn = current.getconn()
+    conn.origin_pool = current
+    return conn
+
+
+def _put_back(conn, close: bool = False):
+    if getattr(conn, "origin_pool", None) is not connection_pool:
+        # checked out before _rebuild_pool swapped the pool; the new one doesn't know it, and closeall() already closed it
+        _last_used.pop(id(conn), None)
+        if not conn.closed:
+            conn.close()
+        return
+    if close:
+        _last_used.pop(id(conn), None)
+    else:
+        _last_used[id(conn)] = monotonic()
+    connection_pool.putconn(conn, close=close)
+
+
+def _discard(conn):
+    _put_back(conn, close=True)
+
+
+def _rebuild_pool(stale):
+    """Replaces `stale` with a fresh pool. The new pool is built before anything is closed, so while the
+    server is still down this raises and leaves `stale` in place for the next checkout to try again.
+    """
+    global connection_pool, _pool_created
+    with _rebuild_lock:
+        if connection_pool is not stale:
+            return  # another thread already rebuilt it while we waited
+        fresh = _new_pool()
+        _bump("rebuilds")
+        _last_used.clear()
+        connection_pool, _pool_created = fresh, monotonic()
+    try:
+        stale.closeall()
+    except Exception:
+        pass
+
+
+def _replica_unavailable(reason: str):
+    global _replica_down_until
+    _replica_down_until = monotonic() + REPLICA_RETRY_S
+    with _stats_lock:
+        _replica_stats["unavailable"] += 1
+    logging.warning(f"read replica unavailable, using the primary for {REPLICA_RETRY_S:.0f}s: {reason}")
+
+
+def _acquire_replica() -> psycopg2.extensions.connection | None:
+    global replica_pool
+    if not DB_REPLICA_DSN or monotonic() < _replica_down_until:
+        return None
+    conn = None
+    try:
+        with _replica_lock:
+            if replica_pool is None:
+                replica_pool = pool.ThreadedConnectionPool(
+                    minconn=1,
+                    maxconn=DB_REPLICA_POOL_MAX,
+                    dsn=DB_REPLICA_DSN,
+                    keepalives=1,
+                    keepalives_idle=60,
+                    keepalives_interval=10,
+                    keepalives_count=5,
+                    application_name=APPLICATION_NAME,
+                    connection_factory=_TimedConnection,
+                )
+        conn = replica_pool.getconn()
+        # doubles as the liveness check, so replica connections skip _needs_validation
+        with conn.cursor() as cur:
+            cur.execute(REPLICA_LAG_SQL)
+            lag = float(cur.fetchone()[0])
+    except pool.PoolError:
+        return None  # all replica connections busy; reports are rare, so just use the primary
+    except psycopg2.Error as e:
+        if conn is not None:
+            replica_pool.putconn(conn, close=True)
+        _replica_unavailable(str(e).strip())
+        return None
+    with _stats_lock:
+        _replica_stats["lag_s"] = round(lag, 1)
+        if lag > DB_REPLICA_MAX_LAG_S:
+            _replica_stats["stale"] += 1
+    if lag > DB_REPLICA_MAX_LAG_S:
+        _release_replica(conn)
+        return None
+    return conn
+
+
+def _release_replica(conn):
+    bad = bool(conn.closed)
+    if not bad:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            bad = True
+    replica_pool.putconn(conn, close=bad)
+
+
+def _use_replica(conn, caller: str, started: float):
+    try:
+        yield conn
+    except Exception as e:
+        logging.warning(f"{caller} failed on the read replica: {e}")
+        # tells @prefer_replica to run the function again on the primary
+        _route.replica_failed = True
+        _release_replica(conn)
+        query_metrics.end(caller, perf_counter() - started, failed=True)
+        raise
+    _release_replica(conn)
+    with _stats_lock:
+        _replica_stats["reads"] += 1
+    query_metrics.end(caller, perf_counter() - started, failed=False)
+
+
+def _needs_validation(conn) -> bool:
+    last = _last_used.get(id(conn), _pool_created)  # never handed out yet: as old as the pool
+    return monotonic() - last >= DB_VALIDATE_IDLE_S or last < _suspect_before
+
+
+def _checkout() -> psycopg2.extensions.connection:
+    global _suspect_before
     if connection_pool is None:
         init_pool()
+    current = connection_pool
     for attempt in range(3):
-        conn = connection_pool.getconn()
+        conn = _getconn()
         if conn.closed:
-            connection_pool.putconn(conn, close=True)
+            _discard(conn)
             continue
+        if not _needs_validation(conn):
+            return conn
+        _bump("validations")
         try:
             conn.cursor().execute("SELECT 1")
             return conn
         except Exception as e:
             logging.error(f"DB connection validation failed (attempt {attempt + 1}): {e}")
-            connection_pool.putconn(conn, close=True)
-            try:
-                connection_pool.closeall()
-            except Exception:
-                pass
-            init_pool()
-    raise psycopg2.OperationalError("DB connection unavailable after 3 attempts")
+            _bump("validation_failures")
+            _suspect_before = monotonic()
+            _discard(conn)
+    # every connection we were handed was dead: the server most likely restarted
+    _rebuild_pool(current)
+    conn = _getconn()
+    _bump("validations")
+    try:
+        conn.cursor().execute("SELECT 1")
+    except Exception as e:
+        _bump("validation_failures")
+        _discard(conn)
+        raise psycopg2.OperationalError(f"DB connection unavailable after rebuilding the pool: {e}") from e
+    return conn
+
+
+def _acquire_conn() -> psycopg2.extensions.connection:
+    started = monotonic()
+    writer = getattr(_role, "writer", False)
+    _gate.acquire(writer, DB_ACQUIRE_TIMEOUT_S)
+    try:
+        conn = _checkout()
+    except Exception:
+        _gate.release(writer)
+        raise
+    waited = (monotonic() - started) * 1000
+    with _stats_lock:
+        _pool_stats["checkouts"] += 1
+        _pool_stats["in_use"] += 1
+        _pool_stats["wait_ms_total"] += waited
+        _pool_stats["wait_ms_max"] = max(_pool_stats["wait_ms_max"], waited)
+    return conn
 
 
 def _release_conn(conn, *, success: bool) -> None:
+    global _suspect_before
     bad = bool(conn.closed)
-    if not bad:
+    if bad:
+        _suspect_before = monotonic()
+    else:
         try:
             conn.commit() if success else conn.rollback()
         except Exception as e:
             logging.error(f"DB {'commit' if success else 'rollback'} failed: {e}")
+            _last_error.value = CommitOutcomeUnknown(f"commit failed, outcome unknown: {e}") if success else e
             bad = True
-    connection_pool.putconn(conn, close=bad)
+    _bump("in_use", -1)
+    try:
+        _put_back(conn, close=bad)
+    finally:
+        _gate.release(getattr(_role, "writer", False))
 
 
 @contextmanager
-def get_db():
-    conn = _acquire_conn()
+def get_db(name=None):
+    caller = name or getattr(_call_site, "name", None) or "get_db"
+    started = perf_counter()
+    query_metrics.begin(caller)
+    replica = _acquire_replica() if getattr(_route, "replica", False) else None
+    if replica is not None:
+        yield from _use_replica(replica, caller, started)
+        return
+    try:
+        conn = _acquire_conn()
+    except Exception as e:
+        _last_error.value = e
+        query_metrics.end(caller, perf_counter() - started, failed=True)
+        raise
     try:
         yield conn
-        _release_conn(conn, success=True)
     except Exception as e:
         logging.error(f"DB query failed: {e}")
+        _last_error.value = e
+        # the query itself died with the connection, so nothing was committed and it is safe to run again
+        _last_error.dead_conn = bool(conn.closed)
         _release_conn(conn, success=False)
+        query_metrics.end(caller, perf_counter() - started, failed=True)
         raise
+    # outside the try above: if releasing raises, the connection must not be released a second time
+    try:
+        _release_conn(conn, success=True)
+    except Exception:
+        query_metrics.end(caller, perf_counter() - started, failed=True)
+        raise
+    query_metrics.end(caller, perf_counter() - started, failed=False)
+
+
+def retry_dead_conn(fn):
+    """Runs fn once more if its query failed because the pooled connection was dead."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        outer = getattr(_call_site, "name", None)
+        _call_site.name = fn.__name__
+        try:
+            return attempt(*args, **kwargs)
+        finally:
+            _call_site.name = outer
+
+    def attempt(*args, **kwargs):
+        _last_error.dead_conn = False
+        try:
+            result = fn(*args, **kwargs)
+        except psycopg2.Error:
+            if not getattr(_last_error, "dead_conn", False):
+                raise
+        else:
+            if not getattr(_last_error, "dead_conn", False):
+                return result
+        _last_error.dead_conn = False
+        _last_error.value = None
+        _bump("dead_conn_retries")
+        logging.warning(f"{fn.__name__}: connection was dead, retrying once")
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def prefer_replica(fn):
+    """Runs fn against the read replica when one is usable, and again on the primary if that fails."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not DB_REPLICA_DSN:
+            return fn(*args, **kwargs)
+        _route.replica = True
+        _route.replica_failed = False
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            _route.replica = False
+        if not _route.replica_failed:
+            return result
+        _route.replica_failed = False
+        with _stats_lock:
+            _replica_stats["fallbacks"] += 1
+        return fn(*args, **kwargs)
+    return wrapper
 
 
 def format_seconds(seconds):
@@ -107,17 +521,18 @@ def est_day_range_utc(days_back=1):
     )
 
 
-def period_filter(period):
+def period_filter(period, column="closed_at"):
     p = (period or "all").lower()
     if p == "day":
-        return "closed_at >= NOW() - INTERVAL '1 day'"
+        return f"{column} >= NOW() - INTERVAL '1 day'"
     if p == "week":
-        return "closed_at >= NOW() - INTERVAL '7 days'"
+        return f"{column} >= NOW() - INTERVAL '7 days'"
     if p == "month":
-        return "closed_at >= NOW() - INTERVAL '1 month'"
+        return f"{column} >= NOW() - INTERVAL '1 month'"
     return None
 
 
+@retry_dead_conn
 def save_ticket(user_id, user_name, user_avatar, question, user_thread, staff_thread):
     try:
         with get_db() as conn:
@@ -136,6 +551,21 @@ def save_ticket(user_id, user_name, user_avatar, question, user_thread, staff_th
         return None
 
 
+def _message_row(ticket_id, sender_id, sender_name, sender_avatar, msg, is_staff, files=None, message_ts=None, origin_message_ts=None):
+    return (
+        ticket_id,
+        sender_id,
+        sender_name,
+        sender_avatar,
+        msg,
+        json.dumps(files) if files else None,
+        is_staff,
+        message_ts,
+        origin_message_ts,
+    )
+
+
+@retry_dead_conn
 def save_message(ticket_id, sender_id, sender_name, sender_avatar, msg, is_staff, files=None, message_ts=None, origin_message_ts=None):
     try:
         with get_db() as conn:
@@ -146,22 +576,45 @@ def save_message(ticket_id, sender_id, sender_name, sender_avatar, msg, is_staff
                         (ticket_id, sender_id, sender_name, sender_avatar, msg, files, is_staff, message_ts, origin_message_ts)
                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
                     """,
-                    (
-                        ticket_id,
-                        sender_id,
-                        sender_name,
-                        sender_avatar,
-                        msg,
-                        json.dumps(files) if files else None,
-                        is_staff,
-                        message_ts,
-                        origin_message_ts,
-                    ),
+                    _message_row(ticket_id, sender_id, sender_name, sender_avatar, msg, is_staff, files, message_ts, origin_message_ts),
                 )
+                cur.execute("UPDATE tickets SET last_msg_at = NOW() WHERE id = %s", (ticket_id,))
     except psycopg2.Error as e:
         logging.error(f"save_message failed: {e}")
 
 
+@retry_dead_conn
+def save_messages(calls: list[tuple[tuple, dict]]) -> bool:
+    """Inserts a batch of save_message calls in one transaction.
+    Returns False on failure so the worker can fall back to single inserts.
+    """
+    if not calls:
+        return True
+    try:
+        rows = [_message_row(*args, **kwargs) for args, kwargs in calls]
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO ticket_msgs
+                        (ticket_id, sender_id, sender_name, sender_avatar, msg, files, is_staff, message_ts, origin_message_ts)
+                    VALUES %s
+                    """,
+                    rows,
+                    page_size=len(rows),
+                )
+                cur.execute(
+                    "UPDATE tickets SET last_msg_at = NOW() WHERE id = ANY(%s)",
+                    (sorted({row[0] for row in rows}),),
+                )
+        return True
+    except (psycopg2.Error, TypeError) as e:
+        logging.error(f"save_messages failed for batch of {len(calls)}: {e}")
+        return False
+
+
+@retry_dead_conn
 def get_ticket(ticket_id):
     try:
         with get_db() as conn:
@@ -174,6 +627,7 @@ def get_ticket(ticket_id):
         return None
 
 
+@retry_dead_conn
 def find_ticket(thread):
     try:
         with get_db() as conn:
@@ -189,6 +643,53 @@ def find_ticket(thread):
         return None
 
 
+@retry_dead_conn
+def get_open_tickets():
+    try:
+        with get_db() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT * FROM tickets WHERE status = 'open' ORDER BY created_at ASC")
+                return [dict(r) for r in cur.fetchall()]
+    except psycopg2.Error as e:
+        logging.error(f"get_open_tickets failed: {e}")
+        return []
+
+
+@retry_dead_conn
+def get_recently_closed_tickets(days: int, limit: int):
+    try:
+        with get_db() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(
+                    """
+                    SELECT * FROM tickets
+                    WHERE status = 'closed' AND closed_at >= NOW() - make_interval(days => %s)
+                    ORDER BY closed_at DESC
+                    LIMIT %s
+                    """,
+                    (days, limit),
+                )
+                return [dict(r) for r in cur.fetchall()]
+    except psycopg2.Error as e:
+        logging.error(f"get_recently_closed_tickets failed: {e}")
+        return []
+
+
+@retry_dead_conn
+def get_ticket_states(ticket_ids: list) -> list[dict]:
+    if not ticket_ids:
+        return []
+    try:
+        with get_db() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT id, status, closed_by FROM tickets WHERE id = ANY(%s)", (list(ticket_ids),))
+                return [dict(r) for r in cur.fetchall()]
+    except psycopg2.Error as e:
+        logging.error(f"get_ticket_states failed: {e}")
+        return []
+
+
+@retry_dead_conn
 def claim_ticket(ticket_id, closer):
     try:
         with get_db() as conn:
@@ -203,6 +704,7 @@ def claim_ticket(ticket_id, closer):
         return False
 
 
+@retry_dead_conn
 def close_ticket(ticket_id):
     try:
         with get_db() as conn:
@@ -217,6 +719,7 @@ def close_ticket(ticket_id):
         return False
 
 
+@retry_dead_conn
 def open_ticket(ticket_id):
     try:
         with get_db() as conn:
@@ -231,6 +734,7 @@ def open_ticket(ticket_id):
         return False
 
 
+@retry_dead_conn
 def get_ticket_user(user_id):
     try:
         with get_db() as conn:
@@ -243,6 +747,33 @@ def get_ticket_user(user_id):
         return None
 
 
+@retry_dead_conn
+def get_ticket_users(limit: int):
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT user_id, is_opted_in FROM ticket_users ORDER BY id DESC LIMIT %s", (limit,))
+                return cur.fetchall()
+    except psycopg2.Error as e:
+        logging.error(f"get_ticket_users failed: {e}")
+        return []
+
+
+@retry_dead_conn
+def get_ticket_user_states(user_ids: list) -> list[tuple]:
+    if not user_ids:
+        return []
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT user_id, is_opted_in FROM ticket_users WHERE user_id = ANY(%s)", (list(user_ids),))
+                return cur.fetchall()
+    except psycopg2.Error as e:
+        logging.error(f"get_ticket_user_states failed: {e}")
+        return []
+
+
+@retry_dead_conn
 def create_ticket_user(user_id):
     try:
         with get_db() as conn:
@@ -258,6 +789,7 @@ def create_ticket_user(user_id):
         return None
 
 
+@retry_dead_conn
 def update_ticket_user_opt(user_id, state: bool):
     try:
         with get_db() as conn:
@@ -272,40 +804,47 @@ def update_ticket_user_opt(user_id, state: bool):
         return False
 
 
-def add_stardust(slack_id, ticket_id=None, amount=TICKET_PAY):
+def _valid_award(slack_id, amount):
     if not slack_id:
         return None
     try:
         increment = float(amount)
     except (TypeError, ValueError):
         return None
-    if increment <= 0:
-        return None
+    return increment if increment > 0 else None
+
 
+@retry_dead_conn
+def add_stardust_bulk(awards: list[tuple]) -> dict | None:
+    """Applies (slack_id, ticket_id, amount) awards in one transaction: one UPDATE over users for the
+    per-user totals, then one sys_logs row per award. Returns the new balance per slack_id that exists,
+    or None if the transaction failed.
+    """
+    valid = [(slack_id, ticket_id, inc) for slack_id, ticket_id, amount in awards if (inc := _valid_award(slack_id, amount))]
+    if not valid:
+        return {}
+    totals: dict[str, float] = {}
+    for slack_id, _, increment in valid:
+        totals[slack_id] = totals.get(slack_id, 0.0) + increment
     try:
         with get_db() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(
+                users = execute_values(
+                    cur,
                     """
-                    UPDATE users
-                    SET cookie_balance = cookie_balance + %s,
-                        cookies_earned = cookies_earned + %s
-                    WHERE slack_id = %s
-                    RETURNING id, username, role, avatar, cookie_balance
+                    UPDATE users AS u
+                    SET cookie_balance = u.cookie_balance + v.amount,
+                        cookies_earned = u.cookies_earned + v.amount
+                    FROM (VALUES %s) AS v (slack_id, amount)
+                    WHERE u.slack_id = v.slack_id
+                    RETURNING u.id, u.slack_id, u.username, u.role, u.avatar, u.cookie_balance
                     """,
-                    (increment, increment, slack_id),
+                    list(totals.items()),
+                    page_size=len(totals),
+                    fetch=True,
                 )
-                row = cur.fetchone()
-                if not row:
-                    return None
-
-                cur.execute(
-                    """
-                    INSERT INTO sys_logs
-                        (user_id, slack_id, username, role, action, context, status_code,
-                         avatar, target_id, target_type, metadata)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """,
+                by_slack_id = {row["slack_id"]: row for row in users}
+                logs = [
                     (
                         row["id"],
                         slack_id,
@@ -318,33 +857,88 @@ def add_stardust(slack_id, ticket_id=None, amount=TICKET_PAY):
                         str(ticket_id) if ticket_id else None,
                         "ticket" if ticket_id else "user",
                         json.dumps({"source": "sw-bot", "amount": increment, "ticketId": ticket_id}),
-                    ),
-                )
-                return float(row["cookie_balance"]) if row.get("cookie_balance") is not None else 0.0
+                    )
+                    for slack_id, ticket_id, increment in valid
+                    if (row := by_slack_id.get(slack_id))
+                ]
+                if logs:
+                    execute_values(
+                        cur,
+                        """
+                        INSERT INTO sys_logs
+                            (user_id, slack_id, username, role, action, context, status_code,
+                             avatar, target_id, target_type, metadata)
+                        VALUES %s
+                        """,
+                        logs,
+                        page_size=len(logs),
+                    )
+                return {
+                    slack_id: float(row["cookie_balance"]) if row.get("cookie_balance") is not None else 0.0
+                    for slack_id, row in by_slack_id.items()
+                }
     except psycopg2.Error as e:
-        logging.error(f"add_stardust failed: {e}")
+        logging.error(f"add_stardust_bulk failed for {len(valid)} award(s): {e}")
         return None
 
 
+def add_stardust(slack_id, ticket_id=None, amount=TICKET_PAY):
+    if not _valid_award(slack_id, amount):
+        return None
+    return (add_stardust_bulk([(slack_id, ticket_id, amount)]) or {}).get(slack_id)
+
+
+# Lookups by ts are pinned to the one live partition ticket_msg_routes names for the ts (migrations/005). The route
+# is read inside the statement, so Postgres prunes at run time and the lookup stays a single round trip. Routes are
+# first-wins: a ts that is message_ts on one row and origin_message_ts on another can sit in a partition its route
+# doesn't name. So when the pinned read finds nothing, the same statement reads every partition's ts indexes.
+_MSG_ROUTE = "NOT archived AND created_at = (SELECT created_at FROM ticket_msg_routes WHERE ts = {ts})"
+
+
+def _msg_lookup_sql(columns: str, condition: str, ts: str = "%(ts)s", tail: str = "") -> str:
+    """SELECT columns FROM ticket_msgs WHERE condition, routed by `ts` (a placeholder, so db_async can pass $1)."""
+    return f"""
+        WITH pinned AS (
+            SELECT {columns} FROM ticket_msgs WHERE {_MSG_ROUTE.format(ts=ts)} AND {condition}
+        )
+        SELECT * FROM (
+            SELECT * FROM pinned
+            UNION ALL
+            SELECT {columns} FROM ticket_msgs WHERE {condition} AND NOT EXISTS (SELECT 1 FROM pinned)
+        ) m {tail}
+    """
+
+
+@retry_dead_conn
 def edit_message(message_ts, new_text):
     try:
         with get_db() as conn:
             with conn.cursor() as cur:
                 cur.execute(
-                    "UPDATE ticket_msgs SET msg = %s WHERE message_ts = %s",
-                    (new_text, message_ts),
+                    f"""
+                    WITH pinned AS (
+                        UPDATE ticket_msgs SET msg = %(msg)s
+                        WHERE {_MSG_ROUTE.format(ts="%(ts)s")} AND message_ts = %(ts)s
+                        RETURNING 1
+                    )
+                    UPDATE ticket_msgs SET msg = %(msg)s
+                    WHERE message_ts = %(ts)s AND NOT EXISTS (SELECT 1 FROM pinned)
+                    """,
+                    {"msg": new_text, "ts": message_ts},
                 )
     except psycopg2.Error as e:
         logging.error(f"edit_message failed: {e}")
 
 
+@retry_dead_conn
 def message_belongs_to_ticket(message_ts: str, ticket_id: int) -> bool:
     try:
         with get_db() as conn:
             with conn.cursor() as cur:
                 cur.execute(
-                    "SELECT 1 FROM ticket_msgs WHERE (message_ts = %s OR origin_message_ts = %s) AND ticket_id = %s",
-                    (message_ts, message_ts, ticket_id),
+                    _msg_lookup_sql("ticket_id", "(message_ts = %(ts)s OR origin_message_ts = %(ts)s) AND ticket_id = %(ticket_id)s",
+                                    tail="LIMIT 1"),
+                    {"ts": message_ts, "ticket_id": ticket_id},
                 )
                 return cur.fetchone() is not None
     except psycopg2.Error as e:
@@ -352,14 +946,12 @@ def message_belongs_to_ticket(message_ts: str, ticket_id: int) -> bool:
         return False
 
 
+@retry_dead_conn
 def get_dest_message_ts(message_ts):
     try:
         with get_db() as conn:
             with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT message_ts FROM ticket_msgs WHERE origin_message_ts = %s",
-                    (message_ts,),
-                )
+                cur.execute(_msg_lookup_sql("message_ts", "origin_message_ts = %(ts)s", tail="LIMIT 1"), {"ts": message_ts})
                 row = cur.fetchone()
                 return row[0] if row else None
     except psycopg2.Error as e:
@@ -368,22 +960,94 @@ def get_dest_message_ts(message_ts):
 
 
 def get_linked_message_ts(ts):
+    link = find_message_link(ts)
+    if link is None:
+        return None
+    return link["message_ts"] if link["origin_message_ts"] == ts else link["origin_message_ts"]
+
+
+@retry_dead_conn
+def find_message_link(ts):
+    """The ticket_msgs row where ts is either side of a relayed pair, preferring the origin side."""
     try:
         with get_db() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT message_ts FROM ticket_msgs WHERE origin_message_ts = %s", (ts,))
-                row = cur.fetchone()
-                if row:
-                    return row[0]
-                cur.execute("SELECT origin_message_ts FROM ticket_msgs WHERE message_ts = %s", (ts,))
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(
+                    _msg_lookup_sql(
+                        "ticket_id, message_ts, origin_message_ts",
+                        "(origin_message_ts = %(ts)s OR message_ts = %(ts)s)",
+                        tail="ORDER BY (origin_message_ts IS NOT DISTINCT FROM %(ts)s) DESC LIMIT 1",
+                    ),
+                    {"ts": ts},
+                )
                 row = cur.fetchone()
-                return row[0] if row else None
+                return dict(row) if row else None
+    except psycopg2.Error as e:
+        logging.error(f"find_message_link failed: {e}")
+        return None
+
+
+@retry_dead_conn
+def ensure_msg_partitions() -> list[str]:
+    """Creates this month's and the next msg_partitions.MONTHS_AHEAD months' ticket_msgs partitions if missing."""
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                today = date.today()
+                return msg_partitions.ensure(cur, today, today)
+    except psycopg2.Error as e:
+        logging.error(f"ensure_msg_partitions failed: {e}")
+        return []
+
+
+@retry_dead_conn
+def archive_closed_ticket_msgs(days: int, batch: int) -> int | None:
+    """Moves the live messages of up to `batch` tickets closed more than `days` ago into the archive tier
+    and drops their routes. Returns the number of messages moved (0 when nothing is left), None on failure.
+    """
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    WITH due AS (
+                        SELECT DISTINCT m.ticket_id
+                        FROM {msg_partitions.LIVE} m
+                        JOIN tickets t ON t.id = m.ticket_id
+                        WHERE t.status = 'closed' AND t.closed_at < NOW() - make_interval(days => %s)
+                        LIMIT %s
+                    ), moved AS (
+                        UPDATE ticket_msgs SET archived = TRUE
+                        WHERE NOT archived AND ticket_id IN (SELECT ticket_id FROM due)
+                        RETURNING message_ts, origin_message_ts
+                    ), unrouted AS (
+                        DELETE FROM ticket_msg_routes
+                        WHERE ts IN (SELECT message_ts FROM moved UNION ALL SELECT origin_message_ts FROM moved)
+                    )
+                    SELECT COUNT(*) FROM moved
+                    """,
+                    (days, batch),
+                )
+                return cur.fetchone()[0]
     except psycopg2.Error as e:
-        logging.error(f"get_linked_message_ts failed: {e}")
+        logging.error(f"archive_closed_ticket_msgs failed: {e}")
         return None
 
 
+@retry_dead_conn
+def drop_empty_msg_partitions(days: int) -> list[str]:
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                cutoff = date.today() - timedelta(days=days)
+                return msg_partitions.drop_empty_live(cur, cutoff.replace(day=1))
+    except psycopg2.Error as e:
+        logging.error(f"drop_empty_msg_partitions failed: {e}")
+        return []
 
+
+@prefer_replica
+@retry_dead_conn
 def get_monthly_feedback_winners(year: int, month: int, count: int = 3) -> list[dict]:
     try:
         with get_db() as conn:
@@ -412,6 +1076,7 @@ def get_monthly_feedback_winners(year: int, month: int, count: int = 3) -> list[
         return []
 
 
+@retry_dead_conn
 def save_feedback(ticket_id, rating, comment):
     try:
         with get_db() as conn:
@@ -427,6 +1092,7 @@ def save_feedback(ticket_id, rating, comment):
         return None
 
 
+@retry_dead_conn
 def get_feedback(ticket_id):
     try:
         with get_db() as conn:
@@ -441,6 +1107,7 @@ def get_feedback(ticket_id):
         return []
 
 
+@retry_dead_conn
 def get_shipwrights():
     try:
         with get_db() as conn:
@@ -454,13 +1121,15 @@ def get_shipwrights():
 
 
 
+@prefer_replica
+@retry_dead_conn
 def avg_close_time(period="all"):
     try:
         with get_db() as conn:
             with conn.cursor() as cur:
-                where = period_filter(period)
-                base = "SELECT AVG(EXTRACT(EPOCH FROM (closed_at - created_at))) FROM tickets WHERE status = 'closed' AND closed_at IS NOT NULL"
-                sql = f"{base} AND {where}" if where else base
+                where = period_filter(period, column="hour")
+                base = "SELECT SUM(close_seconds) / NULLIF(SUM(closed), 0) FROM ticket_hourly_stats"
+                sql = f"{base} WHERE {where}" if where else base
                 cur.execute(sql)
                 row = cur.fetchone()
                 avg_seconds = None
@@ -475,22 +1144,25 @@ def avg_close_time(period="all"):
         return "N/A"
 
 
+@prefer_replica
+@retry_dead_conn
 def count_tickets(status="all"):
     try:
         with get_db() as conn:
             with conn.cursor() as cur:
                 s = (status or "all").lower()
-                if s == "all":
-                    cur.execute("SELECT COUNT(*) FROM tickets")
-                elif s in ("open", "closed"):
-                    cur.execute("SELECT COUNT(*) FROM tickets WHERE status = %s", (s,))
-                row = cur.fetchone()
-                return int(row[0] or 0)
+                if s not in ("all", "open", "closed"):
+                    return 0
+                cur.execute("SELECT COALESCE(SUM(opened), 0), COALESCE(SUM(closed), 0) FROM ticket_hourly_stats")
+                opened, closed = cur.fetchone()
+                return int({"all": opened, "open": opened - closed, "closed": closed}[s])
     except psycopg2.Error as e:
         logging.error(f"count_tickets failed: {e}")
         return 0
 
 
+@prefer_replica
+@retry_dead_conn
 def get_unresolved_tickets_past_24h():
     try:
         with get_db() as conn:
@@ -504,6 +1176,7 @@ def get_unresolved_tickets_past_24h():
         return []
 
 
+@retry_dead_conn
 def get_tickets_due_for_bump():
     """Returns open tickets that are due for a bump:
     - Never bumped and older than 24h, OR
@@ -529,6 +1202,7 @@ def get_tickets_due_for_bump():
         return []
 
 
+@retry_dead_conn
 def mark_ticket_bumped(ticket_id: int) -> bool:
     try:
         with get_db() as conn:
@@ -543,42 +1217,40 @@ def mark_ticket_bumped(ticket_id: int) -> bool:
         return False
 
 
+@prefer_replica
+@retry_dead_conn
 def get_daily_ticket_stats():
     try:
         with get_db() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("SELECT COUNT(*) AS count FROM tickets WHERE created_at >= NOW() - INTERVAL '1 day'")
-                opened_24h = cur.fetchone()["count"]
-
-                cur.execute(
-                    "SELECT COUNT(*) AS count FROM tickets WHERE status = 'closed' AND closed_at >= NOW() - INTERVAL '1 day'"
-                )
-                closed_24h = cur.fetchone()["count"]
-
-                cur.execute("SELECT COUNT(*) AS count FROM tickets WHERE status = 'open'")
-                total_open = cur.fetchone()["count"]
-
+                # one pass over the rollup: all-time totals plus the last 24h, per closer
                 cur.execute(
                     """
-                    SELECT closed_by AS slack_id, COUNT(*) AS count
-                    FROM tickets
-                    WHERE status = 'closed'
-                      AND closed_at >= NOW() - INTERVAL '1 day'
-                      AND closed_by IS NOT NULL
+                    SELECT closed_by,
+                           SUM(opened) AS opened,
+                           SUM(closed) AS closed,
+                           COALESCE(SUM(opened) FILTER (WHERE hour >= date_trunc('hour', NOW() - INTERVAL '1 day')), 0) AS opened_24h,
+                           COALESCE(SUM(closed) FILTER (WHERE hour >= date_trunc('hour', NOW() - INTERVAL '1 day')), 0) AS closed_24h
+                    FROM ticket_hourly_stats
                     GROUP BY closed_by
-                    ORDER BY count DESC
-                    LIMIT 3
                     """
                 )
-                leaderboard = [dict(r) for r in cur.fetchall()]
+                rows = cur.fetchall()
+                opened_24h = sum(r["opened_24h"] for r in rows)
+                closed_24h = sum(r["closed_24h"] for r in rows)
+                total_open = sum(r["opened"] for r in rows) - sum(r["closed"] for r in rows)
+                leaderboard = sorted(
+                    ({"slack_id": r["closed_by"], "count": r["closed_24h"]} for r in rows if r["closed_by"] and r["closed_24h"] > 0),
+                    key=lambda r: r["count"],
+                    reverse=True,
+                )[:3]
 
                 cur.execute(
                     """
-                    SELECT t.id, t.user_id, t.question, t.staff_thread_ts, t.created_at,
-                           (SELECT MAX(created_at) FROM ticket_msgs WHERE ticket_id = t.id) AS last_reply
-                    FROM tickets t
-                    WHERE t.status = 'open' AND t.created_at <= NOW() - INTERVAL '1 day'
-                    ORDER BY t.created_at ASC
+                    SELECT id, user_id, question, staff_thread_ts, created_at, last_msg_at AS last_reply
+                    FROM tickets
+                    WHERE status = 'open' AND created_at <= NOW() - INTERVAL '1 day'
+                    ORDER BY created_at ASC
                     LIMIT 11
                     """
                 )
@@ -598,6 +1270,7 @@ def get_daily_ticket_stats():
 
 
 
+@retry_dead_conn
 def save_meta(text, meta_message_ts=None, votes_message_ts=None):
     try:
         with get_db() as conn:
@@ -613,6 +1286,7 @@ def save_meta(text, meta_message_ts=None, votes_message_ts=None):
         return None
 
 
+@retry_dead_conn
 def update_meta_votes(meta_message_ts, upvote_delta, downvote_delta):
     try:
         with get_db() as conn:
@@ -628,6 +1302,7 @@ def update_meta_votes(meta_message_ts, upvote_delta, downvote_delta):
         return (None, None)
 
 
+@retry_dead_conn
 def find_meta_by_meta_ts(meta_message_ts):
     try:
         with get_db() as conn:
@@ -766,6 +1441,7 @@ def find_meta_by_meta_ts(meta_message_ts):
 #         return {"slack_ids": [], "counts": []}
 
 
+@retry_dead_conn
 def mark_feedback_requested(ticket_id) -> bool:
     try:
         with get_db() as conn:
@@ -780,6 +1456,7 @@ def mark_feedback_requested(ticket_id) -> bool:
         return False
 
 
+@retry_dead_conn
 def save_resolve_message_ts(ticket_id, ts):
     try:
         with get_db() as conn:
@@ -792,6 +1469,7 @@ def save_resolve_message_ts(ticket_id, ts):
         logging.error(f"save_resolve_message_ts failed: {e}")
 
 
+@retry_dead_conn
 def get_resolve_message_ts(ticket_id):
     try:
         with get_db() as conn:
@@ -804,6 +1482,7 @@ def get_resolve_message_ts(ticket_id):
         return None
 
 
+@retry_dead_conn
 def save_error(level, logger, message, full_trace=None):
     try:
         with get_db() as conn:
@@ -0,0 +1,122 @@
+import logging
+
+import asyncpg
+
+from db import APPLICATION_NAME, _message_row, _msg_lookup_sql
+from globals import DB_ASYNC_POOL_MAX, DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER
+
+# asyncpg counterparts of the db functions the event path hits most. They share nothing with db's
+# psycopg2 pool, so awaiting them on the event loop never takes a threadpool thread or a sync connection.
+# Same contract as db: errors are logged and the function returns its empty value.
+pool: asyncpg.Pool | None = None
+
+# InterfaceError covers the client-side failures: pool closed or closing, connection lost mid-query
+ERRORS = (asyncpg.PostgresError, asyncpg.InterfaceError, OSError)
+
+
+async def init_pool():
+    global pool
+    pool = await asyncpg.create_pool(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME,
+        min_size=2,
+        max_size=DB_ASYNC_POOL_MAX,
+        max_inactive_connection_lifetime=300,
+        server_settings={"application_name": APPLICATION_NAME},
+    )
+
+
+async def close_pool():
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+
+async def _get_pool() -> asyncpg.Pool:
+    if pool is None:
+        await init_pool()
+    return pool
+
+
+async def get_ticket(ticket_id):
+    try:
+        row = await (await _get_pool()).fetchrow("SELECT * FROM tickets WHERE id = $1", ticket_id)
+        return dict(row) if row else None
+    except ERRORS as e:
+        logging.error(f"async get_ticket failed: {e}")
+        return None
+
+
+async def find_ticket(thread):
+    try:
+        row = await (await _get_pool()).fetchrow(
+            "SELECT * FROM tickets WHERE staff_thread_ts = $1 OR user_thread_ts = $1",
+            thread,
+        )
+        return dict(row) if row else None
+    except ERRORS as e:
+        logging.error(f"async find_ticket failed: {e}")
+        return None
+
+
+async def get_ticket_user(user_id):
+    try:
+        row = await (await _get_pool()).fetchrow("SELECT * FROM ticket_users WHERE user_id = $1", user_id)
+        return dict(row) if row else None
+    except ERRORS as e:
+        logging.error(f"async get_ticket_user failed: {e}")
+        return None
+
+
+
+async def message_belongs_to_ticket(message_ts: str, ticket_id: int) -> bool:
+    try:
+        row = await (await _get_pool()).fetchrow(
+            _msg_lookup_sql("ticket_id", "(message_ts = $1 OR origin_message_ts = $1) AND ticket_id = $2", ts="$1", tail="LIMIT 1"),
+            message_ts,
+            ticket_id,
+        )
+        return row is not None
+    except ERRORS as e:
+        logging.error(f"async message_belongs_to_ticket failed: {e}")
+        return False
+
+
+async def get_linked_message_ts(ts):
+    try:
+        row = await (await _get_pool()).fetchrow(
+            _msg_lookup_sql(
+                "message_ts, origin_message_ts",
+                "(origin_message_ts = $1 OR message_ts = $1)",
+                ts="$1",
+                tail="ORDER BY (origin_message_ts IS NOT DISTINCT FROM $1) DESC LIMIT 1",
+            ),
+            ts,
+        )
+        if row is None:
+            return None
+        return row["message_ts"] if row["origin_message_ts"] == ts else row["origin_message_ts"]
+    except ERRORS as e:
+        logging.error(f"async get_linked_message_ts failed: {e}")
+        return None
+
+
+async def save_message(ticket_id, sender_id, sender_name, sender_avatar, msg, is_staff, files=None, message_ts=None, origin_message_ts=None):
+    try:
+        async with (await _get_pool()).acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    INSERT INTO ticket_msgs
+                        (ticket_id, sender_id, sender_name, sender_avatar, msg, files, is_staff, message_ts, origin_message_ts)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                    """,
+                    *_message_row(ticket_id, sender_id, sender_name, sender_avatar, msg, is_staff, files, message_ts, origin_message_ts),
+                )
+                await conn.execute("UPDATE tickets SET last_msg_at = NOW() WHERE id = $1", ticket_id)
+    except ERRORS as e:
+        logging.error(f"async save_message failed: {e}")
@@ -0,0 +1,74 @@
+import json, logging, random, select, time
+import psycopg2
+import db
+from cache import cache
+
+logger = logging.getLogger("db_listener")
+
+# Applies NOTIFYs from the triggers in migrations/004 to the cache, so changes sw-dash (or anyone else)
+# makes to ticket status, claims and opt-ins show up immediately instead of after a TTL, or never.
+CHANNEL = "sw_cache_invalidate"
+IDLE_PING_S = 60.0
+RECONNECT_MAX_S = 60.0
+
+stats = {"connected": False, "connects": 0, "received": 0, "applied": 0, "own": 0, "bad_payloads": 0}
+
+
+def handle(payload: str):
+    stats["received"] += 1
+    try:
+        change = json.loads(payload)
+        if change.get("origin") == db.APPLICATION_NAME:
+            stats["own"] += 1  # the cache was updated before this write was even queued
+            return
+        if change["table"] == "tickets":
+            applied = cache.apply_ticket_change(change["id"], change["status"], change["closed_by"])
+        elif change["table"] == "ticket_users":
+            applied = cache.apply_user_opt_change(change["user_id"], change["is_opted_in"])
+        else:
+            raise KeyError(change["table"])
+    except (ValueError, KeyError, TypeError) as e:
+        stats["bad_payloads"] += 1
+        logger.warning(f"ignoring notification {payload!r}: {e}")
+        return
+    stats["applied"] += applied
+
+
+def _listen(conn):
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {CHANNEL}")
+    stats["connected"] = True
+    stats["connects"] += 1
+    cache.live_invalidation = True
+    # LISTEN is in place, so anything missed from here on arrives as a notification; catch up on the rest
+    cache.resync_live_state()
+    while True:
+        readable, _, _ = select.select([conn], [], [], IDLE_PING_S)
+        if not readable:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")  # a dead socket only shows up when we use it
+        conn.poll()
+        while conn.notifies:
+            handle(conn.notifies.pop(0).payload)
+
+
+def run():
+    failures = 0
+    while True:
+        conn = None
+        try:
+            conn = db.open_listen_conn()
+            failures = 0
+            _listen(conn)
+        except (psycopg2.Error, OSError) as e:
+            failures += 1
+            logger.warning(f"listener connection lost ({e}), falling back to TTLs until it reconnects")
+        except Exception as e:
+            failures += 1
+            logger.exception(f"Unhandled error in db listener: {e}")
+        finally:
+            stats["connected"] = False
+            cache.live_invalidation = False
+            if conn is not None and not conn.closed:
+                conn.close()
+        time.sleep(random.uniform(0, min(RECONNECT_MAX_S, 2 ** failures)))
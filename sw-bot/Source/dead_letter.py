@@ -0,0 +1,48 @@
+import json, logging, os, threading
+from datetime import datetime, timezone
+from globals import DEAD_LETTER_PATH
+
+lock = threading.Lock()
+
+
+def add(task_id: str, fn_name: str, args, kwargs: dict, error: Exception, attempts: int):
+    record = {
+        "id": task_id,
+        "fn": fn_name,
+        "args": list(args),
+        "kwargs": kwargs,
+        "error": f"{type(error).__name__}: {error}"[:500],
+        "attempts": attempts,
+        "ts": datetime.now(timezone.utc).isoformat(),
+    }
+    with lock:
+        try:
+            with open(DEAD_LETTER_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        except OSError as e:
+            logging.error(f"dead_letter append failed: {e}")
+
+
+def entries() -> list[dict]:
+    if not os.path.exists(DEAD_LETTER_PATH):
+        return []
+    with lock:
+        try:
+            with open(DEAD_LETTER_PATH, encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"dead_letter load failed: {e}")
+            return []
+
+
+def remove(task_ids: set[str]):
+    with lock:
+        try:
+            with open(DEAD_LETTER_PATH, encoding="utf-8") as f:
+                kept = [line for line in f if line.strip() and json.loads(line)["id"] not in task_ids]
+            tmp = DEAD_LETTER_PATH + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(kept)
+            os.replace(tmp, DEAD_LETTER_PATH)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"dead_letter remove failed: {e}")
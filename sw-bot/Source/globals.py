@@ -20,12 +20,36 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_USER = os.getenv("DB_USER")
 DB_PORT = int(os.getenv("DB_PORT", "5432"))
 DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_VALIDATE_IDLE_S = float(os.getenv("DB_VALIDATE_IDLE_S", "30"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_WRITER_RESERVED = int(os.getenv("DB_POOL_WRITER_RESERVED", "2"))
+DB_ACQUIRE_TIMEOUT_S = float(os.getenv("DB_ACQUIRE_TIMEOUT_S", "5"))
+DB_ASYNC_POOL_MAX = int(os.getenv("DB_ASYNC_POOL_MAX", "10"))
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+DB_REPLICA_DSN = os.getenv("DB_REPLICA_DSN", "")
+DB_REPLICA_POOL_MAX = int(os.getenv("DB_REPLICA_POOL_MAX", "3"))
+DB_REPLICA_MAX_LAG_S = float(os.getenv("DB_REPLICA_MAX_LAG_S", "30"))
+MSG_ARCHIVE_AFTER_DAYS = int(os.getenv("MSG_ARCHIVE_AFTER_DAYS", "30"))
+MSG_ARCHIVE_BATCH = int(os.getenv("MSG_ARCHIVE_BATCH", "200"))
 ENVIRONMENT = os.getenv("ENVIRONMENT", "PRODUCTION")
 OPEN_TICKET_REACTION = os.getenv("OPEN_TICKET_REACTION", "frog-diabolical")
 ERROR_DM_USER = os.getenv("ERROR_DM_USER", "")
 TASK_JOURNAL_PATH = os.getenv("TASK_JOURNAL_PATH", "task_journal.jsonl")
-CACHE_SNAPSHOT_PATH = os.getenv("CACHE_SNAPSHOT_PATH", "cache_snapshot.json")
+TASK_JOURNAL_FSYNC = os.getenv("TASK_JOURNAL_FSYNC", "interval")
+TASK_JOURNAL_FSYNC_MS = int(os.getenv("TASK_JOURNAL_FSYNC_MS", "20"))
+TASK_JOURNAL_SEGMENT_BYTES = int(os.getenv("TASK_JOURNAL_SEGMENT_BYTES", str(1024 * 1024)))
+DEAD_LETTER_PATH = os.getenv("DEAD_LETTER_PATH", "dead_letter.jsonl")
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "6"))
+TASK_RETRY_BASE_MS = int(os.getenv("TASK_RETRY_BASE_MS", "500"))
+TASK_RETRY_MAX_MS = int(os.getenv("TASK_RETRY_MAX_MS", "60000"))
+CACHE_SNAPSHOT_PATH = os.getenv("CACHE_SNAPSHOT_PATH", "cache_snapshot.bin")
+CACHE_DELTA_PATH = os.getenv("CACHE_DELTA_PATH", CACHE_SNAPSHOT_PATH + ".delta")
+CACHE_SNAPSHOT_INTERVAL = float(os.getenv("CACHE_SNAPSHOT_INTERVAL", "300"))
+CACHE_DELTA_INTERVAL = float(os.getenv("CACHE_DELTA_INTERVAL", "5"))
 PORT = int(os.getenv("PORT", "3000"))
+WRITE_WORKERS = int(os.getenv("WRITE_WORKERS", "4"))
+SAVE_BATCH_SIZE = int(os.getenv("SAVE_BATCH_SIZE", "100"))
+SAVE_BATCH_LINGER_MS = int(os.getenv("SAVE_BATCH_LINGER_MS", "50"))
 
 MACROS = {
     "fraud": "Hey there!\nThe shipwrights team cannot help you with this query. Please forward any related questions to <@U091HC53CE8>.",
@@ -1,6 +1,6 @@
-import json
+import asyncio, json, logging
 from time import monotonic
-import ai, blocks, db, errors, relay, views, worker
+import ai, blocks, db, db_async, db_listener, dead_letter, errors, query_metrics, relay, slack_queue, views, worker
 from slack_sdk.errors import SlackApiError
 from cache import cache
 from globals import (
@@ -23,6 +23,23 @@ def _handle_admin_dm(event: dict) -> None:
             text="Cache dump ready.",
             blocks=blocks.cache_dump_trigger(),
         )
+    elif text == "!dlq":
+        entries = dead_letter.entries()
+        lines = [f"`{e['id']}` {e['fn']} x{e['attempts']} - {e['error']}" for e in entries[-30:]]
+        client.chat_postMessage(
+            channel=ERROR_DM_USER,
+            text=f"{len(entries)} dead-lettered task(s)" + ("\n" + "\n".join(lines) if lines else ""),
+        )
+    elif text.startswith("!redrive"):
+        target = text.removeprefix("!redrive").strip()
+        entries = [e for e in dead_letter.entries() if target == "all" or e["id"] == target]
+        redriven = {e["id"] for e in entries if worker.redrive(e)}
+        if redriven:
+            dead_letter.remove(redriven)
+        client.chat_postMessage(
+            channel=ERROR_DM_USER,
+            text=f"Re-queued {len(redriven)} of {len(entries)} dead-lettered task(s).",
+        )
 
 
 def handle_cache_dump_view(payload: dict) -> None:
@@ -41,10 +58,42 @@ def handle_cache_dump_view(payload: dict) -> None:
         "closed_notified_count": len(cache.closed_notified),
         "metrics": dict(cache.metrics),
         "fetch_ages": {k: int(now - t) for k, t in cache.fetch_times.items()},
+        "memory": cache.stats(),
+        "write_shards": worker.stats(),
+        "slack_queue": slack_queue.stats(),
+        "db_pool": db.pool_stats(),
+        "db_queries": query_metrics.snapshot(),
+        "db_listener": dict(db_listener.stats),
     }
     client.views_open(trigger_id=payload["trigger_id"], view=views.cache_dump(data))
 
 
+async def _prefetch(event: dict, channel: str) -> None:
+    thread = event.get("thread_ts")
+    if thread:
+        await cache.find_ticket_by_ts_async(thread)
+    elif channel == USER_CHANNEL and event.get("user"):  # a new ticket: create_ticket checks the opt-in
+        await cache.get_user_opt_in_async(event["user"])
+
+
+async def prefetch_message(event: dict) -> None:
+    """Resolves the event's ticket and sender opt-in on the event loop through db_async, and starts loading the
+    sender's profile if it isn't cached, so the threadpool handler that runs next finds them in cache.
+    """
+    channel = event.get("channel", "")
+    if event.get("bot_id") or channel not in (USER_CHANNEL, STAFF_CHANNEL):
+        return
+    if event.get("user"):
+        cache.prefetch_profile(event["user"])
+    if db_async.pool is None:
+        return
+    try:
+        # Slack wants its ack within 3s; a slow lookup here is simply left to the handler
+        await asyncio.wait_for(_prefetch(event, channel), timeout=1)
+    except Exception as e:
+        logging.warning(f"prefetch_message failed, handler will load synchronously: {e}")
+
+
 def handle_message(event: dict) -> None:
     if event.get("bot_id"):
         return
@@ -1,11 +1,11 @@
-import re, requests as http_requests
+import logging, re, requests as http_requests
 from collections import defaultdict
 from datetime import datetime, timedelta
 from threading import Lock
 from time import monotonic
 import views
 from cache import cache
-from globals import APP_ID
+from globals import APP_ID, client
 
 rate_limits: defaultdict = defaultdict(list)
 rate_lock = Lock()
@@ -52,13 +52,8 @@ def show_feedback_modal(client, body, ticket_id):
 
 
 def get_user_info(client, user_id):
-    result = client.users_info(user=user_id)
-    if result["ok"]:
-        profile = result["user"]["profile"]
-        username = profile.get("display_name") or profile.get("real_name") or result["user"].get("name")
-        pfp = profile.get("image_192")
-        return {"username": username, "pfp": pfp}
-    return None
+    profile = cache.get_profile(user_id)
+    return {"username": profile["display_name"] or profile["name"], "pfp": profile["image_192"]}
 
 
 def is_shipwright(user_id) -> bool:
@@ -93,5 +88,36 @@ def parse_slack_link(link: str):
     return channel, ts
 
 
+# public (C) and private (G) channel permalinks are just workspace URL + channel + ts; DMs and
+# anything else go through chat.getPermalink
+LOCAL_PERMALINK_PREFIXES = ("C", "G")
+WORKSPACE_URL_RETRY_S = 300.0  # after a failed auth.test, use chat.getPermalink this long before asking again
+_workspace_lock = Lock()
+_workspace_retry_at = 0.0
+
+
+def _workspace_url() -> str | None:
+    global _workspace_retry_at
+    with _workspace_lock:
+        if cache.workspace_url is None:
+            if monotonic() < _workspace_retry_at:
+                return None
+            try:
+                cache.workspace_url = client.auth_test()["url"]
+            except Exception as e:
+                _workspace_retry_at = monotonic() + WORKSPACE_URL_RETRY_S
+                logging.warning(f"auth.test failed, permalinks fall back to chat.getPermalink for {WORKSPACE_URL_RETRY_S:g}s: {e}")
+                return None
+        return cache.workspace_url
+
+
+def permalink(channel: str, ts: str) -> str:
+    """The inverse of parse_slack_link, built locally where the format is known."""
+    base = _workspace_url() if channel.startswith(LOCAL_PERMALINK_PREFIXES) else None
+    if base:
+        return f"{base.rstrip('/')}/archives/{channel}/p{ts.replace('.', '')}"
+    return client.chat_getPermalink(channel=channel, message_ts=ts)["permalink"]
+
+
 def respond(response_url: str, text: str) -> None:
     http_requests.post(response_url, json={"text": text, "response_type": "ephemeral"}, timeout=5)
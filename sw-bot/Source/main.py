@@ -2,9 +2,9 @@ import json, logging, os, threading
 from contextlib import asynccontextmanager
 from urllib.parse import parse_qs
 from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from slack_sdk.signature import SignatureVerifier
-import alerts, cache_store, errors, raffle, summary, worker
+import alerts, archive, cache_store, db, db_async, db_listener, errors, query_metrics, raffle, slack_queue, summary, task_journal, worker
 from cache import cache
 from globals import ENVIRONMENT, ERROR_DM_USER, PORT, client
 from handlers import (
@@ -12,7 +12,7 @@ from handlers import (
     handle_delete_meta, handle_edit_message, handle_edited_message, handle_message,
     handle_meta_command, handle_modify_opt, handle_modify_votes, handle_open_create_meta,
     handle_rating_form, handle_reopen_ticket, handle_resolve_detected, handle_resolve_ticket,
-    handle_send_paraphrased, handle_submit_feedback, handle_view_error,
+    handle_send_paraphrased, handle_submit_feedback, handle_view_error, prefetch_message,
 )
 from helpers import seen_already
 
@@ -57,8 +57,14 @@ VIEW_HANDLERS = {
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
-    cache.bot_user_id = client.auth_test()["user_id"]
+    auth = client.auth_test()
+    cache.bot_user_id = auth["user_id"]
+    cache.workspace_url = auth["url"]
     cache_store.load(cache)
+    try:
+        await db_async.init_pool()
+    except Exception as e:
+        logging.error(f"async DB pool unavailable, event prefetch falls back to sync lookups: {e}")
     if ERROR_DM_USER:
         try:
             client.chat_postMessage(channel=ERROR_DM_USER, text="Bot redeployed and online.")
@@ -67,15 +73,23 @@ async def lifespan(_: FastAPI):
     worker.load_and_replay()
     worker.task_runner.enqueue_meta_sticky_update()
     for target, name in [
+        (cache.warm_up, "warmup"),
+        (cache.warm_profiles, "profiles"),
+        (lambda: cache_store.snapshot_loop(cache), "snapshot"),
         (summary.reminders_loop, "reminders"),
         (alerts.alerts_loop, "alerts"),
         (raffle.raffle_loop, "raffle"),
+        (archive.archive_loop, "archive"),
         (worker.task_runner.run, "worker"),
+        (slack_queue.run, "slack"),
+        (db_listener.run, "db-listener"),
     ]:
         threading.Thread(target=target, daemon=True, name=name).start()
     yield
     cache_store.save(cache)
     logging.info("Cache saved on shutdown")
+    task_journal.close()
+    await db_async.close_pool()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -94,7 +108,19 @@ async def verified_body(request: Request) -> bytes:
 
 @app.get("/health")
 async def health():
-    return {"status": "ok"}
+    return {"status": "ok", "warm": cache.warm.is_set()}
+
+
+@app.get("/ready")
+async def ready():
+    if not cache.warm.is_set():
+        return JSONResponse({"status": "warming"}, status_code=503)
+    return {"status": "ready"}
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(query_metrics.render_prometheus(db.pool_stats(), counters=db.POOL_COUNTERS))
 
 
 @app.post("/slack/events")
@@ -113,7 +139,10 @@ async def slack_events(background: BackgroundTasks, request: Request):
     if event.get("type") == "message":
         msg_id = event.get("client_msg_id") or event.get("event_ts") or ""
         if not seen_already(msg_id):
+            await prefetch_message(event)
             background.add_task(handle_message, event)
+    elif event.get("type") == "user_change":
+        cache.apply_user_change(event.get("user", {}))
     return JSONResponse({})
 
 
@@ -0,0 +1,98 @@
+from datetime import date
+import psycopg2
+
+# ticket_msgs is LIST-partitioned on `archived` into two trees, each RANGE-partitioned by month of created_at:
+#   ticket_msgs_live_YYYY_MM     new and recent messages; every insert lands here
+#   ticket_msgs_archive_YYYY_MM  messages of tickets closed long ago, stored with aggressive TOAST compression
+# Both trees have a DEFAULT partition as a safety net, so an insert never fails for want of a month.
+# Used by migrations/005 for the initial layout and by db's nightly maintenance afterwards.
+LIVE = "ticket_msgs_live"
+ARCHIVE = "ticket_msgs_archive"
+MONTHS_AHEAD = 2
+
+
+def add_months(month: date, n: int) -> date:
+    years, index = divmod(month.month - 1 + n, 12)
+    return date(month.year + years, index + 1, 1)
+
+
+def partition_name(tree: str, month: date) -> str:
+    return f"{tree}_{month:%Y_%m}"
+
+
+def _exists(cur, name: str) -> bool:
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    return cur.fetchone()[0]
+
+
+def compress(cur, name: str):
+    # TOAST compresses values once a row passes toast_tuple_target, so dropping it to the minimum
+    # compresses nearly every message; lz4 where the server has it (14+), pglz otherwise
+    cur.execute(f"ALTER TABLE {name} SET (toast_tuple_target = 128, fillfactor = 100)")
+    cur.execute("SAVEPOINT archive_lz4")
+    try:
+        cur.execute(f"ALTER TABLE {name} ALTER COLUMN msg SET COMPRESSION lz4")
+        cur.execute("RELEASE SAVEPOINT archive_lz4")
+    except psycopg2.Error:
+        cur.execute("ROLLBACK TO SAVEPOINT archive_lz4")
+
+
+def create_month(cur, tree: str, month: date) -> str | None:
+    name = partition_name(tree, month)
+    if _exists(cur, name):
+        return None
+    cur.execute(
+        f"CREATE TABLE {name} PARTITION OF {tree} FOR VALUES FROM (%s) TO (%s)",
+        (month.isoformat(), add_months(month, 1).isoformat()),
+    )
+    if tree == ARCHIVE:
+        compress(cur, name)
+    return name
+
+
+def ensure(cur, first: date, today: date) -> list[str]:
+    """Creates the monthly partitions of both trees from first's month to MONTHS_AHEAD past today's."""
+    created = []
+    month = first.replace(day=1)
+    last = add_months(today.replace(day=1), MONTHS_AHEAD)
+    while month <= last:
+        for tree in (LIVE, ARCHIVE):
+            name = create_month(cur, tree, month)
+            if name:
+                created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def months(cur, tree: str) -> dict[date, str]:
+    cur.execute(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        """,
+        (tree,),
+    )
+    found = {}
+    for (name,) in cur.fetchall():
+        suffix = name.removeprefix(f"{tree}_")
+        try:
+            year, month = suffix.split("_")
+            found[date(int(year), int(month), 1)] = name
+        except ValueError:
+            continue  # the default partition
+    return found
+
+
+def drop_empty_live(cur, before: date) -> list[str]:
+    """Drops live months older than `before` that archiving has emptied, so unrouted lookups skip them."""
+    dropped = []
+    for month, name in sorted(months(cur, LIVE).items()):
+        if add_months(month, 1) > before:
+            break
+        cur.execute(f"SELECT EXISTS (SELECT 1 FROM {name})")
+        if cur.fetchone()[0]:
+            continue
+        cur.execute(f"DROP TABLE {name}")
+        dropped.append(name)
+    return dropped
@@ -0,0 +1,106 @@
+import threading
+from collections import deque
+from time import monotonic
+
+import psycopg2
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """No connection freed up within the acquire timeout. Subclasses OperationalError so the worker retries it."""
+
+
+class PoolGate:
+    """Hands out the right to check a connection out of the pool, in arrival order.
+
+    ThreadedConnectionPool raises as soon as it is exhausted; callers pass through here first and wait in a
+    FIFO queue instead. `reserved` of the `size` slots can only be taken by writer threads, so a burst of
+    interactive lookups can never starve the worker. A waiter is only skipped by someone behind it when it
+    is a reader blocked on the reader limit and the one behind is a writer.
+    """
+
+    def __init__(self, size: int, reserved: int):
+        self.size = size
+        self.reserved = min(reserved, size - 1)
+        self.readers = 0
+        self.writers = 0
+        self._lock = threading.Lock()
+        self._waiters: deque = deque()
+        self.acquired = 0
+        self.waited = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.max_queue = 0
+
+    def _can_take(self, writer: bool) -> bool:
+        if self.readers + self.writers >= self.size:
+            return False
+        return writer or self.readers < self.size - self.reserved
+
+    def _take(self, writer: bool):
+        if writer:
+            self.writers += 1
+        else:
+            self.readers += 1
+        self.acquired += 1
+
+    def _wake_next(self):
+        for waiter in self._waiters:
+            if waiter["granted"]:
+                continue
+            if self._can_take(waiter["writer"]):
+                self._take(waiter["writer"])
+                waiter["granted"] = True
+                waiter["event"].set()
+            elif not waiter["writer"]:
+                continue  # reader stuck on the reader limit; a writer behind it may still fit
+            else:
+                return
+
+    def acquire(self, writer: bool, timeout: float):
+        waiter = {"writer": writer, "granted": False, "event": threading.Event()}
+        with self._lock:
+            self._waiters.append(waiter)
+            self._wake_next()
+            if waiter["granted"]:
+                self._waiters.remove(waiter)
+                return
+            self.max_queue = max(self.max_queue, len(self._waiters))
+        started = monotonic()
+        granted = waiter["event"].wait(timeout)
+        waited = monotonic() - started
+        with self._lock:
+            self._waiters.remove(waiter)
+            if not granted and waiter["granted"]:
+                granted = True  # released between the wait timing out and us taking the lock
+            self.waited += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            if not granted:
+                self.timeouts += 1
+        if not granted:
+            raise PoolTimeout(f"no DB connection free after {timeout:.1f}s ({self.size} in use)")
+
+    def release(self, writer: bool):
+        with self._lock:
+            if writer:
+                self.writers -= 1
+            else:
+                self.readers -= 1
+            self._wake_next()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "reserved_for_writers": self.reserved,
+                "readers": self.readers,
+                "writers": self.writers,
+                "queued": len(self._waiters),
+                "max_queued": self.max_queue,
+                "saturation": round((self.readers + self.writers) / self.size, 2),
+                "waited_pct": round(self.waited / self.acquired * 100, 1) if self.acquired else 0.0,
+                "gate_wait_avg_ms": round(self.wait_total / self.waited * 1000, 1) if self.waited else 0.0,
+                "gate_wait_max_ms": round(self.wait_max * 1000, 1),
+                "timeouts": self.timeouts,
+            }
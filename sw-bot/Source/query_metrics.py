@@ -0,0 +1,137 @@
+import logging, threading
+from collections import deque
+from datetime import datetime, timezone
+from globals import DB_SLOW_QUERY_MS
+
+# Fed by db.get_db (one observation per db function call, acquire to release) and by the cursor class
+# db's pool hands out (one per statement: row counts and the slow-query log).
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+SLOW_LOG_SIZE = 100
+
+logger = logging.getLogger("slow_query")
+_lock = threading.Lock()
+_current = threading.local()
+_functions: dict[str, dict] = {}
+_slow: deque = deque(maxlen=SLOW_LOG_SIZE)
+
+
+def _entry(name: str) -> dict:
+    entry = _functions.get(name)
+    if entry is None:
+        entry = _functions[name] = {
+            "calls": 0,
+            "errors": 0,
+            "rows": 0,
+            "statements": 0,
+            "total_ms": 0.0,
+            "max_ms": 0.0,
+            "buckets": [0] * (len(BUCKETS_MS) + 1),
+        }
+    return entry
+
+
+def begin(name: str):
+    _current.name = name
+
+
+def end(name: str, elapsed_s: float, failed: bool):
+    ms = elapsed_s * 1000
+    with _lock:
+        entry = _entry(name)
+        entry["calls"] += 1
+        entry["errors"] += failed
+        entry["total_ms"] += ms
+        entry["max_ms"] = max(entry["max_ms"], ms)
+        entry["buckets"][next((i for i, b in enumerate(BUCKETS_MS) if ms <= b), len(BUCKETS_MS))] += 1
+    _current.name = None
+
+
+def statement(query, params, elapsed_s: float, rowcount: int):
+    name = getattr(_current, "name", None) or "unknown"
+    ms = elapsed_s * 1000
+    with _lock:
+        entry = _entry(name)
+        entry["statements"] += 1
+        if rowcount and rowcount > 0:
+            entry["rows"] += rowcount
+    if ms < DB_SLOW_QUERY_MS:
+        return
+    sql = query.decode(errors="replace") if isinstance(query, bytes) else str(query)
+    sql = " ".join(sql.split())[:1000]
+    # only how many params: their values are user data (save_message binds the message text)
+    param_count = len(params) if params is not None else 0
+    record = {"fn": name, "ms": round(ms, 1), "sql": sql, "param_count": param_count, "ts": datetime.now(timezone.utc).isoformat()}
+    with _lock:
+        _slow.append(record)
+    logger.warning(f"slow query in {name}: {ms:.0f}ms {sql} ({param_count} params)")
+
+
+def _quantile(buckets: list[int], q: float) -> float | None:
+    total = sum(buckets)
+    if not total:
+        return None
+    target = q * total
+    seen = 0
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= target:
+            return BUCKETS_MS[i] if i < len(BUCKETS_MS) else float("inf")
+    return None
+
+
+def snapshot() -> dict:
+    with _lock:
+        functions = {name: {**e, "buckets": list(e["buckets"])} for name, e in _functions.items()}
+        slow = list(_slow)
+    return {
+        "functions": {
+            name: {
+                "calls": e["calls"],
+                "errors": e["errors"],
+                "rows": e["rows"],
+                "statements": e["statements"],
+                "avg_ms": round(e["total_ms"] / e["calls"], 2) if e["calls"] else 0.0,
+                "p50_ms": _quantile(e["buckets"], 0.5),
+                "p95_ms": _quantile(e["buckets"], 0.95),
+                "max_ms": round(e["max_ms"], 1),
+                "total_ms": round(e["total_ms"], 1),
+            }
+            for name, e in sorted(functions.items(), key=lambda kv: kv[1]["total_ms"], reverse=True)
+        },
+        "slow_threshold_ms": DB_SLOW_QUERY_MS,
+        "slow_queries": slow,
+    }
+
+
+def render_prometheus(gauges: dict | None = None, counters: tuple[str, ...] = ()) -> str:
+    """counters names the keys of `gauges` that only ever increase; they're exported as swbot_db_pool_<key>_total."""
+    with _lock:
+        functions = {name: {**e, "buckets": list(e["buckets"])} for name, e in _functions.items()}
+    lines = [
+        "# HELP swbot_db_call_seconds Latency of db.py functions, pool checkout to release.",
+        "# TYPE swbot_db_call_seconds histogram",
+    ]
+    for name, e in sorted(functions.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS_MS, e["buckets"]):
+            cumulative += count
+            lines.append(f'swbot_db_call_seconds_bucket{{fn="{name}",le="{bound / 1000}"}} {cumulative}')
+        lines.append(f'swbot_db_call_seconds_bucket{{fn="{name}",le="+Inf"}} {e["calls"]}')
+        lines.append(f'swbot_db_call_seconds_sum{{fn="{name}"}} {e["total_ms"] / 1000}')
+        lines.append(f'swbot_db_call_seconds_count{{fn="{name}"}} {e["calls"]}')
+    for metric, key, help_text in (
+        ("swbot_db_errors_total", "errors", "db.py function calls that raised inside get_db."),
+        ("swbot_db_rows_total", "rows", "Rows returned or affected, summed over statements."),
+        ("swbot_db_statements_total", "statements", "Statements executed."),
+    ):
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        lines += [f'{metric}{{fn="{name}"}} {e[key]}' for name, e in sorted(functions.items())]
+    for key, value in (gauges or {}).items():
+        if not isinstance(value, (int, float)):
+            continue
+        value = int(value) if isinstance(value, bool) else value
+        if key in counters:
+            lines += [f"# TYPE swbot_db_pool_{key}_total counter", f"swbot_db_pool_{key}_total {value}"]
+        else:
+            lines += [f"# TYPE swbot_db_pool_{key} gauge", f"swbot_db_pool_{key} {value}"]
+    return "\n".join(lines) + "\n"
@@ -23,8 +23,8 @@ def run_raffle():
 
     month_name = datetime(year, month, 1).strftime("%B %Y")
 
-    for winner in winners:
-        db.add_stardust(winner["user_id"], amount=RAFFLE_PRIZE)
+    if db.add_stardust_bulk([(winner["user_id"], None, RAFFLE_PRIZE) for winner in winners]) is None:
+        logging.error(f"raffle: stardust payout failed for {month_name}")
 
     try:
         client.chat_postMessage(
@@ -1,14 +1,14 @@
 import json, logging, os, tempfile, time
 import requests
 from slack_sdk.errors import SlackApiError
-import ai, blocks, db, worker
+import ai, blocks, db, slack_queue, worker
 from cache import cache
 from globals import (
     ADMINS, BOT_TOKEN, MACROS, OPEN_TICKET_REACTION,
     RESOLVE_MESSAGES, STAFF_CHANNEL, USER_CHANNEL, client,
 )
 # from helpers import get_stardance_project  # ship_certs
-from helpers import is_shipwright, parse_slack_link
+from helpers import is_shipwright, parse_slack_link, permalink
 
 
 def swap_reactions(client_inst, ticket, add_name, remove_name):
@@ -181,7 +181,7 @@ def _handle_question(event, ticket, user_id, staff_name, staff_avatar, text, fil
             channel=STAFF_CHANNEL, user=user_id, thread_ts=thread,
             text="Files sent.", blocks=blocks.sent_files_controls(uploaded),
         )
-    worker.enqueue(client.reactions_add, channel=STAFF_CHANNEL, timestamp=event["ts"], name="heavy_check_mark")
+    slack_queue.call("reactions_add", channel=STAFF_CHANNEL, timestamp=event["ts"], name="heavy_check_mark")
 
 
 def _handle_macro(event, ticket, user_id, staff_name, staff_avatar, thread, macro_key):
@@ -198,7 +198,7 @@ def _handle_macro(event, ticket, user_id, staff_name, staff_avatar, thread, macr
         channel=STAFF_CHANNEL, user=user_id, thread_ts=thread,
         text="Message sent.", blocks=blocks.sent_message_controls(dest_ts),
     )
-    worker.enqueue(client.reactions_add, channel=STAFF_CHANNEL, timestamp=event["ts"], name="white_check_mark")
+    slack_queue.call("reactions_add", channel=STAFF_CHANNEL, timestamp=event["ts"], name="white_check_mark")
     cache.close_ticket(ticket["id"])
     cache.claim_ticket(ticket["id"], user_id)
     close_resp = client.chat_postMessage(
@@ -234,14 +234,14 @@ def _handle_help(ticket, user_id):
 
 
 def _handle_tldr(event, ticket):
-    worker.enqueue(client.reactions_add, channel=STAFF_CHANNEL, timestamp=event["ts"], name="white_check_mark")
+    slack_queue.call("reactions_add", channel=STAFF_CHANNEL, timestamp=event["ts"], name="white_check_mark")
     ai.summarize_ticket(ticket["id"])
 
 
 def _handle_ai(event, ticket, user_id, staff_name, staff_avatar, text):
     clean_text = text.strip()[len("!ai"):].strip()
     worker.enqueue(db.save_message, ticket["id"], user_id, staff_name, staff_avatar, text, True, None, event.get("ts"))
-    worker.enqueue(client.reactions_add, channel=STAFF_CHANNEL, timestamp=event["ts"], name="white_check_mark")
+    slack_queue.call("reactions_add", channel=STAFF_CHANNEL, timestamp=event["ts"], name="white_check_mark")
     ai.paraphrase_message(ticket["id"], clean_text)
 
 
@@ -258,7 +258,7 @@ def _handle_reopen(event, ticket, user_id):
         text=f"<@{user_id}> has reopened this ticket.",
     )
     worker.enqueue(db.save_message, ticket["id"], "BOT", "Shipwrighter", None, f"<@{user_id}> has reopened this ticket", True, None, resp["ts"])
-    worker.enqueue(client.reactions_add, channel=STAFF_CHANNEL, timestamp=event["ts"], name="white_check_mark")
+    slack_queue.call("reactions_add", channel=STAFF_CHANNEL, timestamp=event["ts"], name="white_check_mark")
     swap_reactions(client, ticket, OPEN_TICKET_REACTION, "checks-passed-octicon")
 
 
@@ -274,7 +274,7 @@ def _handle_resolve(event, ticket, user_id):
         text=f"Hey! Would you look at that, This ticket was marked as resolved by <@{user_id}>!",
     )
     worker.enqueue(db.save_message, ticket["id"], "BOT", "Shipwrighter", None, f"ticket closed by <@{user_id}>", True, None, resp["ts"])
-    worker.enqueue(client.reactions_add, channel=STAFF_CHANNEL, timestamp=event["ts"], name="white_check_mark")
+    slack_queue.call("reactions_add", channel=STAFF_CHANNEL, timestamp=event["ts"], name="white_check_mark")
     _send_resolve_feedback(ticket)
 
 
@@ -307,7 +307,7 @@ def _handle_purge(event, ticket, user_id):
     cache.close_ticket(ticket["id"])
     cache.claim_ticket(ticket["id"], user_id)
     clear_reactions(ticket)
-    worker.enqueue(client.reactions_add, channel=STAFF_CHANNEL, timestamp=event["ts"], name="white_check_mark")
+    slack_queue.call("reactions_add", channel=STAFF_CHANNEL, timestamp=event["ts"], name="white_check_mark")
     client.chat_postEphemeral(
         channel=STAFF_CHANNEL, thread_ts=ticket["staff_thread_ts"],
         user=user_id, text=f"Purged {deleted} messages and closed ticket.",
@@ -348,13 +348,13 @@ def _handle_delete(event, ticket, user_id, text):
             user=user_id, text="Cannot delete the ticket header message.",
         )
         return
-    if not db.message_belongs_to_ticket(link_ts, ticket["id"]):
+    if not cache.message_belongs_to_ticket(link_ts, ticket["id"]):
         client.chat_postEphemeral(
             channel=STAFF_CHANNEL, thread_ts=ticket["staff_thread_ts"],
             user=user_id, text="That message does not belong to this ticket.",
         )
         return
-    linked_ts = db.get_linked_message_ts(link_ts)
+    linked_ts = cache.get_linked_message_ts(link_ts)
     user_ts = link_ts if link_channel == USER_CHANNEL else linked_ts
     staff_ts = link_ts if link_channel == STAFF_CHANNEL else linked_ts
     deleted = []
@@ -367,7 +367,7 @@ def _handle_delete(event, ticket, user_id, text):
         except SlackApiError:
             pass
     if deleted:
-        worker.enqueue(client.reactions_add, channel=STAFF_CHANNEL, timestamp=event["ts"], name="white_check_mark")
+        slack_queue.call("reactions_add", channel=STAFF_CHANNEL, timestamp=event["ts"], name="white_check_mark")
     client.chat_postEphemeral(
         channel=STAFF_CHANNEL, thread_ts=ticket["staff_thread_ts"],
         user=user_id, text=f"Deleted from: {', '.join(deleted)}." if deleted else "Could not delete message.",
@@ -387,9 +387,8 @@ def handle_staff_reply(event):
         return
 
     user_id = event["user"]
-    user_info_resp = client.users_info(user=user_id)
-    staff_name = user_info_resp["user"]["profile"].get("display_name") or user_info_resp["user"]["profile"].get("real_name")
-    staff_avatar = user_info_resp["user"]["profile"]["image_48"]
+    profile = cache.get_profile(user_id)
+    staff_name, staff_avatar = profile["display_name"], profile["image_48"]
 
     # check_stardance(text, ticket)  # ship_certs
 
@@ -445,9 +444,8 @@ def handle_client_reply(event):
 
 
 
-    user_info_resp = client.users_info(user=user_id)
-    user_name = user_info_resp["user"]["profile"].get("display_name") or user_info_resp["user"]["profile"].get("real_name")
-    user_avatar = user_info_resp["user"]["profile"]["image_48"]
+    profile = cache.get_profile(user_id)
+    user_name, user_avatar = profile["display_name"], profile["image_48"]
 
     file_info = [{"name": f.get("name"), "url": f.get("url_private"), "mimetype": f.get("mimetype"), "size": f.get("size")} for f in files] if files else None
 
@@ -479,11 +477,10 @@ def create_ticket(event):
         return
 
     user_opt_in = cache.get_user_opt_in(user_id)
-    user_info_resp = client.users_info(user=user_id)
-    user_name = user_info_resp["user"]["profile"].get("display_name") or user_info_resp["user"]["profile"].get("real_name")
-    user_avatar = user_info_resp["user"]["profile"]["image_48"]
+    profile = cache.get_profile(user_id)
+    user_name, user_avatar = profile["display_name"], profile["image_48"]
 
-    user_thread_link = client.chat_getPermalink(channel=USER_CHANNEL, message_ts=event["ts"])["permalink"]
+    user_thread_link = permalink(USER_CHANNEL, event["ts"])
 
     staff_msg = client.chat_postMessage(
         channel=STAFF_CHANNEL,
@@ -496,7 +493,8 @@ def create_ticket(event):
     if files:
         send_files(event, STAFF_CHANNEL, staff_msg["ts"])
 
-    staff_link = client.chat_getPermalink(channel=STAFF_CHANNEL, message_ts=staff_msg["ts"])["permalink"]
+    staff_link = permalink(STAFF_CHANNEL, staff_msg["ts"])
+    cache.forget_ticket_miss(event["ts"], staff_msg["ts"])
     ticket_id = db.save_ticket(user_id, user_name, user_avatar, text or "📎 attachment", event["ts"], staff_msg["ts"])
 
     if not ticket_id:
@@ -552,9 +550,8 @@ def edit_message(event):
         return
 
     if message == "This message was deleted.":
-        if message_ts in cache.deleted_headers:
+        if not cache.mark_header_deleted(message_ts):
             return
-        cache.deleted_headers.add(message_ts)
         resp = client.chat_postMessage(
             channel=STAFF_CHANNEL,
             thread_ts=ticket["staff_thread_ts"],
@@ -564,7 +561,7 @@ def edit_message(event):
         return
 
     if event.get("message", {}).get("thread_ts") == event.get("message", {}).get("ts"):
-        user_thread_link = client.chat_getPermalink(channel=USER_CHANNEL, message_ts=message_ts)["permalink"]
+        user_thread_link = permalink(USER_CHANNEL, message_ts)
         client.chat_update(
             channel=STAFF_CHANNEL,
             ts=ticket["staff_thread_ts"],
@@ -573,6 +570,6 @@ def edit_message(event):
         )
         return
 
-    dest_message_ts = db.get_dest_message_ts(message_ts)
+    dest_message_ts = cache.get_dest_message_ts(message_ts)
     if dest_message_ts:
         client.chat_update(channel=STAFF_CHANNEL, ts=dest_message_ts, text=message)
@@ -0,0 +1,155 @@
+import logging, queue, random, threading, time, uuid
+from time import monotonic
+from slack_sdk.errors import SlackApiError
+import dead_letter, task_journal
+from globals import TASK_MAX_ATTEMPTS, TASK_RETRY_BASE_MS, TASK_RETRY_MAX_MS, client
+
+logger = logging.getLogger("slack_queue")
+
+# Fire-and-forget Slack calls, registered by WebClient method name so the journal can replay them.
+# Each method is assigned its Slack rate-limit tier; every tier gets its own token bucket and thread,
+# so a throttled tier never holds up another and none of them share the DB writer shards.
+METHOD_TIERS: dict[str, str] = {
+    "reactions_add": "tier3",
+}
+
+# (requests per minute, burst) - https://api.slack.com/apis/rate-limits
+TIER_LIMITS: dict[str, tuple[int, int]] = {
+    "tier3": (50, 5),
+}
+
+# Slack errors that fail the same way on every attempt, so the call is dropped. Anything else (5xx,
+# internal_error, fatal_error, ...) is retried and dead-lettered like any other exception.
+PERMANENT_ERRORS = {
+    "already_reacted",
+    "bad_timestamp",
+    "channel_not_found",
+    "invalid_name",
+    "is_archived",
+    "message_not_found",
+    "no_item_specified",
+    "not_in_channel",
+    "thread_locked",
+    "too_many_emoji",
+    "too_many_reactions",
+    "account_inactive",
+    "invalid_auth",
+    "missing_scope",
+    "not_authed",
+    "token_revoked",
+}
+
+
+def _journal_name(method: str) -> str:
+    return f"slack.{method}"
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int, burst: int):
+        self.rate = per_minute / 60
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = monotonic()
+
+    def take(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            time.sleep((1 - self.tokens) / self.rate)
+            self.tokens = 1.0
+            self.updated = monotonic()
+        self.tokens -= 1
+
+
+class TierDispatcher:
+    def __init__(self, tier: str):
+        self.tier = tier
+        self.queue: queue.Queue = queue.Queue()
+        self.bucket = TokenBucket(*TIER_LIMITS[tier])
+        self.sent = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    def stats(self) -> dict:
+        return {"depth": self.queue.qsize(), "sent": self.sent, "rate_limited": self.rate_limited, "failed": self.failed}
+
+    def _send(self, task_id: str, method: str, kwargs: dict):
+        attempts = 0
+        while True:
+            self.bucket.take()
+            attempts += 1
+            try:
+                getattr(client, method)(**kwargs)
+                self.sent += 1
+                return
+            except SlackApiError as e:
+                if e.response.status_code == 429:
+                    # the bucket guessed wrong; Slack says exactly how long to back off, and the call stays at the head
+                    retry_after = int(e.response.headers.get("Retry-After", 1))
+                    self.rate_limited += 1
+                    logger.warning(f"{method} rate limited, sleeping {retry_after}s")
+                    time.sleep(retry_after)
+                    continue
+                if e.response.get("error") in PERMANENT_ERRORS:
+                    self.failed += 1
+                    logger.warning(f"{method} failed error={e.response.get('error')}")
+                    return
+                error = e
+            except Exception as e:
+                error = e
+            if attempts >= TASK_MAX_ATTEMPTS:
+                self.failed += 1
+                dead_letter.add(task_id, _journal_name(method), (), kwargs, error, attempts)
+                logger.error(f"{method} dead-lettered after {attempts} attempt(s): {error}")
+                return
+            delay = random.uniform(0, min(TASK_RETRY_MAX_MS, TASK_RETRY_BASE_MS * 2 ** (attempts - 1))) / 1000
+            logger.warning(f"{method} failed (attempt {attempts}), retrying in {delay:.1f}s: {error}")
+            time.sleep(delay)
+
+    def run(self):
+        while True:
+            task_id, method, kwargs = self.queue.get()
+            task_journal.record_start(task_id)
+            try:
+                self._send(task_id, method, kwargs)
+            except Exception as e:
+                logger.exception(f"Unhandled error in slack tier {self.tier}: {e}")
+            finally:
+                task_journal.record_done(task_id)
+                self.queue.task_done()
+
+
+dispatchers = {tier: TierDispatcher(tier) for tier in TIER_LIMITS}
+
+
+def _dispatch(task_id: str, method: str, kwargs: dict):
+    dispatchers[METHOD_TIERS[method]].queue.put((task_id, method, kwargs))
+
+
+def _enqueue(task_id: str, method: str, kwargs: dict):
+    task_journal.record_enqueue(task_id, _journal_name(method), (), kwargs)
+    _dispatch(task_id, method, kwargs)
+
+
+def call(method: str, **kwargs):
+    if method not in METHOD_TIERS:
+        raise ValueError(f"slack_queue: {method!r} is not a registered method")
+    _enqueue(str(uuid.uuid4()), method, kwargs)
+
+
+def replay(fn_name: str, kwargs: dict, task_id: str | None = None) -> bool:
+    method = fn_name.removeprefix("slack.")
+    if not fn_name.startswith("slack.") or method not in METHOD_TIERS:
+        return False
+    _enqueue(task_id or str(uuid.uuid4()), method, kwargs)
+    return True
+
+
+def stats() -> dict:
+    return {tier: d.stats() for tier, d in dispatchers.items()}
+
+
+def run():
+    for tier, dispatcher in dispatchers.items():
+        threading.Thread(target=dispatcher.run, daemon=True, name=f"slack-{tier}").start()
@@ -1,21 +1,147 @@
-import json, logging, os, threading
+import glob, json, logging, os, threading, time
 from datetime import datetime, timezone
-from globals import TASK_JOURNAL_PATH
+from globals import TASK_JOURNAL_FSYNC, TASK_JOURNAL_FSYNC_MS, TASK_JOURNAL_PATH, TASK_JOURNAL_SEGMENT_BYTES
 
+# fsync policy:
+#   "always"   - append() blocks until its record is fsynced; concurrent appends share one fsync (group commit)
+#   "interval" - the flusher writes and fsyncs whatever is buffered every TASK_JOURNAL_FSYNC_MS
+#   "os"       - records are written promptly but left to the OS page cache
+#
+# The journal is a series of segments: TASK_JOURNAL_PATH.000001, .000002, ...
+# Each segment opens with a checkpoint record listing the task ids still pending at that point.
+# Once every task enqueued in a segment is done the segment is deleted by the flusher thread,
+# so what's on disk (and what replay has to read) tracks pending work, not total history.
 lock = threading.RLock()
+_cond = threading.Condition()
+_buffer: list[tuple] = []
+_appended = 0
+_flushed = 0
+_file = None
+_segment = 0
+_live: dict[str, int] = {}  # pending task id -> segment holding its enqueue record
+_recovered = False
+_flusher: threading.Thread | None = None
 
 
 def now() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def append(record: dict):
+def _segment_path(n: int) -> str:
+    return f"{TASK_JOURNAL_PATH}.{n:06d}"
+
+
+def _segments_on_disk() -> list[int]:
+    found = []
+    for path in glob.glob(f"{glob.escape(TASK_JOURNAL_PATH)}.*"):
+        suffix = path.rsplit(".", 1)[-1]
+        if suffix.isdigit():
+            found.append(int(suffix))
+    return sorted(found)
+
+
+def _sync():
+    _file.flush()
+    if TASK_JOURNAL_FSYNC != "os":
+        os.fsync(_file.fileno())
+
+
+def _open_segment(n: int):
+    global _file, _segment
+    _segment = n
+    _file = open(_segment_path(n), "a", encoding="utf-8")
+    if _recovered:
+        # before recovery _live doesn't know about the previous run's pending tasks, so a checkpoint would hide them
+        _file.write(json.dumps({"checkpoint": list(_live), "ts": now()}) + "\n")
+        _sync()
+
+
+def _retire():
+    # every segment older than the oldest one holding a pending task is fully done
+    if not _recovered:
+        return
+    floor = min(_live.values(), default=_segment)
+    for n in _segments_on_disk():
+        if n >= min(floor, _segment):
+            break
+        try:
+            os.remove(_segment_path(n))
+        except OSError as e:
+            logging.error(f"task_journal: could not remove segment {n}: {e}")
+
+
+def _rotate():
+    if _file is not None:
+        _file.close()
+    _open_segment(max(_segments_on_disk(), default=_segment) + 1)
+    _retire()
+
+
+def _write(batch: list[tuple]):
     with lock:
         try:
-            with open(TASK_JOURNAL_PATH, "a", encoding="utf-8") as f:
-                f.write(json.dumps(record) + "\n")
+            if _file is None or _file.closed:
+                _rotate()
+            _file.write("".join(line for line, _, _, _ in batch))
+            _sync()
+            for _, task_id, status, has_fn in batch:
+                if status == "done":
+                    _live.pop(task_id, None)
+                elif has_fn:
+                    _live[task_id] = _segment
+            if _file.tell() >= TASK_JOURNAL_SEGMENT_BYTES:
+                _rotate()
         except OSError as e:
-            logging.error(f"task_journal append failed: {e}")
+            logging.error(f"task_journal write failed: {e}")
+
+
+def _flush_loop():
+    global _buffer, _flushed
+    while True:
+        with _cond:
+            while not _buffer:
+                _cond.wait()
+        if TASK_JOURNAL_FSYNC == "interval":
+            time.sleep(TASK_JOURNAL_FSYNC_MS / 1000)
+        with _cond:
+            batch, _buffer = _buffer, []
+            upto = _appended
+        _write(batch)
+        with _cond:
+            _flushed = upto
+            _cond.notify_all()
+
+
+def append(record: dict):
+    global _appended, _flusher
+    line = json.dumps(record) + "\n"
+    with _cond:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, daemon=True, name="journal")
+            _flusher.start()
+        _buffer.append((line, record.get("id"), record.get("status"), "fn" in record))
+        _appended += 1
+        seq = _appended
+        _cond.notify_all()
+        if TASK_JOURNAL_FSYNC == "always":
+            while _flushed < seq:
+                _cond.wait()
+
+
+def flush():
+    with _cond:
+        target = _appended
+        while _flushed < target:
+            _cond.wait()
+
+
+def close():
+    global _file
+    flush()
+    with lock:
+        if _file is not None:
+            _file.close()
+            _file = None
 
 
 def record_enqueue(task_id: str, fn_name: str, args: tuple, kwargs: dict):
@@ -43,51 +169,54 @@ def record_done(task_id: str):
     append({"id": task_id, "status": "done", "ts": now()})
 
 
+def _replay_paths() -> list[str]:
+    paths = [TASK_JOURNAL_PATH] if os.path.exists(TASK_JOURNAL_PATH) else []  # pre-segment journal file
+    return paths + [_segment_path(n) for n in _segments_on_disk()]
+
+
 def load_pending() -> list[dict]:
-    if not os.path.exists(TASK_JOURNAL_PATH):
-        return []
-    full_records: dict[str, dict] = {}
-    latest_status: dict[str, str] = {}
+    flush()
+    pending: dict[str, dict] = {}
     with lock:
-        try:
-            with open(TASK_JOURNAL_PATH, encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    try:
-                        record = json.loads(line)
-                    except json.JSONDecodeError:
-                        continue
-                    task_id = record.get("id")
-                    if not task_id:
-                        continue
-                    if "fn" in record:
-                        full_records[task_id] = record
-                    latest_status[task_id] = record["status"]
-        except OSError as e:
-            logging.error(f"task_journal load failed: {e}")
-            return []
-    return [
-        {**full_records[tid], "status": latest_status[tid]}
-        for tid in full_records
-        if latest_status.get(tid) != "done"
-    ]
+        for path in _replay_paths():
+            try:
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            record = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if "checkpoint" in record:
+                            keep = set(record["checkpoint"])
+                            pending = {tid: r for tid, r in pending.items() if tid in keep}
+                            continue
+                        task_id = record.get("id")
+                        if not task_id:
+                            continue
+                        if "fn" in record:
+                            pending[task_id] = record
+                        elif record.get("status") == "done":
+                            pending.pop(task_id, None)
+                        elif task_id in pending:
+                            pending[task_id] = {**pending[task_id], "status": record["status"]}
+            except OSError as e:
+                logging.error(f"task_journal load failed for {path}: {e}")
+    return list(pending.values())
 
 
 def compact():
-    pending = load_pending()
+    """Call once replayed tasks have been re-enqueued: drops every segment from before this boot.
+    Replay re-enqueues under the original task ids, so dying before this runs can't double a task."""
+    global _recovered
+    flush()
     with lock:
-        try:
-            with open(TASK_JOURNAL_PATH, "w", encoding="utf-8") as f:
-                for task in pending:
-                    f.write(json.dumps({
-                        "id": task["id"],
-                        "fn": task["fn"],
-                        "args": task["args"],
-                        "kwargs": task.get("kwargs", {}),
-                        "status": "pending",
-                        "ts": now(),
-                    }) + "\n")
-        except OSError as e:
-            logging.error(f"task_journal compact failed: {e}")
+        _recovered = True
+        if os.path.exists(TASK_JOURNAL_PATH):
+            try:
+                os.remove(TASK_JOURNAL_PATH)
+            except OSError as e:
+                logging.error(f"task_journal: could not remove legacy journal: {e}")
+        _rotate()
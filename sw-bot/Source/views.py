@@ -160,6 +160,67 @@ def cache_dump(data: dict) -> dict:
         b.append(section("_no cached keys_"))
     b.append(divider)
 
+    mem = data["memory"]
+    b.append(header("Memory"))
+    lines = [
+        f"`{name}` — {size}/{mem['limits'][name]} ({mem['evictions'][name]} evicted)"
+        for name, size in mem["sizes"].items()
+    ]
+    lines.append(f"*Expired:* {mem['expirations']}  *Thread index:* {mem['thread_index']}  *Known misses:* {mem['ticket_misses']}")
+    rss = f"{mem['rss_kb'] // 1024} MB" if mem["rss_kb"] is not None else "n/a"
+    lines.append(f"*RSS:* {rss}  *Peak RSS:* {mem['max_rss_kb'] // 1024} MB")
+    b += [section("\n".join(lines)), divider]
+
+    shards = data["write_shards"]
+    b.append(header(f"Write Queue ({len(shards)} shards)"))
+    lines = [
+        f"`#{i}` depth {s['depth']} — {s['processed']} done, wait avg {s['avg_wait_ms']}ms / max {s['max_wait_ms']}ms"
+        for i, s in enumerate(shards)
+    ]
+    b += [section("\n".join(lines)), divider]
+
+    tiers = data["slack_queue"]
+    b.append(header("Slack Queue"))
+    lines = [
+        f"`{tier}` depth {t['depth']} — {t['sent']} sent, {t['rate_limited']} rate limited, {t['failed']} failed"
+        for tier, t in tiers.items()
+    ]
+    b += [section("\n".join(lines)), divider]
+
+    p = data["db_pool"]
+    b += [header("DB Pool"), section(
+        f"*In Use:* {p['in_use']} — {p['checkouts']} checkouts, wait avg {p['avg_wait_ms']}ms / max {p['wait_ms_max']}ms\n"
+        f"*Saturation:* {int(p['saturation'] * 100)}% of {p['size']} ({p['readers']} readers, {p['writers']} writers, {p['reserved_for_writers']} reserved) — "
+        f"{p['queued']} queued (max {p['max_queued']}), {p['waited_pct']}% waited, {p['timeouts']} timeouts\n"
+        f"*Validations:* {p['validations']} ({p['validation_failures']} failed)\n"
+        f"*Dead Conn Retries:* {p['dead_conn_retries']} — *Rebuilds:* {p['rebuilds']}\n"
+        f"*Replica:* " + (
+            f"{p['replica_reads']} reads, lag {p['replica_lag_s'] if p['replica_lag_s'] is not None else '?'}s — "
+            f"{p['replica_stale']} too stale, {p['replica_unavailable']} unavailable, {p['replica_fallbacks']} failed over"
+            if p["replica_configured"] else "not configured"
+        )
+    ), divider]
+
+    n = data["db_listener"]
+    b += [header("Live Invalidation"), section(
+        f"*Listener:* {'connected' if n['connected'] else 'disconnected (TTLs only)'} — {n['connects']} connects\n"
+        f"*Notifications:* {n['received']} received, {n['applied']} applied, {n['own']} own writes, {n['bad_payloads']} bad"
+    ), divider]
+
+    q = data["db_queries"]
+    b.append(header("DB Queries"))
+    lines = [
+        f"`{name}` {f['calls']} calls — avg {f['avg_ms']}ms, p95 ≤{f['p95_ms']}ms, max {f['max_ms']}ms, {f['rows']} rows, {f['errors']} errors"
+        for name, f in list(q["functions"].items())[:10]
+    ]
+    b.append(section("\n".join(lines) or "No queries yet."))
+    slow = q["slow_queries"][-5:]
+    if slow:
+        b.append(section(f"*Slow (≥{q['slow_threshold_ms']:.0f}ms):*\n" + "\n".join(
+            f"`{s['fn']}` {s['ms']}ms — `{s['sql'][:150]}` ({s['param_count']} params)"[:300] for s in reversed(slow)
+        )))
+    b.append(divider)
+
     b += [header("Misc"), section(
         f"*Ignorable:* {data['ignorable_count']}\n"
         f"*Deleted Headers:* {data['deleted_headers_count']}\n"
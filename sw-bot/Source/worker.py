@@ -1,15 +1,18 @@
-import logging, uuid, queue
+import heapq, inspect, itertools, logging, random, threading, time, uuid, queue
+from collections import deque
+from time import monotonic
 from typing import Callable
 from slack_sdk.errors import SlackApiError
-import blocks, cache, db, task_journal
-from globals import META_CHANNEL, USER_CHANNEL, client
+import blocks, cache, db, dead_letter, slack_queue, task_journal
+from globals import (
+    META_CHANNEL, SAVE_BATCH_LINGER_MS, SAVE_BATCH_SIZE, TASK_MAX_ATTEMPTS, TASK_RETRY_BASE_MS,
+    TASK_RETRY_MAX_MS, USER_CHANNEL, WRITE_WORKERS, client,
+)
 from helpers import find_meta_sticky_from_history
 # from helpers import find_sticky_from_history  # user sticky
 
 logger = logging.getLogger("worker")
 
-write_queue: queue.Queue = queue.Queue()
-
 TASK_REGISTRY: dict[str, Callable] = {
     f"db.{name}": getattr(db, name)
     for name in (
@@ -22,29 +25,329 @@ TASK_REGISTRY: dict[str, Callable] = {
 }
 
 
+# Tasks that touch the same ticket (or user / meta post) must run in order, so they are routed to a
+# fixed shard by this key. Anything without a key has no ordering constraint and is spread round-robin.
+SHARD_KEYS: dict[str, Callable] = {
+    "db.save_message": lambda a, kw: ("ticket", a[0] if a else kw.get("ticket_id")),
+    "db.close_ticket": lambda a, kw: ("ticket", a[0]),
+    "db.open_ticket": lambda a, kw: ("ticket", a[0]),
+    "db.claim_ticket": lambda a, kw: ("ticket", a[0]),
+    # payouts only touch users/sys_logs, so they're keyed by shipwright and get coalesced on one shard
+    "db.add_stardust": lambda a, kw: ("user", a[0] if a else kw.get("slack_id")),
+    "db.save_feedback": lambda a, kw: ("ticket", a[0]),
+    "db.save_resolve_message_ts": lambda a, kw: ("ticket", a[0]),
+    "db.mark_feedback_requested": lambda a, kw: ("ticket", a[0]),
+    "db.create_ticket_user": lambda a, kw: ("user", a[0]),
+    "db.update_ticket_user_opt": lambda a, kw: ("user", a[0]),
+    "db.save_meta": lambda a, kw: ("meta", a[1] if len(a) > 1 else kw.get("meta_message_ts")),
+    "db.update_meta_votes": lambda a, kw: ("meta", a[0]),
+    "db.edit_message": lambda a, kw: ("msg", a[0]),
+}
+_round_robin = itertools.count()
+
+# save_error failing would log an error, which enqueues another save_error; never retry or dead-letter it
+NO_RETRY = {"db.save_error"}
+
+_attempts: dict[str, int] = {}
+_retry_heap: list = []
+_retry_cond = threading.Condition()
+_retry_seq = itertools.count()
+
+
+def _fn_name(fn: Callable) -> str:
+    return f"{fn.__module__}.{fn.__name__}"
+
+
+def shard_key(fn_name: str, args, kwargs) -> tuple | None:
+    key_fn = SHARD_KEYS.get(fn_name)
+    if key_fn is None:
+        return None
+    try:
+        key = key_fn(args, kwargs)
+    except (IndexError, TypeError):
+        return None
+    return None if key[1] is None else key
+
+
+def shard_for(fn_name: str, args, kwargs) -> int:
+    key = shard_key(fn_name, args, kwargs)
+    if key is None:
+        return next(_round_robin) % WRITE_WORKERS
+    return hash(key) % WRITE_WORKERS
+
+
+def _dispatch(task_id: str, fn_name: str, fn: Callable, args, kwargs):
+    shards[shard_for(fn_name, args, kwargs)].queue.put((task_id, fn, args, kwargs, monotonic()))
+
+
+def _schedule_retry(delay: float, task_id: str, fn_name: str, fn: Callable, args, kwargs):
+    with _retry_cond:
+        heapq.heappush(_retry_heap, (monotonic() + delay, next(_retry_seq), task_id, fn_name, fn, args, kwargs))
+        _retry_cond.notify()
+
+
+def retry_loop():
+    while True:
+        with _retry_cond:
+            while not _retry_heap or _retry_heap[0][0] > monotonic():
+                _retry_cond.wait(timeout=_retry_heap[0][0] - monotonic() if _retry_heap else None)
+            _, _, task_id, fn_name, fn, args, kwargs = heapq.heappop(_retry_heap)
+        _dispatch(task_id, fn_name, fn, args, kwargs)
+
+
+def _call(fn: Callable, args, kwargs) -> Exception | None:
+    db.take_last_error()
+    try:
+        fn(*args, **kwargs)
+    except Exception as e:
+        return e
+    return db.take_last_error()
+
+
+def _finish(task_id: str, fn: Callable, args, kwargs, error: Exception | None) -> bool:
+    """Records the outcome of a task; returns True if it was scheduled for another attempt."""
+    if error is None:
+        _attempts.pop(task_id, None)
+        task_journal.record_done(task_id)
+        return False
+    fn_name = _fn_name(fn)
+    attempts = _attempts.pop(task_id, 0) + 1
+    if fn_name in NO_RETRY:
+        logger.warning(f"write task {fn_name} failed, not retrying: {error}")
+        task_journal.record_done(task_id)
+    elif not db.is_retryable(error) or attempts >= TASK_MAX_ATTEMPTS:
+        dead_letter.add(task_id, fn_name, args, kwargs, error, attempts)
+        task_journal.record_done(task_id)
+        logger.error(f"write task {fn_name} dead-lettered after {attempts} attempt(s): {error}")
+    else:
+        # full jitter: uniform in [0, min(cap, base * 2^n)]
+        delay = random.uniform(0, min(TASK_RETRY_MAX_MS, TASK_RETRY_BASE_MS * 2 ** (attempts - 1))) / 1000
+        _attempts[task_id] = attempts
+        logger.warning(f"write task {fn_name} failed (attempt {attempts}), retrying in {delay:.1f}s: {error}")
+        _schedule_retry(delay, task_id, fn_name, fn, args, kwargs)
+        return True
+    return False
+
+
+def redrive(entry: dict) -> bool:
+    if slack_queue.replay(entry["fn"], entry.get("kwargs", {})):
+        return True
+    fn = TASK_REGISTRY.get(entry["fn"])
+    if fn is None:
+        return False
+    enqueue(fn, *entry["args"], **entry.get("kwargs", {}))
+    return True
+
+
+_SAVE_MESSAGE_SIGNATURE = inspect.signature(db.save_message)
+_ADD_STARDUST_SIGNATURE = inspect.signature(db.add_stardust)
+
+
+def _add_stardust_batch(calls: list[tuple[tuple, dict]]) -> bool:
+    awards = []
+    for args, kwargs in calls:
+        bound = _ADD_STARDUST_SIGNATURE.bind(*args, **kwargs)
+        bound.apply_defaults()
+        awards.append((bound.arguments["slack_id"], bound.arguments["ticket_id"], bound.arguments["amount"]))
+    return db.add_stardust_bulk(awards) is not None
+
+
+# consecutive queued calls of these functions on a shard are applied together by their bulk counterpart,
+# which returns False on failure so the shard can fall back to running them one by one
+BATCHERS: dict[Callable, Callable] = {
+    db.save_message: db.save_messages,
+    db.add_stardust: _add_stardust_batch,
+}
+
+
+def _note_message_link(args, kwargs):
+    # the relayed pair is known before the row is written, so edits/deletes of it never need the db
+    try:
+        bound = _SAVE_MESSAGE_SIGNATURE.bind(*args, **kwargs).arguments
+    except TypeError:
+        return
+    if bound.get("message_ts") or bound.get("origin_message_ts"):
+        cache.cache.remember_message_link(bound["ticket_id"], bound.get("message_ts"), bound.get("origin_message_ts"))
+
+
 def enqueue(fn: Callable, *args, **kwargs):
     task_id = str(uuid.uuid4())
-    task_journal.record_enqueue(task_id, f"{fn.__module__}.{fn.__name__}", args, kwargs)
-    write_queue.put((task_id, fn, args, kwargs))
+    fn_name = _fn_name(fn)
+    if fn is db.save_message:
+        _note_message_link(args, kwargs)
+    task_journal.record_enqueue(task_id, fn_name, args, kwargs)
+    _dispatch(task_id, fn_name, fn, args, kwargs)
 
 
 def load_and_replay():
     pending = task_journal.load_pending()
-    task_journal.compact()
     replayed = 0
     for task in pending:
+        # re-enqueued under the same id: if we die again before compact() retires the old segments,
+        # the next replay sees both enqueue records as one task instead of running it twice
+        if slack_queue.replay(task["fn"], task.get("kwargs", {}), task["id"]):
+            replayed += 1
+            continue
         fn = TASK_REGISTRY.get(task["fn"])
         if fn is None:
             logger.warning(f"load_and_replay: unknown function {task['fn']!r}, skipping")
             continue
-        task_id = str(uuid.uuid4())
-        task_journal.record_enqueue(task_id, task["fn"], task["args"], task.get("kwargs", {}))
-        write_queue.put((task_id, fn, task["args"], task.get("kwargs", {})))
+        if fn is db.save_message:
+            _note_message_link(task["args"], task.get("kwargs", {}))
+        task_journal.record_enqueue(task["id"], task["fn"], task["args"], task.get("kwargs", {}))
+        _dispatch(task["id"], task["fn"], fn, task["args"], task.get("kwargs", {}))
         replayed += 1
+    task_journal.compact()
     if replayed:
         logger.info(f"Replayed {replayed} pending tasks from journal")
 
 
+class WriteShard:
+    def __init__(self, index: int):
+        self.index = index
+        self.queue: queue.Queue = queue.Queue()
+        self._held: tuple | None = None
+        # A task waiting on a retry parks its shard key: later tasks with that key are set aside here, in order,
+        # instead of overtaking it, and go back on the queue one at a time once it has succeeded or been dead-lettered.
+        # Only this shard's thread touches it (a key always maps to the same shard).
+        self.parked: dict[tuple, list] = {}  # shard key -> [id of the task allowed to run, deque of tasks held back]
+        self.processed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def stats(self) -> dict:
+        held = sum(len(waiting) for _, waiting in list(self.parked.values()))
+        return {
+            "depth": self.queue.qsize() + (self._held is not None) + held,
+            "parked_keys": len(self.parked),
+            "processed": self.processed,
+            "avg_wait_ms": round(self.wait_total / self.processed * 1000, 1) if self.processed else 0.0,
+            "max_wait_ms": round(self.wait_max * 1000, 1),
+        }
+
+    def _record_wait(self, enqueued_at: float):
+        waited = monotonic() - enqueued_at
+        self.processed += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def _next_task(self, timeout: float):
+        if self._held is not None:
+            task, self._held = self._held, None
+            return task
+        return self.queue.get(timeout=timeout)
+
+    def _divert(self, task: tuple) -> bool:
+        parked = self.parked.get(shard_key(_fn_name(task[1]), task[2], task[3]))
+        if parked is None or parked[0] == task[0]:
+            return False
+        parked[1].append(task)
+        return True
+
+    def _settle(self, task: tuple, retrying: bool):
+        key = shard_key(_fn_name(task[1]), task[2], task[3])
+        if key is None:
+            return
+        parked = self.parked.get(key)
+        if retrying:
+            if parked is None:
+                self.parked[key] = [task[0], deque()]
+            return
+        if parked is None or parked[0] != task[0]:
+            return
+        if parked[1]:
+            released = parked[1].popleft()
+            parked[0] = released[0]
+            self.queue.put(released)
+        else:
+            del self.parked[key]
+
+    def _drain_batch(self, first: tuple) -> list:
+        # pull consecutive calls of the same batchable function off the queue; anything else is held for the next loop
+        batch = [first]
+        deadline = monotonic() + SAVE_BATCH_LINGER_MS / 1000
+        while len(batch) < SAVE_BATCH_SIZE:
+            remaining = deadline - monotonic()
+            try:
+                task = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if task[1] is not first[1]:
+                self._held = task
+                break
+            if self._divert(task):
+                self.queue.task_done()
+                continue
+            batch.append(task)
+        return batch
+
+    def _run_task(self, task_id, fn, args, kwargs, enqueued_at):
+        self._record_wait(enqueued_at)
+        task_journal.record_start(task_id)
+        try:
+            retrying = _finish(task_id, fn, args, kwargs, _call(fn, args, kwargs))
+            self._settle((task_id, fn, args, kwargs, enqueued_at), retrying)
+        finally:
+            self.queue.task_done()
+
+    def _run_batch(self, batch: list):
+        if len(batch) == 1:
+            self._run_task(*batch[0])
+            return
+        fn = batch[0][1]
+        for task_id, _, _, _, enqueued_at in batch:
+            self._record_wait(enqueued_at)
+            task_journal.record_start(task_id)
+        try:
+            try:
+                applied = BATCHERS[fn]([(args, kwargs) for _, _, args, kwargs, _ in batch])
+            except Exception as e:
+                logger.exception(f"{_fn_name(fn)} batch raised: {e}")
+                applied = False
+            error = db.take_last_error()
+            if applied:
+                # a batch whose commit failed may still have landed; dead-letter it rather than insert it twice
+                outcome = error if isinstance(error, db.CommitOutcomeUnknown) else None
+                for task in batch:
+                    task_id, fn, args, kwargs, _ = task
+                    self._settle(task, _finish(task_id, fn, args, kwargs, outcome))
+            else:
+                logger.warning(f"{_fn_name(fn)} batch of {len(batch)} failed, falling back to single calls")
+                for task in batch:
+                    if self._divert(task):
+                        continue  # an earlier call with its key just failed and is waiting on a retry
+                    task_id, fn, args, kwargs, _ = task
+                    self._settle(task, _finish(task_id, fn, args, kwargs, _call(fn, args, kwargs)))
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    def run(self):
+        db.mark_writer_thread()
+        while True:
+            try:
+                task = self._next_task(timeout=0.5)
+            except queue.Empty:
+                continue
+            if self._divert(task):
+                self.queue.task_done()
+                continue
+            try:
+                if task[1] in BATCHERS:
+                    self._run_batch(self._drain_batch(task))
+                else:
+                    self._run_task(*task)
+            except Exception as e:
+                logger.exception(f"Unhandled error in write shard {self.index}: {e}")
+
+
+shards = [WriteShard(i) for i in range(WRITE_WORKERS)]
+
+
+def stats() -> list[dict]:
+    return [shard.stats() for shard in shards]
+
+
 class Worker:
     def __init__(self):
         self.tasks: list = []
@@ -100,27 +403,22 @@ class Worker:
             logger.error(f"Failed to post meta sticky error={e.response['error']}")
 
     def run(self):
+        for shard in shards:
+            threading.Thread(target=shard.run, daemon=True, name=f"writer-{shard.index}").start()
+        threading.Thread(target=retry_loop, daemon=True, name="retry").start()
         while True:
-            try:
-                task_id, fn, args, kwargs = write_queue.get(timeout=0.1)
-                task_journal.record_start(task_id)
+            time.sleep(0.1)
+            if not all(shard.queue.empty() for shard in shards):
+                continue
+            working_copy, self.tasks = self.tasks, []
+            for task in working_copy:
                 try:
-                    fn(*args, **kwargs)
+                    # if task == "update_sticky_message":  # user sticky
+                    #     self.update_sticky_message()
+                    if task == "update_meta_sticky":
+                        self.update_meta_sticky()
                 except Exception as e:
-                    logger.exception(f"write task {fn.__name__} failed: {e}")
-                finally:
-                    task_journal.record_done(task_id)
-                    write_queue.task_done()
-            except queue.Empty:
-                working_copy, self.tasks = self.tasks, []
-                for task in working_copy:
-                    try:
-                        # if task == "update_sticky_message":  # user sticky
-                        #     self.update_sticky_message()
-                        if task == "update_meta_sticky":
-                            self.update_meta_sticky()
-                    except Exception as e:
-                        logger.exception(f"Unhandled error in task={task}: {e}")
+                    logger.exception(f"Unhandled error in task={task}: {e}")
 
 
 task_runner = Worker()
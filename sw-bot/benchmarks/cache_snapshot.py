@@ -0,0 +1,80 @@
+"""
+Cache snapshot save / load time and size at N cached tickets (and as many ticket_users): cache_store's
+versioned pickle snapshot vs the json dump it replaced, plus one delta frame of 100 changes.
+Writes to a temp directory, no database or Slack needed:
+    python benchmarks/cache_snapshot.py [tickets]
+"""
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+TMP = tempfile.mkdtemp(prefix="sw-bench-")
+os.environ["CACHE_SNAPSHOT_PATH"] = os.path.join(TMP, "cache_snapshot.bin")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Source"))
+
+# cache -> worker -> helpers -> cache is circular; loading worker first (as main does) resolves it
+importlib.import_module("worker")
+import cache_store
+from cache import Cache
+
+TICKETS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+
+def build() -> Cache:
+    c = Cache(max_entries={"tickets": TICKETS, "ticket_users": TICKETS, "fetch_times": TICKETS * 2})
+    for i in range(TICKETS):
+        c.ticket_data_saver({
+            "id": i,
+            "user_id": f"U{i:08d}",
+            "user_name": f"user {i}",
+            "question": "How do I get my project shipped? " * 3,
+            "user_thread_ts": f"1700000000.{i:06d}",
+            "staff_thread_ts": f"1700000001.{i:06d}",
+            "status": "closed" if i % 3 else "open",
+            "closed_by": f"U{i % 50:08d}" if i % 3 else None,
+        })
+        c._set_user_opt(f"U{i:08d}", bool(i % 2))
+    return c
+
+
+def timed(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def json_save(c: Cache):
+    data, _ = c.snapshot()
+    with open(os.path.join(TMP, "cache_snapshot.json"), "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+def json_load(c: Cache):
+    with open(os.path.join(TMP, "cache_snapshot.json"), encoding="utf-8") as f:
+        c.restore(json.load(f))
+
+
+c = build()
+rows = [
+    ("json (before)", timed(lambda: json_save(c)), timed(lambda: json_load(Cache(max_entries=c.max_entries))),
+     os.path.getsize(os.path.join(TMP, "cache_snapshot.json"))),
+    ("cache_store v1", timed(lambda: cache_store.save(c)), timed(lambda: cache_store.load(Cache(max_entries=c.max_entries))),
+     os.path.getsize(cache_store.CACHE_SNAPSHOT_PATH)),
+]
+
+for i in range(100):
+    c._set_user_opt(f"U{i:08d}", True)
+delta_s = timed(lambda: cache_store.save_delta(c))
+
+restored = Cache(max_entries=c.max_entries)
+cache_store.load(restored)
+assert restored.tickets.keys() == c.tickets.keys() and isinstance(next(iter(restored.tickets)), int)
+
+print(f"{TICKETS} tickets + {TICKETS} ticket_users")
+print(f"{'format':<16}{'save':>10}{'load':>10}{'size':>12}")
+for name, save_s, load_s, size in rows:
+    print(f"{name:<16}{save_s * 1000:>8.0f}ms{load_s * 1000:>8.0f}ms{size / 1e6:>10.1f}MB")
+print(f"delta frame of 100 changes: {delta_s * 1000:.2f} ms, {os.path.getsize(cache_store.CACHE_DELTA_PATH)} bytes")
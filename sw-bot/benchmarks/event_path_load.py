@@ -0,0 +1,67 @@
+"""
+Load test: concurrent event lookups through the threadpool + psycopg2 path vs the asyncpg path.
+Each simulated event resolves its ticket by thread ts and the ticket owner's opt-in,
+which is what the message handler needs before it can relay anything.
+Run against a seeded database: python benchmarks/event_path_load.py [events] [concurrency]
+"""
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Source"))
+
+import db
+import db_async
+
+EVENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 40  # anyio's default threadpool size
+
+
+def sample_threads(limit: int) -> list[tuple[str, str]]:
+    with db.get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT user_thread_ts, user_id FROM tickets ORDER BY random() LIMIT %s", (limit,))
+            return cur.fetchall()
+
+
+def sync_event(thread_ts: str, user_id: str):
+    db.find_ticket(thread_ts)
+    db.get_ticket_user(user_id)
+
+
+async def async_event(thread_ts: str, user_id: str, sem: asyncio.Semaphore):
+    async with sem:
+        await db_async.find_ticket(thread_ts)
+        await db_async.get_ticket_user(user_id)
+
+
+def run_sync(events) -> float:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        list(pool.map(lambda e: sync_event(*e), events))
+    return time.perf_counter() - started
+
+
+async def run_async(events) -> float:
+    await db_async.init_pool()
+    sem = asyncio.Semaphore(CONCURRENCY)
+    started = time.perf_counter()
+    await asyncio.gather(*(async_event(ts, user, sem) for ts, user in events))
+    elapsed = time.perf_counter() - started
+    await db_async.close_pool()
+    return elapsed
+
+
+threads = sample_threads(500)
+if not threads:
+    sys.exit("no tickets to sample; seed the database first")
+events = [threads[i % len(threads)] for i in range(EVENTS)]
+
+sync_s = run_sync(events)
+async_s = asyncio.run(run_async(events))
+print(f"{EVENTS} events, concurrency {CONCURRENCY}")
+print(f"threadpool + psycopg2: {sync_s:.2f}s  {EVENTS / sync_s:,.0f} events/s")
+print(f"asyncpg:               {async_s:.2f}s  {EVENTS / async_s:,.0f} events/s")
+print(f"sync pool: {db.pool_stats()}")
@@ -0,0 +1,141 @@
+"""
+EXPLAIN ANALYZE for each hot query, to catch index regressions.
+Point DB_* at a local Postgres with the schema and migrations applied, then:
+    python benchmarks/explain_hot_queries.py [--seed N] [--verbose]
+--seed N inserts N synthetic tickets (and 20x as many messages) first and ANALYZEs them; the whole run
+happens in one transaction that is rolled back, so nothing is left behind.
+Exits 1 if any query sequentially scans tickets, ticket_msg_routes or a ticket_msgs partition.
+Lookups by ts are built by db._msg_lookup_sql, so a routed hit should read a single partition; only a ts with no
+route (archived, or missing) falls through to every partition's ts index.
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Source"))
+
+import db
+
+SEED_PREFIX = "explain-seed"
+
+# (name, sql, params) - the statements from db.py with representative parameters
+QUERIES = [
+    ("find_ticket", "SELECT * FROM tickets WHERE staff_thread_ts = %s OR user_thread_ts = %s",
+     (f"{SEED_PREFIX}-s-500", f"{SEED_PREFIX}-s-500")),
+    ("get_dest_message_ts", db._msg_lookup_sql("message_ts", "origin_message_ts = %(ts)s", tail="LIMIT 1"),
+     {"ts": f"{SEED_PREFIX}-o-5000"}),
+    ("find_message_link", db._msg_lookup_sql(
+        "ticket_id, message_ts, origin_message_ts",
+        "(origin_message_ts = %(ts)s OR message_ts = %(ts)s)",
+        tail="ORDER BY (origin_message_ts IS NOT DISTINCT FROM %(ts)s) DESC LIMIT 1",
+    ), {"ts": f"{SEED_PREFIX}-m-5000"}),
+    ("message_belongs_to_ticket",
+     db._msg_lookup_sql("ticket_id", "(message_ts = %(ts)s OR origin_message_ts = %(ts)s) AND ticket_id = %(ticket_id)s",
+                        tail="LIMIT 1"),
+     {"ts": f"{SEED_PREFIX}-m-5000", "ticket_id": 1}),
+    ("edit_message (lookup)", db._msg_lookup_sql("id", "message_ts = %(ts)s"), {"ts": f"{SEED_PREFIX}-m-5000"}),
+    ("unrouted ts (archived)", db._msg_lookup_sql("id", "message_ts = %(ts)s"), {"ts": f"{SEED_PREFIX}-missing"}),
+    ("get_open_tickets", "SELECT * FROM tickets WHERE status = 'open' ORDER BY created_at ASC", ()),
+    ("get_unresolved_tickets_past_24h",
+     "SELECT * FROM tickets WHERE status = 'open' AND created_at <= NOW() - INTERVAL '1 day'", ()),
+    ("closed in last day",
+     "SELECT COUNT(*) FROM tickets WHERE status = 'closed' AND closed_at >= NOW() - INTERVAL '1 day'", ()),
+    ("avg_close_time (week)",
+     "SELECT SUM(close_seconds) / NULLIF(SUM(closed), 0) FROM ticket_hourly_stats WHERE hour >= NOW() - INTERVAL '7 days'", ()),
+    ("old tickets with last reply", """
+        SELECT id, user_id, question, staff_thread_ts, created_at, last_msg_at AS last_reply
+        FROM tickets
+        WHERE status = 'open' AND created_at <= NOW() - INTERVAL '1 day'
+        ORDER BY created_at ASC
+        LIMIT 11
+    """, ()),
+    ("daily stats rollup", """
+        SELECT closed_by, SUM(opened), SUM(closed),
+               SUM(closed) FILTER (WHERE hour >= date_trunc('hour', NOW() - INTERVAL '1 day'))
+        FROM ticket_hourly_stats
+        GROUP BY closed_by
+    """, ()),
+]
+
+WATCHED_TABLES = {"tickets", "ticket_msgs", "ticket_msg_routes"}
+
+
+def seed(cur, tickets: int):
+    cur.execute(
+        """
+        INSERT INTO tickets (user_id, user_name, question, user_thread_ts, staff_thread_ts, status, created_at, closed_at)
+        SELECT 'U' || g, 'seed user', 'seed question',
+               %(p)s || '-u-' || g, %(p)s || '-s-' || g,
+               CASE WHEN g %% 100 = 0 THEN 'open' ELSE 'closed' END,
+               NOW() - (g || ' minutes')::interval,
+               CASE WHEN g %% 100 = 0 THEN NULL ELSE NOW() - (g || ' minutes')::interval + INTERVAL '2 hours' END
+        FROM generate_series(1, %(n)s) AS g
+        """,
+        {"p": SEED_PREFIX, "n": tickets},
+    )
+    cur.execute(
+        """
+        INSERT INTO ticket_msgs (ticket_id, sender_id, sender_name, msg, is_staff, message_ts, origin_message_ts, created_at)
+        SELECT t.id, 'U1', 'seed', 'seed message', g %% 2 = 0,
+               %(p)s || '-m-' || (t.rn * 20 + g), %(p)s || '-o-' || (t.rn * 20 + g),
+               t.created_at + (g || ' minutes')::interval
+        FROM (SELECT id, created_at, row_number() OVER (ORDER BY id) AS rn FROM tickets WHERE user_thread_ts LIKE %(like)s) t
+        CROSS JOIN generate_series(1, 20) AS g
+        """,
+        {"p": SEED_PREFIX, "like": f"{SEED_PREFIX}-u-%"},
+    )
+    cur.execute("ANALYZE tickets")
+    cur.execute("ANALYZE ticket_msgs")
+
+
+def seq_scans(plan: dict) -> list[str]:
+    found = []
+    if plan.get("Actual Loops") == 0:
+        return found
+    relation = plan.get("Relation Name") or ""
+    if plan.get("Node Type") == "Seq Scan" and (relation in WATCHED_TABLES or relation.startswith("ticket_msgs_")):
+        found.append(relation)
+    for child in plan.get("Plans", []):
+        found += seq_scans(child)
+    return found
+
+
+def partitions(plan: dict) -> set[str]:
+    if plan.get("Actual Loops") == 0:
+        return set()  # pruned at run time or gated off (the unrouted fallback after a routed hit)
+    found = {plan["Relation Name"]} if (plan.get("Relation Name") or "").startswith("ticket_msgs_") else set()
+    for child in plan.get("Plans", []):
+        found |= partitions(child)
+    return found
+
+
+def main():
+    seed_count = int(sys.argv[sys.argv.index("--seed") + 1]) if "--seed" in sys.argv else 0
+    verbose = "--verbose" in sys.argv
+    regressions = []
+    with db.get_db() as conn:
+        with conn.cursor() as cur:
+            if seed_count:
+                print(f"Seeding {seed_count} tickets / {seed_count * 20} messages (rolled back afterwards)...")
+                seed(cur, seed_count)
+            for name, sql, params in QUERIES:
+                cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params)
+                result = cur.fetchone()[0]
+                result = json.loads(result) if isinstance(result, str) else result
+                plan = result[0]
+                scans = seq_scans(plan["Plan"])
+                flag = f"  SEQ SCAN on {', '.join(sorted(set(scans)))}" if scans else ""
+                print(f"{name:<34} {plan['Execution Time']:>9.3f} ms  top: {plan['Plan']['Node Type']}{flag}  partitions: {len(partitions(plan['Plan']))}")
+                if verbose:
+                    cur.execute(f"EXPLAIN ANALYZE {sql}", params)
+                    print("\n".join(f"    {row[0]}" for row in cur.fetchall()))
+                if scans:
+                    regressions.append(name)
+        conn.rollback()  # drop the seed rows
+    if regressions:
+        print(f"\n{len(regressions)} quer{'y' if len(regressions) == 1 else 'ies'} fell back to a sequential scan: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
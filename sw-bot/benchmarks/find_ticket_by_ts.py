@@ -0,0 +1,61 @@
+"""
+find_ticket_by_ts lookup latency at 1k / 10k / 100k cached tickets: the thread_index lookup vs the linear
+scan over cache.tickets it replaced. Pure in-memory, no database or Slack needed:
+    python benchmarks/find_ticket_by_ts.py [lookups]
+"""
+import importlib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Source"))
+
+# cache -> worker -> helpers -> cache is circular; loading worker first (as main does) resolves it
+importlib.import_module("worker")
+from cache import Cache
+
+SIZES = (1_000, 10_000, 100_000)
+LOOKUPS = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+
+
+def build(size: int) -> Cache:
+    c = Cache(max_entries={"tickets": size})
+    for i in range(size):
+        c.ticket_data_saver({
+            "id": i,
+            "user_id": f"U{i}",
+            "user_name": "bench",
+            "question": "q",
+            "user_thread_ts": f"1700000000.{i:06d}",
+            "staff_thread_ts": f"1700000001.{i:06d}",
+            "status": "open",
+            "closed_by": None,
+        })
+    return c
+
+
+def linear_scan(c: Cache, ts):
+    with c._lock:
+        for ticket in c.tickets.values():
+            if ticket["staff_thread_ts"] == ts or ticket["user_thread_ts"] == ts:
+                return ticket
+        return None
+
+
+def per_lookup_us(fn, c: Cache, keys: list) -> float:
+    started = time.perf_counter()
+    for ts in keys:
+        if fn(c, ts) is None:
+            raise AssertionError(f"{ts} not found")
+    return (time.perf_counter() - started) / len(keys) * 1e6
+
+
+print(f"{'tickets':>8}  {'linear scan':>14}  {'thread_index':>14}  speedup")
+for size in SIZES:
+    c = build(size)
+    keys = [f"170000000{random.randint(0, 1)}.{random.randrange(size):06d}" for _ in range(LOOKUPS)]
+    # the scan is O(n) per call, so time it on fewer lookups at the larger sizes
+    scan = per_lookup_us(linear_scan, c, keys[: max(100, LOOKUPS * 1_000 // size)])
+    indexed = per_lookup_us(Cache.find_ticket_by_ts, c, keys)
+    print(f"{size:>8}  {scan:>11.2f} us  {indexed:>11.2f} us  x{scan / indexed:,.0f}")
@@ -0,0 +1,45 @@
+"""
+Per-query latency with eager connection validation (SELECT 1 on every checkout, DB_VALIDATE_IDLE_S=0, the old
+behaviour) vs validating only connections idle past DB_VALIDATE_IDLE_S. Runs a cheap hot lookup (find_ticket
+on a ts that doesn't exist) back to back; point DB_* at any database with the schema applied:
+    python benchmarks/pool_validation.py [queries]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Source"))
+
+import db
+
+QUERIES = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+def run(validate_idle_s: float) -> tuple[list[float], int]:
+    db.DB_VALIDATE_IDLE_S = validate_idle_s
+    before = db.pool_stats()["validations"]
+    timings = []
+    for i in range(QUERIES):
+        started = time.perf_counter()
+        db.find_ticket(f"bench-missing-{i}")
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings, db.pool_stats()["validations"] - before
+
+
+def report(label: str, timings: list[float], validations: int):
+    ordered = sorted(timings)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(f"{label:<24} mean {statistics.mean(timings):6.3f} ms   p50 {statistics.median(timings):6.3f} ms   "
+          f"p99 {p99:6.3f} ms   validations {validations}")
+
+
+configured = db.DB_VALIDATE_IDLE_S
+db.init_pool()
+run(configured)  # warm the pool's connections and the server's plan cache
+eager = run(0)
+idle = run(configured)
+print(f"{QUERIES} sequential find_ticket misses")
+report("eager (every checkout)", *eager)
+report(f"idle > {configured:g}s", *idle)
+print(f"saved per query: {statistics.mean(eager[0]) - statistics.mean(idle[0]):.3f} ms")
@@ -0,0 +1,54 @@
+"""
+Worker write throughput for relayed messages: N save_message tasks through one write shard, run one call
+per task as before vs coalesced into db.save_messages batches (SAVE_BATCH_SIZE / SAVE_BATCH_LINGER_MS).
+Point DB_* at a scratch database with the schema applied; the bench ticket and its messages are deleted
+afterwards, which also takes its opened count back out of the hourly rollup:
+    python benchmarks/save_message_batching.py [messages]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+# keep the bench's journal out of the bot's working directory
+os.environ.setdefault("TASK_JOURNAL_PATH", os.path.join(tempfile.mkdtemp(prefix="sw-bench-"), "task_journal.jsonl"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Source"))
+
+import db
+import worker
+
+MESSAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+def run(ticket_id: int, batched: bool) -> float:
+    if not batched:
+        worker.BATCHERS.pop(db.save_message, None)
+    shard = worker.WriteShard(0)
+    threading.Thread(target=shard.run, daemon=True).start()
+    started = time.perf_counter()
+    for i in range(MESSAGES):
+        args = (ticket_id, "U0BENCH", "bench", None, f"bench message {i}", False)
+        shard.queue.put((str(uuid.uuid4()), db.save_message, args, {}, time.monotonic()))
+    shard.queue.join()
+    return time.perf_counter() - started
+
+
+ticket_id = db.save_ticket("U0BENCH", "bench", None, "save_message batching bench", f"bench-u-{uuid.uuid4()}", f"bench-s-{uuid.uuid4()}")
+if ticket_id is None:
+    sys.exit("could not create the bench ticket, check DB_*")
+try:
+    single_s = run(ticket_id, batched=False)
+    worker.BATCHERS[db.save_message] = db.save_messages
+    batched_s = run(ticket_id, batched=True)
+finally:
+    with db.get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM ticket_msgs WHERE ticket_id = %s", (ticket_id,))
+            cur.execute("DELETE FROM tickets WHERE id = %s", (ticket_id,))
+
+print(f"{MESSAGES} save_message tasks on one shard (batch size {worker.SAVE_BATCH_SIZE}, linger {worker.SAVE_BATCH_LINGER_MS} ms)")
+print(f"one insert per task  {single_s:7.2f} s   {MESSAGES / single_s:8.0f} rows/s")
+print(f"save_messages batch  {batched_s:7.2f} s   {MESSAGES / batched_s:8.0f} rows/s")
+print(f"speedup x{single_s / batched_s:.1f}")
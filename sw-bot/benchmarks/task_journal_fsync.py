@@ -0,0 +1,81 @@
+"""
+task_journal under each TASK_JOURNAL_FSYNC policy, plus the reopen-per-record append it replaced:
+  enqueue latency   - record_enqueue from THREADS concurrent handler threads (p50 / p99)
+  worker throughput - one thread recording enqueue + start + done per task, until flushed
+Each policy runs in its own process (the policy is read at import), journaling to a temp directory:
+    python benchmarks/task_journal_fsync.py [tasks] [threads]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+POLICIES = ("reopen", "always", "interval", "os")
+TASKS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+THREADS = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+ARGS = [1234, "U0BENCH", "bench", None, "a relayed message of typical length " * 4, False]
+
+
+def child():
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Source"))
+    import task_journal
+
+    if os.environ["TASK_JOURNAL_FSYNC"] == "reopen":
+        # what append() did before the flusher: open, write, close under the lock, and no fsync
+        def append(record: dict):
+            with task_journal.lock:
+                with open(task_journal.TASK_JOURNAL_PATH, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+
+        task_journal.append = append
+        task_journal.flush = lambda: None
+
+    latencies = []
+
+    def handler(n: int):
+        for _ in range(n):
+            started = time.perf_counter()
+            task_journal.record_enqueue(str(uuid.uuid4()), "db.save_message", ARGS, {})
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=handler, args=(TASKS // THREADS,)) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    task_journal.flush()
+
+    started = time.perf_counter()
+    for _ in range(TASKS):
+        task_id = str(uuid.uuid4())
+        task_journal.record_enqueue(task_id, "db.save_message", ARGS, {})
+        task_journal.record_start(task_id)
+        task_journal.record_done(task_id)
+    task_journal.flush()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        "p50_us": statistics.median(latencies) * 1e6,
+        "p99_us": latencies[int(len(latencies) * 0.99)] * 1e6,
+        "tasks_per_s": TASKS / elapsed,
+    }))
+
+
+if os.environ.get("TASK_JOURNAL_FSYNC"):
+    child()
+    sys.exit()
+
+print(f"{TASKS} tasks, {THREADS} enqueueing threads")
+print(f"{'policy':<10}{'enqueue p50':>14}{'enqueue p99':>14}{'worker tasks/s':>16}")
+for policy in POLICIES:
+    with tempfile.TemporaryDirectory(prefix="sw-bench-") as tmp:
+        env = {**os.environ, "TASK_JOURNAL_FSYNC": policy, "TASK_JOURNAL_PATH": os.path.join(tmp, "task_journal.jsonl")}
+        out = subprocess.run([sys.executable, __file__, *sys.argv[1:]], env=env, capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+    print(f"{policy:<10}{result['p50_us']:>11.1f} us{result['p99_us']:>11.1f} us{result['tasks_per_s']:>16,.0f}")
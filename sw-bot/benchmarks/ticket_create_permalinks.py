@@ -0,0 +1,71 @@
+"""
+Ticket-creation latency: the two permalinks create_ticket needs (user thread + staff header), fetched with
+chat.getPermalink as before vs built by helpers.permalink from the cached auth.test URL.
+Needs SLACK_BOT_TOKEN and two existing messages the bot can see (nothing is posted):
+    python benchmarks/ticket_create_permalinks.py <user_channel> <user_ts> <staff_channel> <staff_ts> [iterations]
+Also checks that both ways produce the same link.
+"""
+import importlib
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Source"))
+
+# cache -> worker -> helpers -> cache is circular; loading worker first (as main does) resolves it
+importlib.import_module("worker")
+import helpers
+from globals import client
+
+if len(sys.argv) < 5:
+    sys.exit(__doc__)
+USER_CHANNEL, USER_TS, STAFF_CHANNEL, STAFF_TS = sys.argv[1:5]
+ITERATIONS = int(sys.argv[5]) if len(sys.argv) > 5 else 20
+
+
+def via_api() -> tuple[str, str]:
+    return (
+        client.chat_getPermalink(channel=USER_CHANNEL, message_ts=USER_TS)["permalink"],
+        client.chat_getPermalink(channel=STAFF_CHANNEL, message_ts=STAFF_TS)["permalink"],
+    )
+
+
+def via_builder() -> tuple[str, str]:
+    return helpers.permalink(USER_CHANNEL, USER_TS), helpers.permalink(STAFF_CHANNEL, STAFF_TS)
+
+
+def measure(fn) -> tuple[list[float], tuple[str, str]]:
+    timings = []
+    links = None
+    for _ in range(ITERATIONS):
+        started = time.perf_counter()
+        links = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+        if fn is via_api:
+            time.sleep(0.5)  # chat.getPermalink is Tier 4; stay well clear of it
+    return timings, links
+
+
+def report(label: str, timings: list[float]):
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{label:<22} mean {statistics.mean(timings):8.2f} ms   p50 {statistics.median(timings):8.2f} ms   p95 {p95:8.2f} ms")
+
+
+started = time.perf_counter()
+helpers.permalink(USER_CHANNEL, USER_TS)  # the one auth.test the bot makes at startup
+print(f"auth.test (once per process): {(time.perf_counter() - started) * 1000:.1f} ms")
+
+api_timings, api_links = measure(via_api)
+local_timings, local_links = measure(via_builder)
+print(f"\n{ITERATIONS} simulated ticket creations, 2 permalinks each")
+report("chat.getPermalink x2", api_timings)
+report("helpers.permalink x2", local_timings)
+saved = statistics.mean(api_timings) - statistics.mean(local_timings)
+print(f"\nsaved per ticket: {saved:.1f} ms, 2 Slack API calls")
+
+for api, local in zip(api_links, local_links):
+    if api.split("?")[0] != local:
+        sys.exit(f"MISMATCH: api {api} != local {local}")
+print("links match")
@@ -1,6 +1,6 @@
 """
 Migration 001: add last_bumped_at to tickets
-Run once: python migrations/001_add_last_bumped_at.py
+Applied by migrations/migrate.py; can still be run on its own: python migrations/001_add_last_bumped_at.py
 """
 import sys
 import os
@@ -9,7 +9,8 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Source"))
 
 import db
 
-with db.get_db() as conn:
+
+def up(conn):
     with conn.cursor() as cur:
         cur.execute(
             """
@@ -17,4 +18,9 @@ with db.get_db() as conn:
             ADD COLUMN IF NOT EXISTS last_bumped_at TIMESTAMPTZ DEFAULT NULL;
             """
         )
-    print("Migration 001 complete: last_bumped_at added to tickets.")
+
+
+if __name__ == "__main__":
+    with db.get_db() as conn:
+        up(conn)
+        print("Migration 001 complete: last_bumped_at added to tickets.")
@@ -0,0 +1,37 @@
+"""
+Migration 002: indexes for the hot lookups
+- find_ticket:                   tickets.staff_thread_ts OR tickets.user_thread_ts (bitmap OR of both)
+- get_dest_message_ts & co:      ticket_msgs.origin_message_ts, ticket_msgs.message_ts
+- last reply per ticket:         ticket_msgs(ticket_id, created_at)
+- open / stale ticket scans:     tickets(status, created_at)
+- closed-in-period stats:        tickets.closed_at
+Built CONCURRENTLY so the bot keeps writing while they build, which means this can't run in a transaction.
+"""
+
+TRANSACTIONAL = False
+
+INDEXES = {
+    "tickets_staff_thread_ts_idx": "tickets (staff_thread_ts)",
+    "tickets_user_thread_ts_idx": "tickets (user_thread_ts)",
+    "ticket_msgs_origin_message_ts_idx": "ticket_msgs (origin_message_ts)",
+    "ticket_msgs_message_ts_idx": "ticket_msgs (message_ts)",
+    "ticket_msgs_ticket_id_created_at_idx": "ticket_msgs (ticket_id, created_at)",
+    "tickets_status_created_at_idx": "tickets (status, created_at)",
+    "tickets_closed_at_idx": "tickets (closed_at)",
+}
+
+
+def up(conn):
+    with conn.cursor() as cur:
+        for name, target in INDEXES.items():
+            # a CONCURRENTLY build that died part-way leaves an INVALID index that IF NOT EXISTS would skip
+            cur.execute(
+                "SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s",
+                (name,),
+            )
+            row = cur.fetchone()
+            if row and row[0]:
+                print(f"  dropping invalid index {name}")
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            print(f"  building {name} on {target}")
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {target}")
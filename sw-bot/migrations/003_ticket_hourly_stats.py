@@ -0,0 +1,122 @@
+"""
+Migration 003: hourly ticket rollup + tickets.last_msg_at
+ticket_hourly_stats answers count_tickets, avg_close_time and the daily alert. It is maintained by a
+trigger on tickets, so writes from sw-dash and manual SQL keep it right as well as the bot's own. Each
+insert / update / delete takes back the row's old contribution and adds its new one:
+  opened        - tickets created that hour (closed_by = '')
+  closed        - tickets currently closed whose closed_at falls in that hour, per closed_by
+  close_seconds - sum of (closed_at - created_at) over those same tickets
+last_msg_at is bumped by save_message and replaces the per-ticket MAX(ticket_msgs.created_at) subquery.
+The backfill runs under a lock that blocks ticket writes, so it lines up exactly with the trigger.
+"""
+
+
+def up(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ticket_hourly_stats (
+                hour          TIMESTAMPTZ NOT NULL,
+                closed_by     TEXT NOT NULL DEFAULT '',
+                opened        INTEGER NOT NULL DEFAULT 0,
+                closed        INTEGER NOT NULL DEFAULT 0,
+                close_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+                PRIMARY KEY (hour, closed_by)
+            )
+            """
+        )
+        cur.execute("ALTER TABLE tickets ADD COLUMN IF NOT EXISTS last_msg_at TIMESTAMPTZ DEFAULT NULL")
+        cur.execute(
+            """
+            UPDATE tickets t SET last_msg_at = m.last_msg_at
+            FROM (SELECT ticket_id, MAX(created_at) AS last_msg_at FROM ticket_msgs GROUP BY ticket_id) m
+            WHERE m.ticket_id = t.id
+            """
+        )
+        cur.execute(
+            """
+            CREATE OR REPLACE FUNCTION ticket_hourly_stats_add(
+                at TIMESTAMPTZ, closer TEXT, d_opened INTEGER, d_closed INTEGER, d_seconds DOUBLE PRECISION
+            ) RETURNS void AS $$
+                INSERT INTO ticket_hourly_stats (hour, closed_by, opened, closed, close_seconds)
+                VALUES (date_trunc('hour', COALESCE(at, NOW())), COALESCE(closer, ''), d_opened, d_closed, d_seconds)
+                ON CONFLICT (hour, closed_by) DO UPDATE SET
+                    opened = ticket_hourly_stats.opened + EXCLUDED.opened,
+                    closed = ticket_hourly_stats.closed + EXCLUDED.closed,
+                    close_seconds = ticket_hourly_stats.close_seconds + EXCLUDED.close_seconds
+            $$ LANGUAGE sql
+            """
+        )
+        cur.execute(
+            """
+            CREATE OR REPLACE FUNCTION roll_ticket_hourly_stats() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP <> 'INSERT' THEN
+                    IF TG_OP = 'DELETE' OR OLD.created_at IS DISTINCT FROM NEW.created_at THEN
+                        PERFORM ticket_hourly_stats_add(OLD.created_at, '', -1, 0, 0);
+                    END IF;
+                    IF OLD.status = 'closed' AND OLD.closed_at IS NOT NULL THEN
+                        PERFORM ticket_hourly_stats_add(OLD.closed_at, OLD.closed_by, 0, -1,
+                            -EXTRACT(EPOCH FROM (OLD.closed_at - OLD.created_at))::double precision);
+                    END IF;
+                END IF;
+                IF TG_OP <> 'DELETE' THEN
+                    IF TG_OP = 'INSERT' OR OLD.created_at IS DISTINCT FROM NEW.created_at THEN
+                        PERFORM ticket_hourly_stats_add(NEW.created_at, '', 1, 0, 0);
+                    END IF;
+                    IF NEW.status = 'closed' AND NEW.closed_at IS NOT NULL THEN
+                        PERFORM ticket_hourly_stats_add(NEW.closed_at, NEW.closed_by, 0, 1,
+                            EXTRACT(EPOCH FROM (NEW.closed_at - NEW.created_at))::double precision);
+                    END IF;
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """
+        )
+        # no ticket writes between the backfill and the trigger going live
+        cur.execute("LOCK TABLE tickets IN SHARE ROW EXCLUSIVE MODE")
+        cur.execute("DROP TRIGGER IF EXISTS tickets_roll_hourly_rows ON tickets")
+        cur.execute(
+            """
+            CREATE TRIGGER tickets_roll_hourly_rows
+            AFTER INSERT OR DELETE ON tickets
+            FOR EACH ROW
+            EXECUTE FUNCTION roll_ticket_hourly_stats()
+            """
+        )
+        cur.execute("DROP TRIGGER IF EXISTS tickets_roll_hourly_update ON tickets")
+        cur.execute(
+            """
+            CREATE TRIGGER tickets_roll_hourly_update
+            AFTER UPDATE OF status, closed_at, closed_by, created_at ON tickets
+            FOR EACH ROW
+            WHEN (OLD.status IS DISTINCT FROM NEW.status
+                  OR OLD.closed_at IS DISTINCT FROM NEW.closed_at
+                  OR OLD.closed_by IS DISTINCT FROM NEW.closed_by
+                  OR OLD.created_at IS DISTINCT FROM NEW.created_at)
+            EXECUTE FUNCTION roll_ticket_hourly_stats()
+            """
+        )
+        cur.execute("TRUNCATE ticket_hourly_stats")
+        cur.execute(
+            """
+            INSERT INTO ticket_hourly_stats (hour, closed_by, opened)
+            SELECT date_trunc('hour', created_at::timestamptz), '', COUNT(*)
+            FROM tickets
+            GROUP BY 1
+            """
+        )
+        cur.execute(
+            """
+            INSERT INTO ticket_hourly_stats (hour, closed_by, closed, close_seconds)
+            SELECT date_trunc('hour', closed_at::timestamptz), COALESCE(closed_by, ''),
+                   COUNT(*), SUM(EXTRACT(EPOCH FROM (closed_at - created_at)))
+            FROM tickets
+            WHERE status = 'closed' AND closed_at IS NOT NULL
+            GROUP BY 1, 2
+            ON CONFLICT (hour, closed_by) DO UPDATE SET
+                closed = EXCLUDED.closed,
+                close_seconds = EXCLUDED.close_seconds
+            """
+        )
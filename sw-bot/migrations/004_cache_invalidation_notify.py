@@ -0,0 +1,72 @@
+"""
+Migration 004: NOTIFY on ticket status / claim and opt-in changes
+sw-dash and other services write tickets and ticket_users directly. These triggers publish every status,
+closed_by and is_opted_in change on the sw_cache_invalidate channel, and db_listener applies them to the
+bot's cache in place. The payload carries the writer's application_name so the bot can skip its own writes.
+"""
+
+CHANNEL = "sw_cache_invalidate"
+
+
+def up(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            CREATE OR REPLACE FUNCTION notify_ticket_change() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('{CHANNEL}', json_build_object(
+                    'table', 'tickets',
+                    'id', NEW.id,
+                    'status', NEW.status,
+                    'closed_by', NEW.closed_by,
+                    'origin', current_setting('application_name', true)
+                )::text);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """
+        )
+        cur.execute(
+            f"""
+            CREATE OR REPLACE FUNCTION notify_ticket_user_change() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('{CHANNEL}', json_build_object(
+                    'table', 'ticket_users',
+                    'user_id', NEW.user_id,
+                    'is_opted_in', NEW.is_opted_in,
+                    'origin', current_setting('application_name', true)
+                )::text);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """
+        )
+        cur.execute("DROP TRIGGER IF EXISTS tickets_notify_change ON tickets")
+        cur.execute(
+            """
+            CREATE TRIGGER tickets_notify_change
+            AFTER UPDATE OF status, closed_by ON tickets
+            FOR EACH ROW
+            WHEN (OLD.status IS DISTINCT FROM NEW.status OR OLD.closed_by IS DISTINCT FROM NEW.closed_by)
+            EXECUTE FUNCTION notify_ticket_change()
+            """
+        )
+        cur.execute("DROP TRIGGER IF EXISTS ticket_users_notify_insert ON ticket_users")
+        cur.execute(
+            """
+            CREATE TRIGGER ticket_users_notify_insert
+            AFTER INSERT ON ticket_users
+            FOR EACH ROW
+            EXECUTE FUNCTION notify_ticket_user_change()
+            """
+        )
+        cur.execute("DROP TRIGGER IF EXISTS ticket_users_notify_update ON ticket_users")
+        cur.execute(
+            """
+            CREATE TRIGGER ticket_users_notify_update
+            AFTER UPDATE OF is_opted_in ON ticket_users
+            FOR EACH ROW
+            WHEN (OLD.is_opted_in IS DISTINCT FROM NEW.is_opted_in)
+            EXECUTE FUNCTION notify_ticket_user_change()
+            """
+        )
@@ -0,0 +1,144 @@
+"""
+Migration 005: partition ticket_msgs, add the archive tier and the ts routing table
+Rebuilds ticket_msgs as  ticket_msgs (LIST archived) -> ticket_msgs_live / ticket_msgs_archive (RANGE created_at,
+monthly); see Source/msg_partitions.py. Readers that go through ticket_msgs (transcripts by ticket_id) see both
+tiers unchanged. ticket_msg_routes maps every message_ts / origin_message_ts of a live message to its created_at,
+so db's lookups by ts read a single partition; db.archive_closed_ticket_msgs moves old closed tickets into the
+archive tier and drops their routes.
+Copies every row, so apply while the bot is stopped, right before deploying the code that reads ticket_msg_routes.
+"""
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Source"))
+
+import msg_partitions
+
+INDEXES = {
+    "ticket_msgs_origin_message_ts_idx": "(origin_message_ts)",
+    "ticket_msgs_message_ts_idx": "(message_ts)",
+    "ticket_msgs_ticket_id_created_at_idx": "(ticket_id, created_at)",
+}
+
+
+def up(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('ticket_msgs')")
+        if cur.fetchone()[0] == "p":
+            print("  ticket_msgs is already partitioned")
+            return
+
+        cur.execute("ALTER TABLE ticket_msgs RENAME TO ticket_msgs_legacy")
+        cur.execute(
+            """
+            SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = 'ticket_msgs_legacy'::regclass AND contype = 'f'
+            """
+        )
+        foreign_keys = cur.fetchall()
+        cur.execute(
+            """
+            SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+            WHERE attrelid = 'ticket_msgs_legacy'::regclass AND attname = 'created_at'
+            """
+        )
+        created_at_type = cur.fetchone()[0]
+        cur.execute(
+            """
+            UPDATE ticket_msgs_legacy m SET created_at = COALESCE(t.created_at, NOW())
+            FROM tickets t WHERE t.id = m.ticket_id AND m.created_at IS NULL
+            """
+        )
+
+        cur.execute(
+            """
+            CREATE TABLE ticket_msgs (
+                LIKE ticket_msgs_legacy INCLUDING DEFAULTS,
+                archived BOOLEAN NOT NULL DEFAULT FALSE
+            ) PARTITION BY LIST (archived)
+            """
+        )
+        cur.execute("ALTER TABLE ticket_msgs ALTER COLUMN created_at SET NOT NULL")
+        cur.execute(f"CREATE TABLE {msg_partitions.LIVE} PARTITION OF ticket_msgs FOR VALUES IN (FALSE) PARTITION BY RANGE (created_at)")
+        cur.execute(f"CREATE TABLE {msg_partitions.ARCHIVE} PARTITION OF ticket_msgs FOR VALUES IN (TRUE) PARTITION BY RANGE (created_at)")
+        cur.execute(f"CREATE TABLE {msg_partitions.LIVE}_default PARTITION OF {msg_partitions.LIVE} DEFAULT")
+        cur.execute(f"CREATE TABLE {msg_partitions.ARCHIVE}_default PARTITION OF {msg_partitions.ARCHIVE} DEFAULT")
+        msg_partitions.compress(cur, f"{msg_partitions.ARCHIVE}_default")
+        cur.execute("SELECT MIN(created_at)::date FROM ticket_msgs_legacy")
+        first = cur.fetchone()[0] or date.today()
+        created = msg_partitions.ensure(cur, first, date.today())
+        print(f"  created {len(created)} monthly partitions from {first:%Y-%m}")
+
+        # a fresh sequence: an identity column's sequence can't outlive the legacy table
+        cur.execute("CREATE SEQUENCE ticket_msgs_id_seq_new")
+        cur.execute("SELECT setval('ticket_msgs_id_seq_new', COALESCE((SELECT MAX(id) FROM ticket_msgs_legacy), 0) + 1, false)")
+        cur.execute("ALTER TABLE ticket_msgs ALTER COLUMN id SET DEFAULT nextval('ticket_msgs_id_seq_new')")
+
+        cur.execute("INSERT INTO ticket_msgs SELECT l.*, FALSE FROM ticket_msgs_legacy l")
+        copied = cur.rowcount
+        cur.execute("SELECT COUNT(*) FROM ticket_msgs_legacy")
+        if cur.fetchone()[0] != copied:
+            raise RuntimeError("ticket_msgs copy is short, aborting")
+        print(f"  copied {copied} messages")
+
+        cur.execute("DROP TABLE ticket_msgs_legacy")
+        cur.execute("ALTER SEQUENCE ticket_msgs_id_seq_new OWNED BY ticket_msgs.id")
+        cur.execute("SELECT to_regclass('ticket_msgs_id_seq') IS NULL")
+        if cur.fetchone()[0]:
+            cur.execute("ALTER SEQUENCE ticket_msgs_id_seq_new RENAME TO ticket_msgs_id_seq")
+        # after the drop, so the key and indexes get their old names back. A partitioned key has to include the
+        # partition columns, so this alone doesn't make id unique. id still is: every insert takes it from
+        # ticket_msgs_id_seq (neither the bot nor sw-dash's reply route writes an explicit id), and archiving is an
+        # UPDATE of `archived` that moves the row with its id. Anything that starts writing ids itself must keep it so.
+        cur.execute("ALTER TABLE ticket_msgs ADD PRIMARY KEY (id, archived, created_at)")
+        for name, definition in foreign_keys:
+            cur.execute(f"ALTER TABLE ticket_msgs ADD CONSTRAINT {name} {definition}")
+        for name, columns in INDEXES.items():
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ticket_msgs {columns}")
+
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS ticket_msg_routes (
+                ts         TEXT PRIMARY KEY,
+                created_at {created_at_type} NOT NULL
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE OR REPLACE FUNCTION route_ticket_msg() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO ticket_msg_routes (ts, created_at)
+                SELECT ts, NEW.created_at
+                FROM unnest(ARRAY[NEW.message_ts, NEW.origin_message_ts]) AS ts
+                WHERE ts IS NOT NULL
+                ON CONFLICT (ts) DO NOTHING;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """
+        )
+        cur.execute(
+            """
+            CREATE TRIGGER ticket_msgs_route
+            AFTER INSERT ON ticket_msgs
+            FOR EACH ROW
+            WHEN (NOT NEW.archived AND (NEW.message_ts IS NOT NULL OR NEW.origin_message_ts IS NOT NULL))
+            EXECUTE FUNCTION route_ticket_msg()
+            """
+        )
+        cur.execute(
+            """
+            INSERT INTO ticket_msg_routes (ts, created_at)
+            SELECT ts, created_at FROM (
+                SELECT message_ts AS ts, created_at FROM ticket_msgs WHERE message_ts IS NOT NULL
+                UNION ALL
+                SELECT origin_message_ts, created_at FROM ticket_msgs WHERE origin_message_ts IS NOT NULL
+            ) s
+            ON CONFLICT (ts) DO NOTHING
+            """
+        )
+        print(f"  routed {cur.rowcount} message timestamps (the first archive run trims closed tickets)")
+        cur.execute("ANALYZE ticket_msgs")
+        cur.execute("ANALYZE ticket_msg_routes")
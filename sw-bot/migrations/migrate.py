@@ -0,0 +1,114 @@
+"""
+Applies every migrations/NNN_*.py that isn't recorded in schema_migrations yet, in version order.
+Run: python migrations/migrate.py          (apply pending)
+     python migrations/migrate.py --status (list applied / pending)
+
+A migration module defines up(conn). It runs inside a transaction together with the schema_migrations
+insert, unless it sets TRANSACTIONAL = False (e.g. CREATE INDEX CONCURRENTLY); then it runs in autocommit
+and must be safe to re-run, since a failure half-way leaves it unrecorded.
+"""
+import importlib.util
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Source"))
+
+import psycopg2
+
+from globals import DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER
+
+MIGRATIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+FILE_PATTERN = re.compile(r"^(\d{3})_(\w+)\.py$")
+
+
+def discover() -> list[tuple[int, str, str]]:
+    found = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = FILE_PATTERN.match(filename)
+        if match:
+            found.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    found.sort()
+    versions = [v for v, _, _ in found]
+    if len(versions) != len(set(versions)):
+        sys.exit(f"duplicate migration versions in {MIGRATIONS_DIR}")
+    return found
+
+
+def load(version: int, path: str):
+    spec = importlib.util.spec_from_file_location(f"migration_{version:03d}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def connect():
+    return psycopg2.connect(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASSWORD, dbname=DB_NAME)
+
+
+def ensure_table(conn):
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version    INTEGER PRIMARY KEY,
+                name       TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+            """
+        )
+
+
+def applied_versions(conn) -> set[int]:
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cur.fetchall()}
+
+
+def record(cur, version: int, name: str):
+    cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+
+
+def apply(conn, version: int, name: str, module):
+    if getattr(module, "TRANSACTIONAL", True):
+        conn.autocommit = False
+        try:
+            module.up(conn)
+            with conn.cursor() as cur:
+                record(cur, version, name)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+    else:
+        module.up(conn)
+        with conn.cursor() as cur:
+            record(cur, version, name)
+
+
+def main():
+    conn = connect()
+    try:
+        ensure_table(conn)
+        done = applied_versions(conn)
+        pending = [(v, n, p) for v, n, p in discover() if v not in done]
+        if "--status" in sys.argv:
+            for version, name, _ in discover():
+                print(f"{version:03d} {name}: {'applied' if version in done else 'pending'}")
+            return
+        if not pending:
+            print("No pending migrations.")
+            return
+        for version, name, path in pending:
+            print(f"Applying {version:03d} {name}...")
+            apply(conn, version, name, load(version, path))
+            print(f"Applied {version:03d} {name}.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+import importlib
+import os
+import sys
+import tempfile
+
+# keep the journal and dead-letter files the modules open at import out of the working tree
+_tmp = tempfile.mkdtemp(prefix="sw-bot-tests-")
+os.environ.setdefault("TASK_JOURNAL_PATH", os.path.join(_tmp, "task_journal.jsonl"))
+os.environ.setdefault("DEAD_LETTER_PATH", os.path.join(_tmp, "dead_letter.jsonl"))
+os.environ.setdefault("CACHE_SNAPSHOT_PATH", os.path.join(_tmp, "cache_snapshot.bin"))
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Source"))
+
+# cache -> worker -> helpers -> cache is circular; loading worker first (as main does) resolves it
+importlib.import_module("worker")
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+import db
+from cache import Cache
+
+SLOW_DB_S = 0.3
+
+
+def _ticket(ticket_id):
+    return {
+        "id": ticket_id,
+        "user_id": "U1",
+        "user_name": "user",
+        "question": "q",
+        "user_thread_ts": f"100.{ticket_id}",
+        "staff_thread_ts": f"200.{ticket_id}",
+        "status": "open",
+        "closed_by": None,
+    }
+
+
+def test_concurrent_misses_load_once(monkeypatch):
+    calls = []
+
+    def slow_get_ticket(ticket_id):
+        calls.append(ticket_id)
+        time.sleep(SLOW_DB_S)
+        return _ticket(ticket_id)
+
+    monkeypatch.setattr(db, "get_ticket", slow_get_ticket)
+    c = Cache()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(c.get_ticket_by_id(7))) for _ in range(50)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls == [7]
+    assert len(results) == 50
+    assert all(r is results[0] and r["id"] == 7 for r in results)
+
+
+def test_slow_load_does_not_block_other_keys(monkeypatch):
+    release = threading.Event()
+    loading = threading.Event()
+
+    def stuck_get_ticket(ticket_id):
+        loading.set()
+        release.wait(5)
+        return _ticket(ticket_id)
+
+    monkeypatch.setattr(db, "get_ticket", stuck_get_ticket)
+    monkeypatch.setattr(db, "get_ticket_user", lambda user_id: {"is_opted_in": False})
+    monkeypatch.setattr(db, "find_ticket", lambda ts: None)
+    c = Cache()
+    c.ticket_data_saver(_ticket(2))
+    slow = threading.Thread(target=c.get_ticket_by_id, args=(1,))
+    slow.start()
+    try:
+        assert loading.wait(5)
+        started = time.monotonic()
+        # a cached ticket and misses on other keys all go through while ticket 1 is loading
+        assert c.get_ticket_by_id(2)["id"] == 2
+        assert c.find_ticket_by_ts("200.2")["id"] == 2
+        assert c.get_user_opt_in("U9") is False
+        assert c.find_ticket_by_ts("999.1") is None
+        assert time.monotonic() - started < SLOW_DB_S
+        assert slow.is_alive()
+    finally:
+        release.set()
+        slow.join()
+    assert c.get_ticket_by_id(1)["id"] == 1
+
+
+def test_failed_load_is_not_cached(monkeypatch):
+    attempts = []
+
+    def flaky_get_ticket(ticket_id):
+        attempts.append(ticket_id)
+        if len(attempts) == 1:
+            raise RuntimeError("db down")
+        return _ticket(ticket_id)
+
+    monkeypatch.setattr(db, "get_ticket", flaky_get_ticket)
+    c = Cache()
+    with pytest.raises(RuntimeError):
+        c.get_ticket_by_id(3)
+    assert c.get_ticket_by_id(3)["id"] == 3
+    assert attempts == [3, 3]
@@ -0,0 +1,38 @@
+import pickle
+
+import cache_store
+from cache import Cache
+
+
+def _ticket(i, **extra):
+    return {"id": i, "user_id": f"U{i}", "user_name": f"user {i}", "question": "how do I ship?",
+            "user_thread_ts": f"1700000000.{i:06d}", "staff_thread_ts": f"1700000001.{i:06d}", "status": "open",
+            "closed_by": None, **extra}
+
+
+def test_corrupt_snapshot_starts_cold_instead_of_raising(monkeypatch, tmp_path):
+    path = tmp_path / "cache_snapshot.bin"
+    monkeypatch.setattr(cache_store, "CACHE_SNAPSHOT_PATH", str(path))
+    monkeypatch.setattr(cache_store, "CACHE_DELTA_PATH", str(tmp_path / "cache_delta.bin"))
+    # a pickle that unpickles fine but has the wrong shape, so restore() fails partway through
+    path.write_bytes(cache_store.HEADER.pack(cache_store.MAGIC, cache_store.VERSION, 1)
+                     + pickle.dumps({"tickets": {1: _ticket(1)}, "ticket_users": None}))
+
+    c = Cache()
+    cache_store.load(c)
+
+    assert c.tickets == {} and c.ticket_users == {} and c.thread_index == {}
+
+
+def test_unpicklable_value_requeues_the_dirty_keys(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache_store, "CACHE_SNAPSHOT_PATH", str(tmp_path / "cache_snapshot.bin"))
+    monkeypatch.setattr(cache_store, "CACHE_DELTA_PATH", str(tmp_path / "cache_delta.bin"))
+    c = Cache()
+    c.ticket_data_saver(_ticket(1, question=lambda: None))
+
+    cache_store.save(c)
+    assert ("tickets", 1) in c._dirty
+
+    monkeypatch.setattr(cache_store, "_generation", 1)
+    cache_store.save_delta(c)
+    assert ("tickets", 1) in c._dirty
@@ -0,0 +1,173 @@
+from time import monotonic
+
+import psycopg2
+import pytest
+
+import db
+
+
+class FakeConn:
+    def __init__(self, commit_error=None, rollback_error=None, dead=False):
+        self.closed = 0
+        self.dead = dead
+        self.commit_error = commit_error
+        self.rollback_error = rollback_error
+        self.committed = False
+
+    def commit(self):
+        if self.commit_error:
+            self.closed = 2
+            raise self.commit_error
+        self.committed = True
+
+    def rollback(self):
+        if self.rollback_error:
+            raise self.rollback_error
+
+    def close(self):
+        self.closed = 1
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, vars=None):
+        if self.dead:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+
+class FakePool:
+    def __init__(self):
+        self.idle = []
+        self.returned = []
+
+    def getconn(self):
+        return self.idle.pop()
+
+    def putconn(self, conn, close=False):
+        if getattr(conn, "origin_pool", None) is not self:
+            raise psycopg2.pool.PoolError("trying to put unkeyed connection")
+        self.returned.append((conn, close))
+
+    def closeall(self):
+        for conn, _ in self.returned:
+            conn.close()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    fake = FakePool()
+    monkeypatch.setattr(db, "connection_pool", fake)
+    monkeypatch.setattr(db, "_new_pool", FakePool)
+    monkeypatch.setattr(db, "_pool_created", monotonic())  # fresh connections skip validation
+    db.take_last_error()
+    yield fake
+    assert db.pool_stats()["in_use"] == 0
+    assert db._gate.readers == db._gate.writers == 0
+
+
+def _checkout(pool, conn):
+    pool.idle.append(conn)
+    assert db._acquire_conn() is conn
+    return conn
+
+
+def test_failed_commit_is_ambiguous_and_not_retryable(pool):
+    conn = _checkout(pool, FakeConn(commit_error=psycopg2.OperationalError("server closed the connection unexpectedly")))
+    db._release_conn(conn, success=True)
+
+    error = db.take_last_error()
+    assert isinstance(error, db.CommitOutcomeUnknown)
+    assert not db.is_retryable(error)
+    assert pool.returned == [(conn, True)]
+
+
+def test_failed_rollback_keeps_its_error(pool):
+    conn = _checkout(pool, FakeConn(rollback_error=psycopg2.InterfaceError("connection already closed")))
+    db._release_conn(conn, success=False)
+
+    assert isinstance(db.take_last_error(), psycopg2.InterfaceError)
+
+
+def test_rebuilt_pool_connection_is_validated(pool, monkeypatch):
+    monkeypatch.setattr(db, "DB_VALIDATE_IDLE_S", 0)
+    pool.idle.extend(FakeConn(dead=True) for _ in range(3))
+    rebuilt = FakePool()
+    rebuilt.idle.append(FakeConn(dead=True))
+    monkeypatch.setattr(db, "_new_pool", lambda: rebuilt)
+
+    with pytest.raises(psycopg2.OperationalError, match="after rebuilding the pool"):
+        db._acquire_conn()
+    assert [close for _, close in rebuilt.returned] == [True]
+
+
+def test_failed_rebuild_keeps_the_old_pool_until_the_server_is_back(pool, monkeypatch):
+    monkeypatch.setattr(db, "DB_VALIDATE_IDLE_S", 0)
+
+    def server_down():
+        raise psycopg2.OperationalError("could not connect to server")
+
+    monkeypatch.setattr(db, "_new_pool", server_down)
+    pool.idle.extend(FakeConn(dead=True) for _ in range(3))
+    with pytest.raises(psycopg2.OperationalError, match="could not connect"):
+        db._acquire_conn()
+    assert db.connection_pool is pool
+
+    rebuilt = FakePool()
+    rebuilt.idle.append(FakeConn())
+    monkeypatch.setattr(db, "_new_pool", lambda: rebuilt)
+    pool.idle.extend(FakeConn(dead=True) for _ in range(3))
+    conn = db._acquire_conn()
+    assert db.connection_pool is rebuilt
+    db._release_conn(conn, success=True)
+    assert rebuilt.returned == [(conn, False)]
+
+
+def test_rebuild_of_an_already_replaced_pool_is_skipped(pool):
+    before = db.pool_stats()["rebuilds"]
+    db._rebuild_pool(pool)
+    rebuilt = db.connection_pool
+    db._rebuild_pool(pool)  # a second thread that also saw `pool` fail
+    assert db.connection_pool is rebuilt
+    assert db.pool_stats()["rebuilds"] - before == 1
+
+
+def test_pool_errors_are_retryable():
+    assert db.is_retryable(psycopg2.pool.PoolError("connection pool is closed"))
+
+
+def test_connection_from_a_replaced_pool_is_closed_not_returned(pool):
+    conn = _checkout(pool, FakeConn())
+    db._rebuild_pool(pool)
+    db._release_conn(conn, success=True)
+
+    assert conn.closed
+    assert db.connection_pool.returned == []
+
+
+def test_get_db_releases_once_when_putconn_fails(pool, monkeypatch):
+    pool.idle.append(FakeConn())
+
+    def broken_putconn(conn, close=False):
+        raise psycopg2.pool.PoolError("pool is closed")
+
+    monkeypatch.setattr(pool, "putconn", broken_putconn)
+    with pytest.raises(psycopg2.pool.PoolError):
+        with db.get_db():
+            pass
+
+
+def test_get_db_reports_metrics_under_the_decorated_function(pool):
+    pool.idle.extend([FakeConn(), FakeConn()])
+
+    @db.retry_dead_conn
+    def lookup_for_metrics():
+        with db.get_db():
+            pass
+
+    lookup_for_metrics()
+    with db.get_db("named_for_metrics"):
+        pass
+
+    functions = db.query_metrics.snapshot()["functions"]
+    assert functions["lookup_for_metrics"]["calls"] == 1
+    assert functions["named_for_metrics"]["calls"] == 1
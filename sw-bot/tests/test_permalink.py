@@ -0,0 +1,30 @@
+import helpers
+
+
+class FlakyClient:
+    def __init__(self):
+        self.auth_calls = 0
+
+    def auth_test(self):
+        self.auth_calls += 1
+        raise RuntimeError("slack is down")
+
+    def chat_getPermalink(self, channel, message_ts):
+        return {"permalink": f"https://example.slack.com/archives/{channel}/p{message_ts.replace('.', '')}"}
+
+
+def test_failed_auth_test_is_not_retried_until_the_backoff_passes(monkeypatch):
+    client = FlakyClient()
+    clock = [1000.0]
+    monkeypatch.setattr(helpers, "client", client)
+    monkeypatch.setattr(helpers, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(helpers, "_workspace_retry_at", 0.0)
+    monkeypatch.setattr(helpers.cache, "workspace_url", None)
+
+    for _ in range(3):
+        assert helpers.permalink("C123", "1700000000.000100").endswith("/archives/C123/p1700000000000100")
+    assert client.auth_calls == 1
+
+    clock[0] += helpers.WORKSPACE_URL_RETRY_S
+    helpers.permalink("C123", "1700000000.000100")
+    assert client.auth_calls == 2
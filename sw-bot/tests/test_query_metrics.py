@@ -0,0 +1,17 @@
+import query_metrics
+
+
+def test_slow_query_log_keeps_the_param_count_not_the_values(monkeypatch, caplog):
+    monkeypatch.setattr(query_metrics, "DB_SLOW_QUERY_MS", 0)
+    query_metrics.statement("INSERT INTO ticket_msgs (msg) VALUES (%s)", ("my password is hunter2",), 0.5, 1)
+
+    record = query_metrics.snapshot()["slow_queries"][-1]
+    assert record["param_count"] == 1
+    assert "hunter2" not in str(record) and "hunter2" not in caplog.text
+
+
+def test_monotonic_pool_stats_are_exported_as_counters():
+    text = query_metrics.render_prometheus({"checkouts": 7, "in_use": 2}, counters=("checkouts",))
+
+    assert "# TYPE swbot_db_pool_checkouts_total counter\nswbot_db_pool_checkouts_total 7" in text
+    assert "# TYPE swbot_db_pool_in_use gauge\nswbot_db_pool_in_use 2" in text
@@ -0,0 +1,59 @@
+import pytest
+from slack_sdk.errors import SlackApiError
+
+import slack_queue
+
+
+class FakeResponse(dict):
+    def __init__(self, status_code, error):
+        super().__init__(ok=False, error=error)
+        self.status_code = status_code
+        self.headers = {}
+
+
+class FakeClient:
+    def __init__(self, *failures):
+        self.failures = list(failures)
+        self.calls = 0
+
+    def reactions_add(self, **kwargs):
+        self.calls += 1
+        if self.failures:
+            status_code, error = self.failures.pop(0)
+            raise SlackApiError(error, FakeResponse(status_code, error))
+
+
+@pytest.fixture
+def dispatcher(monkeypatch):
+    dead = []
+    monkeypatch.setattr(slack_queue.time, "sleep", lambda s: None)
+    monkeypatch.setattr(slack_queue, "TASK_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(slack_queue.dead_letter, "add", lambda *args: dead.append(args))
+    d = slack_queue.TierDispatcher("tier3")
+    d.dead = dead
+    return d
+
+
+def test_permanent_error_is_dropped_without_retry(dispatcher, monkeypatch):
+    client = FakeClient((200, "already_reacted"))
+    monkeypatch.setattr(slack_queue, "client", client)
+    dispatcher._send("t1", "reactions_add", {"name": "white_check_mark"})
+
+    assert client.calls == 1 and dispatcher.failed == 1 and dispatcher.dead == []
+
+
+def test_transient_error_is_retried(dispatcher, monkeypatch):
+    client = FakeClient((500, "internal_error"), (200, "fatal_error"))
+    monkeypatch.setattr(slack_queue, "client", client)
+    dispatcher._send("t1", "reactions_add", {"name": "white_check_mark"})
+
+    assert client.calls == 3 and dispatcher.sent == 1 and dispatcher.dead == []
+
+
+def test_transient_error_is_dead_lettered_after_the_last_attempt(dispatcher, monkeypatch):
+    client = FakeClient(*[(503, "service_unavailable")] * 3)
+    monkeypatch.setattr(slack_queue, "client", client)
+    dispatcher._send("t1", "reactions_add", {"name": "white_check_mark"})
+
+    assert client.calls == 3 and dispatcher.failed == 1
+    assert [(task_id, fn, attempts) for task_id, fn, _, _, _, attempts in dispatcher.dead] == [("t1", "slack.reactions_add", 3)]
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import psycopg2
+import pytest
+
+import worker
+
+
+@pytest.fixture
+def shard(monkeypatch):
+    monkeypatch.setattr(worker, "TASK_RETRY_BASE_MS", 20)
+    monkeypatch.setattr(worker, "TASK_RETRY_MAX_MS", 50)
+    monkeypatch.setattr(worker, "SAVE_BATCH_LINGER_MS", 20)
+    shard = worker.WriteShard(0)
+    monkeypatch.setattr(worker, "shards", [shard])
+    monkeypatch.setattr(worker, "WRITE_WORKERS", 1)
+    threading.Thread(target=shard.run, daemon=True).start()
+    threading.Thread(target=worker.retry_loop, daemon=True).start()
+    return shard
+
+
+def _db_fn(name, body):
+    body.__name__ = name
+    body.__module__ = "db"
+    return body
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_retry_keeps_ticket_order(shard):
+    ran = []
+    failures = [psycopg2.OperationalError("connection reset")]
+
+    def close(ticket_id):
+        if failures:
+            raise failures.pop()
+        ran.append(("close", ticket_id))
+
+    close_ticket = _db_fn("close_ticket", close)
+    open_ticket = _db_fn("open_ticket", lambda ticket_id: ran.append(("open", ticket_id)))
+    claim_ticket = _db_fn("claim_ticket", lambda ticket_id, claimer: ran.append(("claim", ticket_id)))
+
+    worker.enqueue(close_ticket, 5)
+    worker.enqueue(open_ticket, 5)
+    worker.enqueue(claim_ticket, 5, "U1")
+    worker.enqueue(open_ticket, 6)
+    _wait_for(lambda: len(ran) == 4 and not shard.parked)
+
+    assert [r for r in ran if r[1] == 5] == [("close", 5), ("open", 5), ("claim", 5)]
+    assert ran[0] == ("open", 6)  # other tickets aren't held up by the retry
+
+
+def test_batch_fallback_retry_keeps_message_order(shard, monkeypatch):
+    saved = []
+    failures = [psycopg2.OperationalError("connection reset")]
+
+    def save(ticket_id, msg):
+        if msg == "m1" and failures:
+            raise failures.pop()
+        saved.append(msg)
+
+    save_message = _db_fn("save_message", save)
+    monkeypatch.setitem(worker.BATCHERS, save_message, lambda calls: False)
+    for i in range(1, 6):
+        worker.enqueue(save_message, 5, f"m{i}")
+    _wait_for(lambda: len(saved) == 5 and not shard.parked)
+
+    assert saved == ["m1", "m2", "m3", "m4", "m5"]
+
+
+def test_permanent_error_is_dead_lettered_without_retrying(shard, monkeypatch):
+    dead = []
+    monkeypatch.setattr(worker.dead_letter, "add", lambda task_id, fn_name, *rest: dead.append(fn_name))
+    ran = []
+    attempts = []
+
+    def close(ticket_id):
+        attempts.append(ticket_id)
+        raise TypeError("bad replayed args")
+
+    close_ticket = _db_fn("close_ticket", close)
+    open_ticket = _db_fn("open_ticket", lambda ticket_id: ran.append(ticket_id))
+    worker.enqueue(close_ticket, 7)
+    worker.enqueue(open_ticket, 7)
+    _wait_for(lambda: ran == [7])
+
+    assert attempts == [7]
+    assert dead == ["db.close_ticket"]
+    assert not shard.parked